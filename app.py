@@ -1,11 +1,18 @@
 import os
+import time
+import threading
+from collections import namedtuple, OrderedDict
 from dotenv import load_dotenv
-from flask import Flask
+from flask import Flask, g
 from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager
+from flask_login import LoginManager, current_user
+from logs import setup_logging, get_logger, sample_request
+from metrics import REQUEST_SECONDS
+from profiling import ProfileRun, request_trigger, PROFILE_HEADER
 
 # Flask app and config
 load_dotenv()
+setup_logging()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'devsecretkey')
 
@@ -46,16 +53,25 @@ class User(db.Model, UserMixin):
     created_at = db.Column(db.DateTime, default=datetime.now)  # Use local time instead of UTC
     is_admin = db.Column(db.Boolean, default=False)
     is_super_admin = db.Column(db.Boolean, default=False)  # New field for super admin protection
+    video_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # kept by stats.py
     
     # Relationship with videos
     videos = db.relationship('Video', backref='user', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_user_created_at', 'created_at'),
+        db.Index('ix_user_video_count', 'video_count'),
+    )
+
 class Video(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(255), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     cloudinary_public_id = db.Column(db.String(255), nullable=True)
     cloudinary_url = db.Column(db.Text, nullable=True)
+    preview_url = db.Column(db.Text, nullable=True)  # low-res preview shown until the full render is ready
+    poster_url = db.Column(db.Text, nullable=True)  # poster frame for gallery cards (see thumbnails.py)
+    thumbnail_url = db.Column(db.Text, nullable=True)
     description = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(50), default='processing')
     created_at = db.Column(db.DateTime, default=datetime.now)  # Use local time
@@ -64,9 +80,127 @@ class Video(db.Model):
     size = db.Column(db.Integer, nullable=True)
     format = db.Column(db.String(10), nullable=True)
 
+    # Render jobs queued for this video (removed together with the video)
+    jobs = db.relationship('RenderJob', backref='video', lazy=True, cascade='all, delete-orphan')
+
+    # Also created on existing databases by migrations.py
+    __table_args__ = (
+        db.Index('ux_video_uuid', 'uuid', unique=True),
+        db.Index('ix_video_status_created_at', 'status', 'created_at'),
+        db.Index('ix_video_user_created_at', 'user_id', 'created_at'),
+        db.Index('ix_video_created_at', 'created_at'),
+    )
+
+class RenderJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, failed
+    attempts = db.Column(db.Integer, default=0)
+    encoding_profile = db.Column(db.String(20), nullable=True)  # see encoding_profiles.py
+    worker_id = db.Column(db.String(100), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    stage = db.Column(db.String(20), nullable=True)  # tts, normalize, preview, encode, poster, upload
+    progress = db.Column(db.Float, default=0.0)  # percent complete of the current stage
+    eta_seconds = db.Column(db.Float, nullable=True)
+    stage_timings = db.Column(db.Text, nullable=True)  # JSON {stage: seconds}
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # last progress report of the running worker
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_render_job_status_created_at', 'status', 'created_at'),
+        db.Index('ix_render_job_video_id', 'video_id'),
+    )
+
+class DailyStats(db.Model):
+    """Per-day rollup of users and videos by creation day (maintained by stats.py)"""
+    __tablename__ = 'daily_stats'
+    day = db.Column(db.Date, primary_key=True)
+    users = db.Column(db.Integer, default=0, nullable=False)
+    admins = db.Column(db.Integer, default=0, nullable=False)
+    videos = db.Column(db.Integer, default=0, nullable=False)
+    completed = db.Column(db.Integer, default=0, nullable=False)
+    processing = db.Column(db.Integer, default=0, nullable=False)
+    failed = db.Column(db.Integer, default=0, nullable=False)
+
+class ProfilingSettings(db.Model):
+    """The admin switch for sampled profiling, a single row with id 1 (see profiling.py)"""
+    __tablename__ = 'profiling_settings'
+    id = db.Column(db.Integer, primary_key=True)
+    request_rate = db.Column(db.Float, default=0.0, nullable=False)  # fraction of requests profiled
+    job_rate = db.Column(db.Float, default=0.0, nullable=False)  # fraction of render jobs profiled
+    endpoints = db.Column(db.String(500), nullable=True)  # comma-separated; empty means all
+    enabled_until = db.Column(db.DateTime, nullable=True)
+    updated_by = db.Column(db.String(150), nullable=True)
+
+class Profile(db.Model):
+    """cProfile statistics and SQL timings of one request or render job"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # request, job
+    name = db.Column(db.String(200), nullable=False)  # endpoint or video folder
+    detail = db.Column(db.String(500), nullable=True)  # method and path, or job id
+    trigger = db.Column(db.String(10), nullable=False)  # sample, header
+    status_code = db.Column(db.Integer, nullable=True)
+    duration_ms = db.Column(db.Float, nullable=False)
+    sql_count = db.Column(db.Integer, nullable=False)
+    sql_ms = db.Column(db.Float, nullable=False)
+    stats = db.Column(db.Text, nullable=False)  # top functions by cumulative time
+    sql = db.Column(db.Text, nullable=False)  # JSON [{sql, count, ms}], slowest first
+    data = db.Column(db.LargeBinary, nullable=False)  # marshalled pstats, served as a .prof file
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+class MetricsSnapshot(db.Model):
+    """Latest metric values of one web or worker process (written by metrics.py)"""
+    __tablename__ = 'metrics_snapshot'
+    process = db.Column(db.String(120), primary_key=True)  # host:pid:start time
+    data = db.Column(db.Text, nullable=False)  # JSON {metric: [[labels, value], ...]}
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+# --- Logged-in user cache ---
+# load_user() runs on every authenticated request. Users are cached per
+# process for USER_CACHE_TTL seconds as SessionUser records (plain immutable
+# values, safe to share between requests and threads). The admin routes and
+# UserModelView call forget_user() after changing a user; other processes
+# pick the change up when their entry expires.
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+USER_CACHE_SIZE = 4096
+
+class SessionUser(namedtuple('SessionUser', 'id username email is_admin is_super_admin'), UserMixin):
+    """What current_user needs of a User, detached from any session"""
+    __slots__ = ()
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, bool(user.is_admin), bool(user.is_super_admin))
+
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+def forget_user(user_id):
+    """Drop a user from this process's login cache (after an edit, admin toggle or delete)"""
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+        if cached and now < cached[0]:
+            _user_cache.move_to_end(user_id)
+            return cached[1]
+    
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    record = SessionUser.from_user(user)
+    with _user_cache_lock:
+        _user_cache[user_id] = (now + USER_CACHE_TTL, record)
+        if len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return record
 
 # Import routes after model definition to avoid circular import
 
@@ -121,6 +255,13 @@ class UserModelView(SecureModelView):
             'placeholder': 'Leave blank to keep current password'
         }
     }
+    
+    # Keep logged-in sessions in step with edits made here
+    def after_model_change(self, form, model, is_created):
+        forget_user(model.id)
+    
+    def after_model_delete(self, model):
+        forget_user(model.id)
 
 class VideoModelView(SecureModelView):
     # Video-specific configurations
@@ -143,6 +284,28 @@ class VideoModelView(SecureModelView):
     
     # Form configurations - removed 'user' field since it doesn't exist
     form_columns = ['user_id', 'description', 'status', 'cloudinary_url']
+    
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        """Exact video id, or indexed full-text search on descriptions ranked by relevance"""
+        # Import here to avoid circular imports
+        from flask import request
+        from search import search_videos
+        search = search.strip()
+        if not search:
+            return query, count_query, joins, count_joins
+        
+        if db.session.query(Video.id).filter_by(uuid=search).first():
+            query = query.filter(Video.uuid == search)
+            if count_query is not None:
+                count_query = count_query.filter(Video.uuid == search)
+            return query, count_query, joins, count_joins
+        
+        query, score = search_videos(query, search)
+        if not request.args.get('sort'):
+            query = query.order_by(score.desc())
+        if count_query is not None:
+            count_query, _ = search_videos(count_query, search)
+        return query, count_query, joins, count_joins
 
 # Initialize admin with custom base template
 admin = Admin(
@@ -156,19 +319,70 @@ admin = Admin(
 admin.add_view(UserModelView(User, db.session, name='Users', category='Management'))
 admin.add_view(VideoModelView(Video, db.session, name='Videos', category='Management'))
 
+# Registers the dashboard rollup hooks in web and worker processes alike
+import stats
 from main import *
 
-# Add request logging
+# Request logging: one record per request when it completes, sampled per
+# endpoint (LOG_SAMPLE_RATES) so static and media requests stay cheap.
+# Every request is also timed into the latency histogram of /metrics.
+log = get_logger('app')
+
 @app.before_request
-def log_request_info():
-    print(f"[REQUEST] {request.method} {request.url} from {request.remote_addr}")
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Sampled or X-Profile profiling (profiling.py); a cached check while it is off
+    trigger = request_trigger(request.endpoint, request.headers.get(PROFILE_HEADER),
+                              lambda: current_user.is_authenticated and current_user.is_admin)
+    if trigger:
+        g.profile = ProfileRun('request', request.endpoint or 'none', f"{request.method} {request.full_path}",
+                               trigger).start()
+
+@app.after_request
+def log_request_info(response):
+    started = g.get('request_started')
+    elapsed = time.perf_counter() - started if started else None
+    if elapsed is not None:
+        REQUEST_SECONDS.observe(elapsed, endpoint=request.endpoint or 'none', method=request.method,
+                                status=response.status_code)
+    if sample_request(request.endpoint, response.status_code):
+        log.info("%s %s %s", request.method, request.path, response.status_code,
+                 endpoint=request.endpoint, remote=request.remote_addr,
+                 duration_ms=round(elapsed * 1000, 1) if elapsed is not None else None)
+    run = g.pop('profile', None)
+    if run:
+        run.stop()
+        try:
+            profile_id = run.save(response.status_code)
+            if run.trigger == 'header':
+                response.headers['X-Profile-Id'] = str(profile_id)
+        except Exception as e:
+            log.warning("Could not save request profile", endpoint=request.endpoint, error=str(e))
+    return response
+
+@app.teardown_request
+def stop_unfinished_profile(exc):
+    # A request that failed before after_request must not leave the profiler running
+    run = g.pop('profile', None)
+    if run:
+        run.stop()
 
 def init_app():
-    """Initialize database and create admin user"""
+    """
+    Initialize database and create admin user.
+
+    Raises:
+        SchemaOutOfDate: If the tables still lack model columns after migrating;
+            the app must not start against them
+    """
+    from migrations import run_migrations, SchemaOutOfDate
     with app.app_context():
         try:
             db.create_all()
             
+            # Bring existing databases up to the current schema (indexes, new columns)
+            run_migrations()
+            
             # Create admin user if doesn't exist
             admin_user = User.query.filter_by(username='admin').first()
             if not admin_user:
@@ -183,27 +397,34 @@ def init_app():
                 )
                 db.session.add(admin_user)
                 db.session.commit()
-                print("[INFO] Super Admin user created (username: admin, password: admin123)")
+                log.info("Super Admin user created (username: admin, password: admin123)")
             else:
                 # If admin exists but isn't marked as super admin, mark them
                 if not admin_user.is_super_admin:
                     admin_user.is_super_admin = True
                     db.session.commit()
-                    print("[INFO] Existing admin user marked as super admin")
+                    log.info("Existing admin user marked as super admin")
             
-            print("[INFO] Database initialization successful")
+            log.info("Database initialization successful")
             return True
+        except SchemaOutOfDate:
+            log.exception("Database schema is out of date")
+            raise
         except Exception as e:
-            print(f"[ERROR] Database initialization failed: {e}")
+            log.exception("Database initialization failed")
             return False
 
 # Initialize database on startup (works with both Flask dev server and Gunicorn)
+from migrations import SchemaOutOfDate  # imports the models above
+
 try:
     init_app()
+except SchemaOutOfDate:
+    raise
 except Exception as e:
-    print(f"[WARNING] Database initialization had an issue: {e}")
-    print("[INFO] App will continue running, database might need manual setup")
+    log.warning("Database initialization had an issue, the app will continue running "
+                "but the database might need manual setup", error=str(e))
 
 if __name__ == '__main__':
-    print("[INFO] Starting Flask application on http://127.0.0.1:5000")
+    log.info("Starting Flask application on http://127.0.0.1:5000")
     app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
@@ -0,0 +1,100 @@
+"""
+Named libx264 encoding profiles for reels.
+
+Reels are slideshows of still images, so every profile uses -tune stillimage,
+a low output frame rate and a long keyframe interval: a 3 second slide then
+costs a handful of nearly free P-frames instead of 75 full frames.
+
+The deployment default comes from ENCODING_PROFILE; a job can pick another
+profile by name (RenderJob.encoding_profile).
+"""
+import os
+
+from logs import get_logger
+
+log = get_logger(__name__)
+
+ENCODING_PROFILES = {
+    # Quick turnaround, visibly softer
+    'draft': {
+        'preset': 'ultrafast',
+        'crf': 30,
+        'tune': 'stillimage',
+        'fps': 10,
+        'keyint_seconds': 10,
+        'threads': 2,
+    },
+    # Default for published reels
+    'standard': {
+        'preset': 'veryfast',
+        'crf': 23,
+        'tune': 'stillimage',
+        'fps': 15,
+        'keyint_seconds': 6,
+        'threads': 2,
+    },
+    # Best quality per byte, for reels we keep long-term
+    'archive': {
+        'preset': 'slow',
+        'crf': 18,
+        'tune': 'stillimage',
+        'fps': 24,
+        'keyint_seconds': 4,
+        'threads': 4,
+    },
+}
+
+# Throwaway low-resolution render shown in the gallery while the full render runs
+PREVIEW_PROFILE = {
+    'preset': 'ultrafast',
+    'crf': 32,
+    'tune': 'stillimage',
+    'fps': 5,
+    'keyint_seconds': 10,
+    'threads': 1,
+}
+PREVIEW_HEIGHT = int(os.environ.get('PREVIEW_HEIGHT', 360))
+
+DEFAULT_ENCODING_PROFILE = os.environ.get('ENCODING_PROFILE', 'standard')
+if DEFAULT_ENCODING_PROFILE not in ENCODING_PROFILES:
+    log.warning("Unknown ENCODING_PROFILE, using 'standard'", profile=DEFAULT_ENCODING_PROFILE)
+    DEFAULT_ENCODING_PROFILE = 'standard'
+
+# Overrides the per-profile thread count, e.g. to match cores / RENDER_WORKERS
+FFMPEG_THREADS = int(os.environ.get('FFMPEG_THREADS', 0))
+
+
+def resolve_profile_name(name=None):
+    """Return name if it is a known profile, otherwise the deployment default"""
+    if name in ENCODING_PROFILES:
+        return name
+    if name:
+        log.warning("Unknown encoding profile, using the default", profile=name, default=DEFAULT_ENCODING_PROFILE)
+    return DEFAULT_ENCODING_PROFILE
+
+
+def get_profile(name=None):
+    return ENCODING_PROFILES[resolve_profile_name(name)]
+
+
+def _encoder_args(profile, threads=None):
+    return [
+        '-c:v', 'libx264',
+        '-preset', profile['preset'],
+        '-tune', profile['tune'],
+        '-crf', str(profile['crf']),
+        '-r', str(profile['fps']),
+        '-g', str(profile['fps'] * profile['keyint_seconds']),
+        '-threads', str(threads or profile['threads']),
+        '-pix_fmt', 'yuv420p',
+    ]
+
+
+def video_encoder_args(name=None):
+    """ffmpeg output arguments for the video stream of the given profile"""
+    return _encoder_args(get_profile(name), FFMPEG_THREADS)
+
+
+def preview_encoder_args():
+    """ffmpeg output arguments for the low-resolution preview render"""
+    return ['-vf', f"scale=-2:{PREVIEW_HEIGHT}"] + _encoder_args(PREVIEW_PROFILE)
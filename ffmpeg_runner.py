@@ -0,0 +1,160 @@
+"""
+Run ffmpeg with machine-readable progress.
+
+ffmpeg is started with "-progress pipe:1 -nostats", so it writes key=value
+blocks to stdout while it encodes. Each block ends with "progress=continue" or
+"progress=end", and run_ffmpeg() turns every block into an
+on_progress(percent, eta_seconds) call. stderr is drained on a background
+thread into a bounded buffer, so a chatty encode can neither deadlock the pipe
+nor grow memory without limit.
+
+A ProgressTracker combines the progress of several runs (a preview, many
+segment encodes in parallel, a concat) into one percent and ETA for the job.
+
+Every run is recorded in the ffmpeg wall and CPU time histograms of
+metrics.py under its pipeline step.
+"""
+import os
+import time
+import threading
+import subprocess
+from collections import deque
+
+from metrics import FFMPEG_SECONDS, FFMPEG_CPU_SECONDS
+
+STDERR_TAIL_LINES = 200
+
+
+def parse_progress_block(lines):
+    """Turn the key=value lines of one progress block into a dict"""
+    values = {}
+    for line in lines:
+        key, sep, value = line.strip().partition('=')
+        if sep:
+            values[key] = value
+    return values
+
+
+def out_time_seconds(values):
+    """Encoded output position in seconds, or None if the block has none"""
+    # out_time_ms is (despite its name) in microseconds, like out_time_us
+    for key in ('out_time_us', 'out_time_ms'):
+        value = values.get(key)
+        if value and value.lstrip('-').isdigit():
+            return max(int(value), 0) / 1_000_000
+    return None
+
+
+class ProgressTracker:
+    """
+    One percent/ETA over several ffmpeg runs.
+
+    Register every run with part(weight) before the first one starts, so the
+    total never grows and the percent only moves forward. The weight is the
+    expected cost of the run, e.g. the seconds of output it encodes. Each
+    part() returns the on_progress callback to hand to run_ffmpeg(). Parts
+    may report from several threads at once.
+    """
+
+    def __init__(self, on_progress):
+        self.on_progress = on_progress
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._weights = []
+        self._done = []
+
+    def part(self, weight):
+        """Register a run; returns its on_progress(percent, eta_seconds) callback"""
+        with self._lock:
+            index = len(self._weights)
+            self._weights.append(max(float(weight), 0.0))
+            self._done.append(0.0)
+
+        def update(percent, eta_seconds=None):
+            with self._lock:
+                self._done[index] = self._weights[index] * min(max(percent, 0.0), 100.0) / 100.0
+            self.on_progress(*self.snapshot())
+        return update
+
+    def snapshot(self):
+        """(percent, eta_seconds) over all parts; the ETA is None until there is progress"""
+        with self._lock:
+            total, done = sum(self._weights), sum(self._done)
+        if total <= 0 or done >= total:
+            return 100.0, 0.0
+        percent = 100.0 * done / total
+        if percent <= 0:
+            return 0.0, None
+        return percent, (time.time() - self.started) * (100.0 - percent) / percent
+
+
+def wait_with_cpu_time(process):
+    """
+    Wait for a child process to exit.
+
+    Returns:
+        float or None: Its CPU time (user + system) in seconds, None where the
+        platform does not report it per child
+    """
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_ffmpeg(command, duration=None, on_progress=None, step='other'):
+    """
+    Run an ffmpeg command (argument list) and report progress while it runs.
+
+    Args:
+        command (list): ffmpeg command; progress options are inserted after 'ffmpeg'
+        duration (float): Expected output duration in seconds, used for percent/ETA
+        on_progress (callable): Called as on_progress(percent, eta_seconds)
+        step (str): Pipeline step the run is recorded under (segment, concat, preview, ...)
+
+    Returns:
+        tuple: (returncode, stderr_tail) where stderr_tail is the last
+        STDERR_TAIL_LINES lines of ffmpeg's log output
+    """
+    command = [command[0], '-progress', 'pipe:1', '-nostats'] + list(command[1:])
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, bufsize=1)
+
+    def drain_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line)
+
+    stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+    stderr_thread.start()
+
+    started = time.time()
+    block = []
+    for line in process.stdout:
+        block.append(line)
+        if not line.startswith('progress='):
+            continue
+
+        values = parse_progress_block(block)
+        block = []
+        if on_progress is None:
+            continue
+        if values.get('progress') == 'end':
+            on_progress(100.0, 0.0)
+            continue
+        position = out_time_seconds(values)
+        if duration and position is not None:
+            percent = min(100.0 * position / duration, 99.9)
+            elapsed = time.time() - started
+            eta = elapsed * (100.0 - percent) / percent if percent > 0 else None
+            on_progress(percent, eta)
+
+    cpu_seconds = wait_with_cpu_time(process)
+    FFMPEG_SECONDS.observe(time.time() - started, step=step)
+    if cpu_seconds is not None:
+        FFMPEG_CPU_SECONDS.observe(cpu_seconds, step=step)
+    stderr_thread.join(timeout=5)
+    return process.returncode, ''.join(stderr_tail)
@@ -1,40 +1,32 @@
-# This folder looks for files that have been recently uploaded in user_uploads
+# Render pipeline for reels uploaded to user_uploads (driven by worker.py)
 import os
-import time
-import subprocess
-import cloudinary
-import cloudinary.uploader
 from dotenv import load_dotenv
-from text_to_audio import text_to_speech_file
+from text_to_audio import text_to_speech_file, speech_key, AUDIO_KEY_FILE
+from image_prep import normalize_images
+import render_cache
+from uploader import (submit_upload, publish_image, reel_name, reel_version, local_reel_path, local_reel_url,
+                      local_preview_path, local_preview_url, REELS_DIR)
+from thumbnails import probe_metadata, extract_posters
+from segments import plan_segments, encode_segments, concat_segments
+from encoding_profiles import resolve_profile_name, get_profile, video_encoder_args, preview_encoder_args
+from timeline import plan_timeline
+from ffmpeg_runner import run_ffmpeg, ProgressTracker
+from metrics import STATUS_COMMIT_SECONDS, RENDER_FAILURES
+from logs import get_logger, tail_output
 
 # Load environment variables
 load_dotenv()
+log = get_logger(__name__)
 
-# Configure Cloudinary
-cloudinary_url = os.getenv('CLOUDINARY_URL')
-if cloudinary_url:
-    try:
-        cloudinary.config(cloudinary_url=cloudinary_url)
-        # Verify configuration worked
-        if not cloudinary.config().cloud_name:
-            raise ValueError("Cloudinary URL parsing failed")
-    except Exception as e:
-        print(f"[WARNING] Failed to configure Cloudinary with URL: {e}")
-        # Fallback to individual parameters
-        cloudinary.config(
-            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-            api_key=os.getenv('CLOUDINARY_API_KEY'),
-            api_secret=os.getenv('CLOUDINARY_API_SECRET')
-        )
-else:
-    cloudinary.config(
-        cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-        api_key=os.getenv('CLOUDINARY_API_KEY'),
-        api_secret=os.getenv('CLOUDINARY_API_SECRET')
-    )
+# Seconds per image when input.txt does not give a duration
+DEFAULT_SLIDE_DURATION = 3
+# Rough cost of the preview and of the concat per second of reel, relative to
+# encoding a second of segment; weights of the render progress (ProgressTracker)
+PREVIEW_COST = 0.05
+CONCAT_COST = 0.05
 
-def update_video_status(folder, status, cloudinary_url=None):
-    """Update video status in database"""
+def update_video_status(folder, status, cloudinary_url=None, preview_url=None):
+    """Update video status in database (pass preview_url='' to clear the preview)"""
     try:
         # Import here to avoid circular imports
         from app import app, db, Video
@@ -44,145 +36,330 @@ def update_video_status(folder, status, cloudinary_url=None):
                 video.status = status
                 if cloudinary_url:
                     video.cloudinary_url = cloudinary_url
-                db.session.commit()
-                print(f"[DATABASE] Updated video {folder} status to {status}")
+                if preview_url is not None:
+                    video.preview_url = preview_url or None
+                with STATUS_COMMIT_SECONDS.time(status=status):
+                    db.session.commit()
+                log.info("Updated video status", folder=folder, status=status)
             else:
-                print(f"[WARNING] Video {folder} not found in database")
+                log.warning("Video not found in database", folder=folder)
+    except Exception:
+        log.exception("Failed to update video status", folder=folder, status=status)
+
+def update_video_media(folder, **fields):
+    """Set metadata columns (duration, size, format, poster_url, thumbnail_url) of a video"""
+    try:
+        from app import app, db, Video
+        with app.app_context():
+            video = Video.query.filter_by(uuid=folder).first()
+            if video:
+                for name, value in fields.items():
+                    setattr(video, name, value)
+                db.session.commit()
+    except Exception:
+        log.exception("Failed to update media info", folder=folder)
+
+def copy_media_info(folder, url):
+    """Reuse the poster and metadata of another video that already has this reel (render cache hit)"""
+    from app import app, Video
+    with app.app_context():
+        source = Video.query.filter(Video.cloudinary_url == url, Video.uuid != folder,
+                                    Video.poster_url.isnot(None)).first()
+        fields = {name: getattr(source, name) for name in
+                  ('duration', 'size', 'format', 'poster_url', 'thumbnail_url')} if source else None
+    if fields:
+        update_video_media(folder, **fields)
+
+def publish_media_info(folder, output_video_path, progress=None):
+    """
+    Probes the finished reel into Video.duration/size/format and publishes a
+    poster and thumbnail for the gallery cards, named after the reel.
+    """
+    if progress:
+        progress.stage('poster')
+    try:
+        fields = probe_metadata(output_video_path)
+        name = os.path.splitext(os.path.basename(output_video_path))[0]
+        images = extract_posters(output_video_path, REELS_DIR, name, fields['duration'])
+        if images:
+            fields['poster_url'], fields['thumbnail_url'] = [publish_image(path) for path in images]
     except Exception as e:
-        print(f"[ERROR] Failed to update database for {folder}: {e}")
+        # A missing poster must never fail an otherwise finished reel
+        log.warning("Could not extract poster/metadata", folder=folder, error=str(e))
+        return
+    update_video_media(folder, **fields)
+    log.info("Poster and metadata ready", folder=folder, duration=fields['duration'], size=fields['size'])
+
+def read_input_list(folder):
+    """
+    Parse user_uploads/<folder>/input.txt.
+    
+    Returns:
+        list or None: [(image_file, duration or None), ...] in reel order, None if input.txt is missing
+    """
+    input_txt_path = f"user_uploads/{folder}/input.txt"
+    if not os.path.exists(input_txt_path):
+        return None
+    slides = []
+    with open(input_txt_path, "r") as f:
+        for line in f:
+            if line.startswith("file "):
+                slides.append([line.split("'")[1], None])
+            elif line.startswith("duration ") and slides:
+                slides[-1][1] = line.split()[1]
+    return [tuple(slide) for slide in slides]
+
+def write_input_list(folder, slides):
+    """Write [(image_file, duration), ...] to user_uploads/<folder>/input.txt"""
+    with open(f"user_uploads/{folder}/input.txt", "w") as f:
+        for img_file, duration in slides:
+            f.write(f"file '{img_file}'\n")
+            if duration:
+                f.write(f"duration {duration}\n")
+
+def audio_is_current(folder):
+    """
+    True if audio.mp3 is the narration of the current description.txt with
+    the current voice settings.
+    
+    Checked by cache key, not file times: audio.mp3 may be a hard link to a
+    TTS cache entry whose mtime other videos move forward. Background music
+    from a failed synthesis is never current, so a re-render tries again.
+    """
+    audio_path = f"user_uploads/{folder}/audio.mp3"
+    desc_path = f"user_uploads/{folder}/description.txt"
+    key_path = f"user_uploads/{folder}/{AUDIO_KEY_FILE}"
+    if not (os.path.exists(audio_path) and os.path.getsize(audio_path) > 0
+            and os.path.exists(desc_path) and os.path.exists(key_path)):
+        return False
+    with open(desc_path, "r") as f:
+        text = f.read()
+    with open(key_path, "r") as f:
+        return f.read().strip() == speech_key(text)
 
 def text_to_speech(folder: str):
-    print(f"Converting text to speech for {folder}...")
+    log.info("Converting text to speech", folder=folder)
     desc_path = f"user_uploads/{folder}/description.txt"
     if not os.path.exists(desc_path):
-        print(f"[ERROR] description.txt not found for {folder}")
+        log.error("description.txt not found", folder=folder)
         return
     with open(desc_path, "r") as f:
         text = f.read()
-    print(text, folder)
+    log.debug("Description text", folder=folder, chars=len(text))
     text_to_speech_file(text, folder)
-def create_reel(folder):
+def create_preview(folder, frames_txt_path, duration=None, on_progress=None):
+    """
+    Renders a small, low frame rate preview of the reel and publishes it on the
+    Video row so the gallery can show it while the full render runs.
+    duration (the reel length) and on_progress are passed on to run_ffmpeg().
+    
+    Returns:
+        str or None: URL of the preview, or None if it could not be rendered
+    """
+    preview_path = local_preview_path(folder)
+    command = ['ffmpeg', '-y',
+               '-f', 'concat', '-safe', '0', '-i', frames_txt_path,
+               '-i', f"user_uploads/{folder}/audio.mp3",
+               *preview_encoder_args(),
+               '-c:a', 'aac', '-b:a', '48k', '-shortest', preview_path]
+    log.debug("Rendering preview", folder=folder, command=' '.join(command))
+    try:
+        returncode, stderr = run_ffmpeg(command, duration=duration, on_progress=on_progress, step='preview')
+    except Exception as e:
+        log.warning("Preview render failed", folder=folder, error=str(e))
+        return None
+    if returncode != 0 or not os.path.exists(preview_path):
+        log.warning("Preview render failed", folder=folder, exit_code=returncode,
+                    ffmpeg_output=tail_output(stderr))
+        return None
+    
+    preview_url = local_preview_url(folder)
+    update_video_status(folder, 'processing', preview_url=preview_url)
+    log.info("Preview ready", folder=folder, url=preview_url)
+    return preview_url
+
+def discard_preview(folder):
+    """Remove the preview once the full render has replaced it"""
+    preview_path = local_preview_path(folder)
+    if os.path.exists(preview_path):
+        os.remove(preview_path)
+        log.debug("Preview file removed", path=preview_path)
+
+def publish_reel(folder, output_video_path, cache_key=None, progress=None):
+    """
+    Marks the video completed with its local URL and hands the reel to the
+    background upload pool (uploader.py), which swaps in the storage URL
+    once the upload succeeds.
+    
+    Returns:
+        str: URL the reel is available at right now
+    """
+    log.info("Publishing reel", folder=folder)
+    publish_media_info(folder, output_video_path, progress)
+    if progress:
+        progress.stage('upload')
+    
+    # Serve the local file straight away; the preview is no longer needed
+    local_url = local_reel_url(os.path.splitext(os.path.basename(output_video_path))[0])
+    update_video_status(folder, 'completed', local_url, preview_url='')
+    discard_preview(folder)
+    
+    submit_upload(folder, output_video_path, cache_key)
+    return local_url
+
+def create_reel(folder, profile=None, progress=None):
     """
     Creates a video reel from images and audio for a given folder.
     
     Args:
         folder (str): The folder name in user_uploads containing the images and audio
+        profile (str): Encoding profile name (see encoding_profiles.py); defaults to ENCODING_PROFILE
+        progress (job_queue.JobProgress): Optional recorder for stage, percent complete and ETA
         
     Returns:
         str or None: URL/path to the created video, or None if creation failed
         
-    Note: The scale filter 'scale=trunc(iw/2)*2:trunc(ih/2)*2' is essential to ensure
-    both width and height are even numbers, which is required by the H.264 encoder.
-    Without this, you'll get "height not divisible by 2" errors.
+    Note: Images are first normalized by image_prep.normalize_images() to the
+    reel frame size (REEL_WIDTH x REEL_HEIGHT, both even as H.264 requires), so
+    ffmpeg only ever decodes small frames of one uniform size.
     """
-    input_txt_path = f"user_uploads/{folder}/input.txt"
-    print(f"[DEBUG] Reading {input_txt_path}...")
-    if not os.path.exists(input_txt_path):
-        print(f"[ERROR] input.txt not found for {folder}")
+    slides = read_input_list(folder)
+    if slides is None:
+        log.error("input.txt not found", folder=folder)
+        RENDER_FAILURES.inc(cause='missing_input')
         return None
-    with open(input_txt_path, "r") as f:
-        lines = f.readlines()
-    print(f"[DEBUG] input.txt contents:\n{''.join(lines)}")
-    
-    # Check that all referenced files exist and are valid images
-    from PIL import Image
-    missing_files = []
-    invalid_images = []
-    for line in lines:
-        if line.startswith("file "):
-            img_file = line.split("'")[1]
-            img_path = os.path.join(f"user_uploads/{folder}", img_file)
-            if not os.path.exists(img_path):
-                missing_files.append(img_file)
-            else:
-                try:
-                    # Try to open the image with PIL to validate it
-                    with Image.open(img_path) as img:
-                        img.verify()  # Verify it's a valid image
-                except (IOError, OSError, Image.UnidentifiedImageError):
-                    invalid_images.append(img_file)
+    log.debug("Read input.txt", folder=folder, slides=slides)
+    
+    # Check that all referenced files exist
+    image_files = [img_file for img_file, _ in slides]
+    durations = [duration for _, duration in slides]
+    missing_files = [img_file for img_file in image_files
+                     if not os.path.exists(os.path.join(f"user_uploads/{folder}", img_file))]
     if missing_files:
-        print(f"[ERROR] The following files referenced in input.txt are missing: {missing_files}")
+        log.error("Files referenced in input.txt are missing", folder=folder, missing=missing_files)
+        RENDER_FAILURES.inc(cause='missing_images')
         return None
+    
+    # Validate, orient, resize and pad every image to the reel frame in parallel
+    if progress:
+        progress.stage('normalize')
+    frames, invalid_images = normalize_images(folder, image_files)
     if invalid_images:
-        print(f"[ERROR] The following files are not valid images: {invalid_images}")
+        log.error("Files are not valid images", folder=folder, invalid=invalid_images)
+        RENDER_FAILURES.inc(cause='invalid_images')
         return None
     
     # Check audio.mp3 exists and is not empty
     audio_path = f"user_uploads/{folder}/audio.mp3"
     if not os.path.exists(audio_path) or os.path.getsize(audio_path) == 0:
-        print(f"[ERROR] audio.mp3 is missing or empty for {folder}")
+        log.error("audio.mp3 is missing or empty", folder=folder)
+        RENDER_FAILURES.inc(cause='missing_audio')
         return None
     
-    # Create output directory for reels if it doesn't exist
-    os.makedirs("static/reels", exist_ok=True)
-    output_video_path = f"static/reels/{folder}.mp4"
+    # Spread the real audio length over the slides in whole output frames,
+    # using the input.txt durations as relative weights
+    profile = resolve_profile_name(profile)
+    weights = [float(d or DEFAULT_SLIDE_DURATION) for d in durations]
+    planned = plan_timeline(audio_path, weights, get_profile(profile)['fps'])
+    frame_files = [frame['frame'] for frame in frames]
+    if planned:
+        durations = planned
+        log.debug("Planned slide durations", folder=folder, durations=durations)
+    else:
+        log.warning("Could not probe audio length, using input.txt durations", folder=folder)
+        durations = [d or DEFAULT_SLIDE_DURATION for d in durations]
+    
+    # Concat list over the normalized frames with the planned durations
+    frames_txt_path = f"user_uploads/{folder}/frames.txt"
+    with open(frames_txt_path, "w") as f:
+        for frame_file, duration in zip(frame_files, durations):
+            f.write(f"file 'frames/{frame_file}'\nduration {duration}\n")
+        # The concat demuxer ignores the duration of the last entry unless it is repeated
+        f.write(f"file 'frames/{frame_files[-1]}'\n")
+    
+    # Frames are already uniform and even-sized, so no scale filter is needed
+    output_args = ['segments', *video_encoder_args(profile), '-c:a', 'aac', '-shortest']
+    
+    # Identical frames + audio + settings were already rendered: reuse that reel
+    frame_paths = [f"user_uploads/{folder}/frames/{frame_file}" for frame_file in frame_files]
+    key = render_cache.cache_key(frame_paths, durations, audio_path, output_args)
+    
+    # Named by content version, so a re-render never overwrites a published reel
+    output_video_path = local_reel_path(reel_name(folder, reel_version(key)))
+    os.makedirs(os.path.dirname(output_video_path), exist_ok=True)
+    
+    cached = render_cache.lookup(key)
+    if cached and cached['url']:
+        log.info("Render cache hit", folder=folder, url=cached['url'])
+        update_video_status(folder, 'completed', cached['url'])
+        copy_media_info(folder, cached['url'])
+        return cached['url']
+    
+    if cached:
+        log.info("Render cache hit, reusing file", folder=folder, file=cached['file'])
+        render_cache.restore_file(cached, output_video_path)
+        return publish_reel(folder, output_video_path, key, progress)
+    
+    # One percent/ETA from the start of the preview to the end of the concat,
+    # weighted by the seconds of video each ffmpeg run processes
+    segment_paths, missing = plan_segments(frame_paths, durations, profile)
+    reel_seconds = sum(float(d) for d in durations)
+    tracker = ProgressTracker(progress) if progress else None
+    part = tracker.part if tracker else (lambda weight: None)
+    preview_progress = part(reel_seconds * PREVIEW_COST)
+    segment_progress = [part(float(duration)) for _, duration, _ in missing]
+    concat_progress = part(reel_seconds * CONCAT_COST)
     
-    # Fix the ffmpeg command to use dynamic folder paths and ensure even dimensions
-    # The scale filter ensures both width and height are even numbers (required for H.264)
-    command = f'''ffmpeg -y -f concat -safe 0 -i user_uploads/{folder}/input.txt \
--i user_uploads/{folder}/audio.mp3 \
--vf "scale=trunc(iw/2)*2:trunc(ih/2)*2" \
--c:v libx264 -pix_fmt yuv420p -c:a aac -shortest {output_video_path}'''
+    # Publish a quick low-resolution preview before the full encode
+    if progress:
+        progress.stage('preview')
+    create_preview(folder, frames_txt_path, reel_seconds, preview_progress)
     
-    print(f"[DEBUG] Running ffmpeg command: {command}")
+    # Encode each slide as its own segment (reusing cached segments), then
+    # join them with a stream copy and add the audio
+    if progress:
+        preview_progress(100.0)  # done, or failed and skipped
+        progress.stage('encode', *tracker.snapshot())
     try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True)
-        print(f"[FFMPEG STDOUT]:\n{result.stdout}")
-        if result.stderr:
-            print(f"[FFMPEG STDERR]:\n{result.stderr}")
-        if result.returncode != 0:
-            print(f"[ERROR] ffmpeg failed with exit code {result.returncode}")
+        if not encode_segments(missing, profile, segment_progress):
+            log.error("Segment encoding failed", folder=folder)
+            RENDER_FAILURES.inc(cause='segment_encode')
+            update_video_status(folder, 'failed')
+            return None
+        
+        returncode, stderr = concat_segments(segment_paths, audio_path, output_video_path,
+                                             f"user_uploads/{folder}/segments.txt", reel_seconds, concat_progress)
+        if returncode != 0:
             # Check for common errors and provide helpful messages
-            if "height not divisible by 2" in result.stderr or "width not divisible by 2" in result.stderr:
-                print("[ERROR] Image dimensions issue - this should be fixed by the scale filter")
-            elif "No such file or directory" in result.stderr:
-                print("[ERROR] Input file not found - check if all referenced files exist")
-            elif "Invalid argument" in result.stderr:
-                print("[ERROR] Invalid FFmpeg parameters - check input format and codec settings")
+            hint = None
+            if "No such file or directory" in stderr:
+                hint = "Input file not found - check if all referenced files exist"
+            elif "Invalid argument" in stderr:
+                hint = "Invalid FFmpeg parameters - check input format and codec settings"
+            log.error("ffmpeg concat failed", folder=folder, exit_code=returncode, hint=hint,
+                      ffmpeg_output=tail_output(stderr))
+            RENDER_FAILURES.inc(cause='concat')
             # Update database with failed status
             update_video_status(folder, 'failed')
             return None
         
         # Check if output file was actually created and has content
         if not os.path.exists(output_video_path) or os.path.getsize(output_video_path) == 0:
-            print(f"[ERROR] Output video file was not created or is empty: {output_video_path}")
+            log.error("Output video file was not created or is empty", folder=folder, path=output_video_path)
+            RENDER_FAILURES.inc(cause='empty_output')
             update_video_status(folder, 'failed')
             return None
             
-        print(f"[SUCCESS] Video created successfully: {output_video_path} ({os.path.getsize(output_video_path)} bytes)")
-        print(f"Creating reel for {folder}...")
-        
-        # Upload to Cloudinary
+        log.info("Video created", folder=folder, path=output_video_path, size=os.path.getsize(output_video_path))
         try:
-            print(f"[DEBUG] Uploading {output_video_path} to Cloudinary...")
-            upload_result = cloudinary.uploader.upload(
-                output_video_path,
-                resource_type="video",
-                public_id=f"videos/{folder}",
-                folder="bot_ai_vids"
-            )
-            cloudinary_url = upload_result.get('secure_url')
-            print(f"[SUCCESS] Video uploaded to Cloudinary: {cloudinary_url}")
-            
-            # Update database with Cloudinary URL
-            update_video_status(folder, 'completed', cloudinary_url)
+            render_cache.store_file(key, output_video_path)
+        except OSError as e:
+            log.warning("Could not add reel to the render cache", folder=folder, error=str(e))
+        return publish_reel(folder, output_video_path, key, progress)
             
-            # Clean up local file after upload
-            if os.path.exists(output_video_path):
-                os.remove(output_video_path)
-                print(f"[DEBUG] Local video file {output_video_path} removed")
-                
-            return cloudinary_url
-        except Exception as e:
-            print(f"[ERROR] Failed to upload to Cloudinary: {e}")
-            # Return local path as fallback and update database
-            local_url = f"/static/reels/{folder}.mp4"
-            update_video_status(folder, 'completed', local_url)
-            return local_url
-            
-    except Exception as e:
-        print(f"[ERROR] Exception running ffmpeg: {e}")
+    except Exception:
+        log.exception("Exception running ffmpeg", folder=folder)
+        RENDER_FAILURES.inc(cause='exception')
         # Update database with failed status
         update_video_status(folder, 'failed')
         return None
@@ -190,62 +367,6 @@ def create_reel(folder):
     
 
 if __name__ == "__main__":
-    while True:
-        print("Processing queue...")
-        
-        # Get processing videos from database instead of done.txt
-        try:
-            from app import app, db, Video
-            with app.app_context():
-                # Find videos that need processing
-                pending_videos = Video.query.filter_by(status='processing').all()
-                
-                for video in pending_videos:
-                    folder = video.uuid
-                    folder_path = f"user_uploads/{folder}"
-                    
-                    # Check if folder exists and has required files
-                    if not os.path.exists(folder_path):
-                        print(f"[WARNING] Folder {folder_path} not found, marking as failed")
-                        update_video_status(folder, 'failed')
-                        continue
-                    
-                    # Check if description.txt exists
-                    desc_path = f"{folder_path}/description.txt"
-                    if not os.path.exists(desc_path):
-                        print(f"[WARNING] description.txt not found for {folder}, skipping")
-                        continue
-                    
-                    print(f"[INFO] Processing video: {folder}")
-                    try:
-                        # Set status to processing in case it's not already
-                        update_video_status(folder, 'processing')
-                        
-                        # Process the video
-                        text_to_speech(folder)  # convert from text to audio   
-                        result = create_reel(folder)  # create a reel from the audio and images
-                        
-                        if result:
-                            print(f"[SUCCESS] Completed processing for {folder}")
-                        else:
-                            print(f"[ERROR] Failed processing for {folder}")
-                            
-                    except Exception as e:
-                        print(f"[ERROR] Exception processing {folder}: {e}")
-                        update_video_status(folder, 'failed')
-                        
-        except Exception as e:
-            print(f"[ERROR] Database query failed: {e}")
-            # Fallback to old method if database fails
-            with open ("done.txt", "r") as f:
-                done_folders = f.readlines()
-            done_folders = [line.strip() for line in done_folders]   
-            folders = os.listdir("user_uploads")
-            for folder in folders:
-                if folder not in done_folders:
-                    text_to_speech(folder)  # convert from text to audio   
-                    create_reel(folder) # create a reel from the audio and images
-                    with open("done.txt", "a") as f:
-                        f.write(folder + "\n")
-                        
-        time.sleep(5)
\ No newline at end of file
+    # Pending videos are now drained from the RenderJob queue by worker.py
+    from worker import run_worker
+    run_worker()
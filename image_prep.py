@@ -0,0 +1,121 @@
+"""
+Image pre-normalization for reels.
+
+Every uploaded image is validated, rotated according to its EXIF orientation,
+fitted inside the reel frame and padded to exactly that frame, then written as
+a compact JPEG under user_uploads/<folder>/frames/ (named by content hash).
+ffmpeg then only has to decode small frames of one uniform, even size.
+"""
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# Target reel frame (portrait 9:16 by default); both must be even for H.264
+REEL_WIDTH = int(os.environ.get('REEL_WIDTH', 1080)) // 2 * 2
+REEL_HEIGHT = int(os.environ.get('REEL_HEIGHT', 1920)) // 2 * 2
+FRAME_QUALITY = int(os.environ.get('FRAME_JPEG_QUALITY', 90))
+IMAGE_PREP_WORKERS = int(os.environ.get('IMAGE_PREP_WORKERS', 0)) or min(8, os.cpu_count() or 1)
+PAD_COLOR = (0, 0, 0)
+
+
+def frame_name(src_path, size):
+    """Content hash of a source image plus the output settings"""
+    digest = hashlib.sha256()
+    with open(src_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    digest.update(f"|{size[0]}x{size[1]}|q{FRAME_QUALITY}|{PAD_COLOR}".encode())
+    return digest.hexdigest()[:32]
+
+
+def normalize_image(src_path, dest_path, size=(REEL_WIDTH, REEL_HEIGHT)):
+    """
+    Validate one image and write it as a size-sized, letterboxed JPEG.
+
+    Returns:
+        dict: Source/output paths and dimensions
+
+    Raises:
+        OSError: If the image cannot be decoded (PIL.UnidentifiedImageError is a subclass)
+    """
+    with Image.open(src_path) as img:
+        original_size = img.size
+        # Only decode as much of a large JPEG as the output frame needs
+        img.draft('RGB', size)
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        fitted = ImageOps.contain(img, size, method=Image.Resampling.LANCZOS)
+
+    frame = Image.new('RGB', size, PAD_COLOR)
+    frame.paste(fitted, ((size[0] - fitted.width) // 2, (size[1] - fitted.height) // 2))
+    frame.save(dest_path, 'JPEG', quality=FRAME_QUALITY, optimize=True)
+
+    return {
+        'source': os.path.basename(src_path),
+        'frame': os.path.basename(dest_path),
+        'original_width': original_size[0],
+        'original_height': original_size[1],
+        'fitted_width': fitted.width,
+        'fitted_height': fitted.height,
+        'width': size[0],
+        'height': size[1],
+        'bytes': os.path.getsize(dest_path)
+    }
+
+
+def normalize_images(folder, image_files, size=(REEL_WIDTH, REEL_HEIGHT), max_workers=IMAGE_PREP_WORKERS):
+    """
+    Normalize the images of a reel in parallel.
+
+    Args:
+        folder (str): The folder name in user_uploads containing the images
+        image_files (list): Image file names in reel order
+        size (tuple): Output frame (width, height)
+        max_workers (int): Size of the thread pool
+
+    Returns:
+        tuple: (frames, invalid_images) where frames is a list of result dicts
+        in reel order (None for invalid images) and invalid_images lists the
+        names of files that could not be decoded
+    """
+    folder_path = f"user_uploads/{folder}"
+    frames_dir = os.path.join(folder_path, "frames")
+    os.makedirs(frames_dir, exist_ok=True)
+
+    def work(img_file):
+        src_path = os.path.join(folder_path, img_file)
+        try:
+            # Frames are named after their content, so re-rendering an edited
+            # reel only normalizes images that actually changed
+            name = frame_name(src_path, size)
+            dest_path = os.path.join(frames_dir, f"{name}.jpg")
+            info_path = os.path.join(frames_dir, f"{name}.json")
+            if os.path.exists(dest_path) and os.path.exists(info_path):
+                with open(info_path) as f:
+                    return dict(json.load(f), source=img_file)
+            result = normalize_image(src_path, dest_path, size)
+            with open(info_path, "w") as f:
+                json.dump(result, f)
+            return result
+        except (IOError, OSError, ValueError, Image.DecompressionBombError) as e:
+            log.error("Could not normalize image", folder=folder, file=img_file, error=str(e))
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(image_files)))) as pool:
+        frames = list(pool.map(work, image_files))
+
+    invalid_images = [img_file for img_file, frame in zip(image_files, frames) if frame is None]
+
+    # Record the dimensions of every frame alongside the frames themselves
+    with open(os.path.join(frames_dir, "manifest.json"), "w") as f:
+        json.dump({'width': size[0], 'height': size[1], 'frames': frames}, f, indent=2)
+
+    return frames, invalid_images
@@ -15,6 +15,10 @@ def init_database():
             db.create_all()
             print("[INFO] Database tables created successfully")
             
+            from migrations import run_migrations
+            applied = run_migrations()
+            print(f"[INFO] Applied {len(applied)} schema migration(s)")
+            
             # Check if admin user already exists
             admin_user = User.query.filter_by(username='admin').first()
             
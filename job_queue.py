@@ -0,0 +1,191 @@
+"""
+Database-backed render job queue.
+
+The web app only inserts jobs (see enqueue_job); render workers claim them with
+claim_next_job and report back with complete_job / fail_job. All functions
+expect to be called inside an app context.
+"""
+import os
+import json
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, func
+
+from app import app, db, Video, RenderJob
+from encoding_profiles import resolve_profile_name
+from logs import get_logger
+from metrics import RENDER_FAILURES
+
+# A running job whose worker has not reported progress (JobProgress) in this
+# many seconds is assumed to belong to a dead worker and is handed out again.
+# Every stage and ffmpeg progress update refreshes heartbeat_at, so a long
+# render is never taken away from a live worker.
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 15 * 60))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+log = get_logger(__name__)
+
+
+
+def enqueue_job(video, encoding_profile=None):
+    """Add a queued render job for video to the session (the caller commits)"""
+    job = RenderJob(video=video, status='queued',
+                    encoding_profile=resolve_profile_name(encoding_profile))
+    db.session.add(job)
+    return job
+
+
+def claim_next_job(worker_id):
+    """
+    Atomically claim the oldest queued job for worker_id.
+
+    Returns:
+        RenderJob or None: The claimed job (now 'running'), or None if the queue is empty
+    """
+    query = RenderJob.query.filter_by(status='queued').order_by(RenderJob.created_at, RenderJob.id)
+    if db.engine.dialect.name == 'postgresql':
+        # Let concurrent workers skip rows another worker is already claiming
+        query = query.with_for_update(skip_locked=True)
+
+    candidate = query.first()
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    # Conditional update so two workers can never both claim the same row
+    result = db.session.execute(
+        update(RenderJob)
+        .where(RenderJob.id == candidate.id, RenderJob.status == 'queued')
+        .values(status='running',
+                worker_id=worker_id,
+                attempts=RenderJob.attempts + 1,
+                started_at=datetime.now(),
+                heartbeat_at=datetime.now())
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        return None
+
+    job = db.session.get(RenderJob, candidate.id)
+    db.session.refresh(job)
+    return job
+
+
+def complete_job(job_id):
+    job = db.session.get(RenderJob, job_id)
+    if job:
+        job.status = 'completed'
+        job.error = None
+        job.finished_at = datetime.now()
+        db.session.commit()
+
+
+def fail_job(job_id, error, retry=False):
+    """Mark a job failed, or put it back in the queue if retry is allowed and attempts remain"""
+    job = db.session.get(RenderJob, job_id)
+    if not job:
+        return
+    job.error = str(error)[:2000] if error else None
+    if retry and (job.attempts or 0) < JOB_MAX_ATTEMPTS:
+        job.status = 'queued'
+        job.worker_id = None
+        job.started_at = None
+        job.heartbeat_at = None
+    else:
+        job.status = 'failed'
+        job.finished_at = datetime.now()
+    db.session.commit()
+
+
+def requeue_stale_jobs():
+    """Return jobs whose worker stopped reporting progress (crashed worker) to the queue"""
+    cutoff = datetime.now() - timedelta(seconds=JOB_STALE_SECONDS)
+    # Jobs claimed before heartbeats existed only have started_at
+    last_seen = func.coalesce(RenderJob.heartbeat_at, RenderJob.started_at)
+    stale_jobs = RenderJob.query.filter(RenderJob.status == 'running', last_seen < cutoff).all()
+    for job in stale_jobs:
+        if (job.attempts or 0) < JOB_MAX_ATTEMPTS:
+            log.warning("Re-queueing stale job", job_id=job.id, worker_id=job.worker_id)
+            job.status = 'queued'
+            job.worker_id = None
+            job.started_at = None
+            job.heartbeat_at = None
+        else:
+            log.error("Stale job exceeded its attempts, marking as failed", job_id=job.id,
+                      attempts=JOB_MAX_ATTEMPTS)
+            RENDER_FAILURES.inc(cause='stale')
+            job.status = 'failed'
+            job.error = 'Worker did not finish the job'
+            job.finished_at = datetime.now()
+            job.video.status = 'failed'
+    db.session.commit()
+    return len(stale_jobs)
+
+
+def enqueue_orphaned_videos():
+    """Queue jobs for 'processing' videos created before the job queue existed"""
+    orphans = Video.query.filter(Video.status == 'processing', ~Video.jobs.any()).all()
+    for video in orphans:
+        enqueue_job(video)
+    db.session.commit()
+    return len(orphans)
+
+
+def queue_depth():
+    return RenderJob.query.filter_by(status='queued').count()
+
+
+class JobProgress:
+    """
+    Records the current stage, percent complete, ETA and per-stage timings of
+    a running job. Every write also refreshes the job's heartbeat, which
+    requeue_stale_jobs() checks. Unlike the functions above it opens its own
+    app context, so the render pipeline can call it from anywhere. Progress
+    writes are throttled to one every min_interval seconds.
+    """
+
+    def __init__(self, job_id, min_interval=1.0):
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self.timings = {}
+        self.current = None
+        self.stage_started = None
+        self.last_write = 0
+
+    def _write(self, **values):
+        try:
+            with app.app_context():
+                db.session.execute(update(RenderJob).where(RenderJob.id == self.job_id)
+                                   .values(heartbeat_at=datetime.now(), **values))
+                db.session.commit()
+        except Exception as e:
+            log.warning("Failed to record job progress", job_id=self.job_id, error=str(e))
+        self.last_write = time.time()
+
+    def _close_stage(self):
+        if self.current:
+            self.timings[self.current] = round(time.time() - self.stage_started, 3)
+
+    def stage(self, name, percent=0.0, eta_seconds=None):
+        """
+        Start a new pipeline stage (closes the timing of the previous one).
+        A percent and ETA carry on a progress that spans several stages.
+        """
+        self._close_stage()
+        self.current = name
+        self.stage_started = time.time()
+        self._write(stage=name, progress=round(percent, 1),
+                    eta_seconds=round(eta_seconds, 1) if eta_seconds is not None else None,
+                    stage_timings=json.dumps(self.timings))
+
+    def __call__(self, percent, eta_seconds=None):
+        if percent < 100 and time.time() - self.last_write < self.min_interval:
+            return
+        self._write(progress=round(percent, 1),
+                    eta_seconds=round(eta_seconds, 1) if eta_seconds is not None else None)
+
+    def finish(self):
+        self._close_stage()
+        self.current = None
+        self._write(stage='done', progress=100.0, eta_seconds=0.0,
+                    stage_timings=json.dumps(self.timings))
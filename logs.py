@@ -0,0 +1,220 @@
+"""
+Structured, non-blocking logging.
+
+Modules get a logger with get_logger(__name__) and pass fields as keyword
+arguments:
+
+    log = get_logger(__name__)
+    log.info("Queued render job", job_id=job.id, folder=folder)
+
+setup_logging() puts a single QueueHandler on the root logger. A QueueListener
+thread formats and writes the records, so a log call on a request thread only
+appends to a queue. If the queue is full, records are dropped and counted
+instead of blocking the caller. Levels below LOG_LEVEL are discarded before
+any formatting.
+
+Request logs are sampled per Flask endpoint (LOG_SAMPLE_RATES), so static
+files and media ranges do not flood the log. Server errors are always logged.
+
+Settings:
+    LOG_LEVEL              DEBUG, INFO (default), WARNING, ERROR
+    LOG_FORMAT             text (default) or json (one object per line)
+    LOG_QUEUE_SIZE         records buffered before new ones are dropped
+    LOG_SAMPLE_RATES       "endpoint=rate,..." with rate between 0 and 1
+    LOG_FFMPEG_TAIL_LINES  lines of ffmpeg output kept in error logs
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', 'static=0.1,serve_reel=0.1,serve_stored_media=0.1')
+LOG_FFMPEG_TAIL_LINES = int(os.environ.get('LOG_FFMPEG_TAIL_LINES', 20))
+
+# Keyword arguments that belong to logging itself rather than to the record's fields
+_LOGGING_KWARGS = {'exc_info', 'stack_info', 'stacklevel', 'extra'}
+
+
+class FieldLogger(logging.LoggerAdapter):
+    """A logger whose keyword arguments become structured fields of the record"""
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in _LOGGING_KWARGS}
+        extra = dict(kwargs.get('extra') or {})
+        extra['fields'] = {**self.extra, **fields}
+        kwargs['extra'] = extra
+        return msg, kwargs
+
+    def bind(self, **fields):
+        """A logger that adds these fields to every record"""
+        return FieldLogger(self.logger, {**self.extra, **fields})
+
+
+def get_logger(name, **fields):
+    return FieldLogger(logging.getLogger(name), fields)
+
+
+def _plain(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _text_value(value):
+    """key=value form: quote (and escape newlines in) strings that need it"""
+    value = _plain(value)
+    if isinstance(value, str) and (not value or '"' in value or any(c.isspace() for c in value)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class TextFormatter(logging.Formatter):
+    """2026-01-01 12:00:00,000 INFO worker: Completed render folder=abc job_id=3"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        record.message = record.getMessage()
+        record.asctime = self.formatTime(record)
+        line = self.formatMessage(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={_text_value(value)}" for key, value in fields.items())
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg, the fields, and exc if any"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        for key, value in (getattr(record, 'fields', None) or {}).items():
+            entry.setdefault(key, _plain(value))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue without blocking; drop the record if the writer has fallen behind"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Render the message now (arguments may change after the call) but
+        # leave formatting to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+_listener = None
+_listener_pid = None
+
+
+def setup_logging(level=None):
+    """
+    Route all logging in this process through the background writer.
+
+    Safe to call more than once. Forked children get a writer of their own
+    automatically, because the parent's thread does not exist there.
+    """
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level or LOG_LEVEL)
+    # werkzeug logs every request itself; our sampled request log replaces it
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    if _listener_pid is None:
+        os.register_at_fork(after_in_child=_setup_in_child)
+    _listener_pid = os.getpid()
+
+
+def _setup_in_child():
+    # Forked processes (render workers, gunicorn --preload) need their own writer
+    if _listener is not None:
+        setup_logging()
+
+
+def flush_logging():
+    """Write out everything still queued (at exit, or before a process ends)"""
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(flush_logging)
+
+
+def _parse_rates(spec):
+    rates = {}
+    for item in spec.split(','):
+        name, sep, rate = item.partition('=')
+        if sep and name.strip():
+            try:
+                rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+            except ValueError:
+                pass
+    return rates
+
+
+SAMPLE_RATES = _parse_rates(LOG_SAMPLE_RATES)
+
+
+def sample_request(endpoint, status_code):
+    """Whether to log this request: always for 5xx, else at the endpoint's rate (default 1)"""
+    if status_code >= 500:
+        return True
+    rate = SAMPLE_RATES.get(endpoint or '', SAMPLE_RATES.get('*', 1.0))
+    return rate >= 1.0 or random.random() < rate
+
+
+def tail_output(output, lines=None):
+    """The last lines of ffmpeg (or other tool) output, for an error log"""
+    lines = LOG_FFMPEG_TAIL_LINES if lines is None else lines
+    kept = (output or '').rstrip().splitlines()[-lines:] if lines > 0 else []
+    return '\n'.join(kept)
@@ -1,17 +1,47 @@
 import os
+import json
+import math
+import time
 import uuid
-from flask import render_template, request, redirect, url_for, flash, jsonify
+import hmac
+import base64
+import threading
+from datetime import datetime
+from flask import render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from sqlalchemy import or_
+from sqlalchemy import or_, and_, case, func
+from sqlalchemy.orm import joinedload, load_only, defer
 
-from app import app, db, login_manager, User, Video
-from generate_process import text_to_speech, create_reel
+from app import app, db, login_manager, User, Video, RenderJob, Profile, forget_user
+from job_queue import enqueue_job
+from generate_process import read_input_list, write_input_list
+from encoding_profiles import ENCODING_PROFILES, DEFAULT_ENCODING_PROFILE
+from uploader import delete_reels, REELS_DIR
+from storage import LOCAL_STORAGE_DIR
+from media import send_media
+from thumbnails import POSTER_WIDTH, THUMBNAIL_WIDTH
+from search import search_videos, autocomplete_users
+from stats import dashboard_stats, forget_videos
+from logs import get_logger
+import metrics
+import profiling
+
+log = get_logger(__name__)
 
 UPLOAD_FOLDER = 'user_uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+SSE_POLL_INTERVAL = 1
+SSE_MAX_SECONDS = 300
+# Every open stream holds a server thread, so only this many stream per process;
+# the others get the current status and reconnect after SSE_BUSY_RETRY_MS
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 4))
+SSE_BUSY_RETRY_MS = int(os.environ.get('SSE_BUSY_RETRY_MS', 5000))
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+# Longest slide the slides API accepts, in seconds
+MAX_SLIDE_SECONDS = 60
 
 
 
@@ -75,37 +105,31 @@ def signup():
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
-    print(f"[DEBUG] Login route accessed with method: {request.method}")
-    
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
-        print(f"[DEBUG] Login attempt: username={username}, password={'*' * len(password) if password else 'None'}")
         
         if not username or not password:
-            print("[DEBUG] Missing username or password")
+            log.debug("Login without username or password")
             flash("Please provide both username and password.", "danger")
             return render_template("login.html")
         
         try:
             user = User.query.filter_by(username=username).first()
             if user:
-                print(f"[DEBUG] User found: {user.username}, admin: {user.is_admin}")
-                print(f"[DEBUG] Password hash check: {check_password_hash(user.password, password)}")
                 if check_password_hash(user.password, password):
                     login_user(user, remember=True)
-                    print(f"[DEBUG] Login successful for {username}")
-                    print(f"[DEBUG] Current user authenticated: {current_user.is_authenticated}")
+                    log.info("Login successful", username=username, user_id=user.id)
                     flash("Logged in successfully!", "success")
                     return redirect(url_for("home"))
                 else:
-                    print(f"[DEBUG] Password mismatch for {username}")
+                    log.info("Login failed: password mismatch", username=username)
                     flash("Invalid username or password.", "danger")
             else:
-                print(f"[DEBUG] User not found: {username}")
+                log.info("Login failed: unknown user", username=username)
                 flash("Invalid username or password.", "danger")
         except Exception as e:
-            print(f"[DEBUG] Database error during login: {e}")
+            log.exception("Database error during login", username=username)
             flash("Login failed due to database error.", "danger")
     
     return render_template("login.html")
@@ -120,7 +144,6 @@ def logout():
 @app.route("/create", methods=["GET", "POST"])
 @login_required
 def create():
-    print(f"[DEBUG] Create route accessed by user: {current_user.username if current_user.is_authenticated else 'Anonymous'}")
     myid = uuid.uuid1()
     if request.method == "POST":
         try:
@@ -151,7 +174,11 @@ def create():
             with open(os.path.join(upload_path, "description.txt"), "w", encoding='utf-8') as desc_file:
                 desc_file.write(desc)
             
-            # Create video entry in database
+            # Write input.txt
+            write_input_list(rec_id, [(f, 3) for f in input_files])
+            
+            # Create video entry and its render job in one transaction;
+            # the render itself happens in worker.py
             video = Video(
                 uuid=rec_id,
                 user_id=current_user.id,
@@ -159,41 +186,304 @@ def create():
                 status='processing'
             )
             db.session.add(video)
+            job = enqueue_job(video, request.form.get("profile"))
             db.session.commit()
+            log.info("Queued render job", job_id=job.id, folder=rec_id, user_id=current_user.id)
             
-            # Write input.txt
-            with open(os.path.join(upload_path, "input.txt"), "w") as fl:
-                for f in input_files:
-                    fl.write(f"file '{f}'\nduration 3\n")
+            status_url = url_for("api_job_status", job_id=job.id)
+            if request.accept_mimetypes.best == "application/json":
+                response = jsonify({
+                    "job_id": job.id,
+                    "video_uuid": rec_id,
+                    "status": job.status,
+                    "encoding_profile": job.encoding_profile,
+                    "status_url": status_url
+                })
+                response.headers["Location"] = status_url
+                return response, 202
             
-            # Call processing functions
-            try:
-                print(f"[DEBUG] Starting processing for {rec_id}")
-                text_to_speech(rec_id)
-                video_url = create_reel(rec_id)
-                
-                # Update video with completion status
-                if video_url:
-                    video.status = 'completed'
-                    video.cloudinary_url = video_url
-                    db.session.commit()
-                    flash("Reel created successfully! View it in the gallery.", "success")
-                else:
-                    video.status = 'failed'
-                    db.session.commit()
-                    flash("Error creating video. Please try again.", "error")
-                    
-            except Exception as e:
-                video.status = 'failed'
-                db.session.commit()
-                print(f"[ERROR] Processing failed for {rec_id}: {e}")
-                flash(f"Error creating reel: {str(e)}", "error")
+            flash("Your reel is being created! It will appear in the gallery when it's ready.", "success")
+            return render_template("create.html", myid=uuid.uuid1(), job_id=job.id,
+                                   encoding_profiles=ENCODING_PROFILES,
+                                   default_profile=DEFAULT_ENCODING_PROFILE), 202, {"Location": status_url}
                 
         except Exception as e:
-            print(f"[ERROR] Upload failed: {e}")
+            db.session.rollback()
+            log.exception("Upload failed", user_id=current_user.id)
             flash(f"Upload failed: {str(e)}", "error")
             
-    return render_template("create.html", myid=myid)
+    return render_template("create.html", myid=myid, encoding_profiles=ENCODING_PROFILES,
+                           default_profile=DEFAULT_ENCODING_PROFILE)
+
+@app.route("/api/jobs/<int:job_id>")
+@login_required
+def api_job_status(job_id):
+    job = RenderJob.query.get_or_404(job_id)
+    if job.video.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({"error": "Not allowed"}), 403
+    
+    return jsonify({
+        "job_id": job.id,
+        "video_uuid": job.video.uuid,
+        "status": job.status,
+        "video_status": job.video.status,
+        "video_url": job.video.cloudinary_url,
+        "preview_url": job.video.preview_url,
+        "attempts": job.attempts,
+        "encoding_profile": job.encoding_profile,
+        "stage": job.stage,
+        "progress": job.progress,
+        "eta_seconds": job.eta_seconds,
+        "stage_timings": json.loads(job.stage_timings) if job.stage_timings else {},
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    })
+
+def video_status_payload(video, job):
+    """Status of a video and its latest render job, as sent to clients"""
+    return {
+        "video_uuid": video.uuid,
+        "video_status": video.status,
+        "video_url": video.cloudinary_url,
+        "preview_url": video.preview_url,
+        "poster_url": video.poster_url,
+        "duration": video.duration,
+        "job_id": job.id if job else None,
+        "job_status": job.status if job else None,
+        "stage": job.stage if job else None,
+        "progress": job.progress if job else None,
+        "eta_seconds": job.eta_seconds if job else None,
+        "stage_timings": json.loads(job.stage_timings) if job and job.stage_timings else {}
+    }
+
+@app.route("/api/videos/<video_uuid>/events")
+@login_required
+def api_video_events(video_uuid):
+    """Server-sent events stream of status/progress changes for one video"""
+    video = Video.query.filter_by(uuid=video_uuid).first_or_404()
+    if video.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({"error": "Not allowed"}), 403
+    video_id = video.id
+    
+    def current_status():
+        # End the previous transaction so every poll sees fresh rows
+        db.session.rollback()
+        video = Video.query.get(video_id)
+        if video is None:
+            return None, True
+        job = RenderJob.query.filter_by(video_id=video_id).order_by(RenderJob.id.desc()).first()
+        finished = video.status in ('completed', 'failed') and (job is None or job.status in ('completed', 'failed'))
+        return json.dumps(video_status_payload(video, job)), finished
+    
+    def events():
+        if not _sse_slots.acquire(blocking=False):
+            # All stream slots are taken: answer like a poll, the client's
+            # EventSource asks again after the retry delay
+            payload, _ = current_status()
+            if payload is None:
+                yield "event: deleted\ndata: {}\n\n"
+                return
+            yield f"retry: {SSE_BUSY_RETRY_MS}\nevent: status\ndata: {payload}\n\n"
+            return
+        try:
+            last_payload = None
+            last_sent = time.time()
+            deadline = time.time() + SSE_MAX_SECONDS
+            while time.time() < deadline:
+                payload, finished = current_status()
+                if payload is None:
+                    yield "event: deleted\ndata: {}\n\n"
+                    return
+                if payload != last_payload:
+                    yield f"event: status\ndata: {payload}\n\n"
+                    last_payload = payload
+                    last_sent = time.time()
+                    if finished:
+                        return
+                elif time.time() - last_sent > 15:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    last_sent = time.time()
+                time.sleep(SSE_POLL_INTERVAL)
+            # The client's EventSource reconnects automatically after this
+            yield "retry: 1000\n\n"
+        finally:
+            _sse_slots.release()
+    
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/videos/<video_uuid>/slides", methods=["GET", "POST"])
+@login_required
+def api_video_slides(video_uuid):
+    """
+    GET: list the slides of a reel.
+    POST: replace, reorder or remove slides and queue a re-render. Form fields:
+        order - JSON list of image file names (or {"file", "duration"} objects) in the new order
+        files - optional new images; they may be referenced by name in order
+    Only slides whose image or duration changed are encoded again.
+    """
+    video = Video.query.filter_by(uuid=video_uuid).first_or_404()
+    if video.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({"error": "Not allowed"}), 403
+    
+    slides = read_input_list(video.uuid)
+    if slides is None:
+        return jsonify({"error": "This reel has no slide list"}), 404
+    
+    if request.method == "GET":
+        return jsonify({
+            "video_uuid": video.uuid,
+            "slides": [{"file": f, "duration": d} for f, d in slides]
+        })
+    
+    active_job = RenderJob.query.filter(RenderJob.video_id == video.id,
+                                        RenderJob.status.in_(['queued', 'running'])).first()
+    if active_job:
+        return jsonify({"error": "This reel is still rendering", "job_id": active_job.id}), 409
+    
+    try:
+        order = json.loads(request.form.get("order", ""))
+        if not isinstance(order, list) or not order:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "order must be a non-empty JSON list"}), 400
+    
+    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], video.uuid)
+    for file in request.files.getlist("files"):
+        if file and file.filename:
+            filename = secure_filename(file.filename)
+            if filename.rsplit('.', 1)[-1].lower() not in ALLOWED_EXTENSIONS:
+                return jsonify({"error": f"{file.filename} is not an allowed image type"}), 400
+            file.save(os.path.join(upload_path, filename))
+    
+    durations = dict(slides)
+    new_slides = []
+    for entry in order:
+        if isinstance(entry, dict):
+            name, duration = entry.get("file"), entry.get("duration")
+        else:
+            name, duration = entry, None
+        name = secure_filename(str(name or ""))
+        if not name or not os.path.exists(os.path.join(upload_path, name)):
+            return jsonify({"error": f"Unknown slide image: {name}"}), 400
+        try:
+            duration = float(duration) if duration is not None else float(durations.get(name) or 3)
+        except (TypeError, ValueError):
+            return jsonify({"error": f"Invalid duration for {name}"}), 400
+        # nan, inf and non-positive lengths would only fail later, in the worker
+        if not (math.isfinite(duration) and 0 < duration <= MAX_SLIDE_SECONDS):
+            return jsonify({"error": f"Duration for {name} must be more than 0 and at most "
+                                     f"{MAX_SLIDE_SECONDS} seconds"}), 400
+        new_slides.append((name, f"{duration:g}"))
+    
+    write_input_list(video.uuid, new_slides)
+    
+    last_job = RenderJob.query.filter_by(video_id=video.id).order_by(RenderJob.id.desc()).first()
+    video.status = 'processing'
+    job = enqueue_job(video, last_job.encoding_profile if last_job else None)
+    db.session.commit()
+    
+    status_url = url_for("api_job_status", job_id=job.id)
+    response = jsonify({
+        "job_id": job.id,
+        "video_uuid": video.uuid,
+        "status": job.status,
+        "slides": [{"file": f, "duration": d} for f, d in new_slides],
+        "status_url": status_url
+    })
+    response.headers["Location"] = status_url
+    return response, 202
+
+@app.route("/static/reels/<path:filename>")
+@app.route("/reels/<path:filename>")
+def serve_reel(filename):
+    """
+    Reels and previews that are still served from this server's disk.
+
+    REELS_DIR lies under static/, so the second rule takes its files (and the
+    /static/reels/ URLs of older reels) away from Flask's static handler.
+    """
+    return send_media(REELS_DIR, filename)
+
+@app.route("/media/<path:key>")
+def serve_stored_media(key):
+    """Objects of the local storage backend (STORAGE_BACKEND=local)"""
+    return send_media(LOCAL_STORAGE_DIR, key)
+
+GALLERY_PAGE_SIZE = 24
+GALLERY_MAX_PAGE_SIZE = 100
+
+# Only the columns a gallery card needs (descriptions can be long, but are shown)
+GALLERY_COLUMNS = (Video.id, Video.uuid, Video.user_id, Video.description, Video.status,
+                   Video.created_at, Video.cloudinary_url, Video.preview_url,
+                   Video.poster_url, Video.thumbnail_url, Video.duration)
+
+def encode_cursor(sort_value, video_id):
+    """Opaque keyset cursor for the (sort value, id) position of the last card"""
+    raw = f"{sort_value}|{video_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, parse):
+    """
+    Returns:
+        tuple or None: (parse(sort value), id), None if the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        sort_value, video_id = raw.rsplit("|", 1)
+        return parse(sort_value), int(video_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def gallery_page(args, limit):
+    """
+    One page of gallery videos using keyset pagination: newest first, or most
+    relevant first when searching.
+    
+    Args:
+        args: Request arguments (status, search, user_id, cursor)
+        limit (int): Page size
+        
+    Returns:
+        tuple: (videos, next_cursor or None)
+    """
+    query = Video.query.options(
+        load_only(*GALLERY_COLUMNS),
+        joinedload(Video.user).load_only(User.id, User.username)
+    )
+    
+    status_filter = args.get('status', 'all')
+    if status_filter and status_filter != 'all':
+        query = query.filter(Video.status == status_filter)
+    user_filter = args.get('user_id', '')
+    if user_filter and user_filter.isdigit():
+        query = query.filter(Video.user_id == int(user_filter))
+    
+    search_query = args.get('search', '').strip()
+    if search_query:
+        query, sort_key = search_videos(query, search_query)
+        parse = float
+    else:
+        sort_key = Video.created_at
+        parse = datetime.fromisoformat
+    
+    # Seek past the last card of the previous page instead of OFFSET, so every
+    # page costs the same no matter how deep it is
+    position = decode_cursor(args.get('cursor', ''), parse)
+    if position:
+        sort_value, video_id = position
+        query = query.filter(or_(sort_key < sort_value,
+                                 and_(sort_key == sort_value, Video.id < video_id)))
+    
+    rows = query.add_columns(sort_key).order_by(sort_key.desc(), Video.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last, sort_value = rows[limit - 1]
+        next_cursor = encode_cursor(repr(sort_value) if search_query else sort_value.isoformat(), last.id)
+    return [video for video, _ in rows[:limit]], next_cursor
 
 @app.route("/gallery")
 def gallery():
@@ -202,30 +492,57 @@ def gallery():
     search_query = request.args.get('search', '')
     user_filter = request.args.get('user_id', '')
     
-    # Build query
-    query = Video.query
-    
-    # Apply status filter
-    if status_filter != 'all':
-        query = query.filter_by(status=status_filter)
-    
-    # Apply search filter (search in description)
-    if search_query:
-        query = query.filter(Video.description.contains(search_query))
-    
-    # Apply user filter
-    if user_filter and user_filter.isdigit():
-        query = query.filter_by(user_id=int(user_filter))
-    
-    # Get videos with user information
-    videos = query.order_by(Video.created_at.desc()).all()
+    videos, next_cursor = gallery_page(request.args, GALLERY_PAGE_SIZE)
     
-    # Get all users for filter dropdown
-    users = User.query.all()
+    # Users for the filter dropdown (admins only)
+    users = []
+    if current_user.is_authenticated and current_user.is_admin:
+        users = db.session.query(User.id, User.username).order_by(User.username).all()
     
     return render_template("gallery.html", videos=videos, users=users, 
                          status_filter=status_filter, search_query=search_query, 
-                         user_filter=user_filter)
+                         user_filter=user_filter, next_cursor=next_cursor,
+                         poster_width=POSTER_WIDTH, thumbnail_width=THUMBNAIL_WIDTH)
+
+@app.route("/api/videos")
+def api_videos():
+    """
+    Gallery videos as JSON for infinite scroll.
+    
+    Query args: status, search, user_id, cursor (from next_cursor), limit,
+    include_html=1 to also get the rendered cards.
+    """
+    limit = request.args.get('limit', GALLERY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, GALLERY_MAX_PAGE_SIZE))
+    videos, next_cursor = gallery_page(request.args, limit)
+    
+    payload = {
+        "videos": [{
+            "id": video.id,
+            "uuid": video.uuid,
+            "description": video.description,
+            "status": video.status,
+            "created_at": video.created_at.isoformat() if video.created_at else None,
+            "video_url": video.cloudinary_url,
+            "preview_url": video.preview_url,
+            "poster_url": video.poster_url,
+            "thumbnail_url": video.thumbnail_url,
+            "duration": video.duration,
+            "user": {"id": video.user.id, "username": video.user.username} if video.user else None
+        } for video in videos],
+        "next_cursor": next_cursor,
+        "next_url": None
+    }
+    if next_cursor:
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        payload["next_url"] = url_for("api_videos", **args)
+    if request.args.get('include_html'):
+        payload["html"] = "".join(
+            render_template("gallery_card.html", video=video, poster_width=POSTER_WIDTH,
+                            thumbnail_width=THUMBNAIL_WIDTH)
+            for video in videos)
+    return jsonify(payload)
 
 # User Management Routes
 @app.route("/admin/dashboard")
@@ -235,103 +552,133 @@ def admin_dashboard():
         flash("Admin access required.", "danger")
         return redirect(url_for("home"))
     
-    # Get comprehensive statistics
-    total_users = User.query.count()
-    admin_users = User.query.filter_by(is_admin=True).count()
-    regular_users = total_users - admin_users
-    
-    total_videos = Video.query.count()
-    completed_videos = Video.query.filter_by(status='completed').count()
-    processing_videos = Video.query.filter_by(status='processing').count()
-    failed_videos = Video.query.filter_by(status='failed').count()
+    # Counters come from the daily rollup (stats.py), cached for a few seconds
+    stats = dashboard_stats()
     
-    # Recent activities
+    # Recent activities (indexed on created_at)
     recent_users = User.query.order_by(User.created_at.desc()).limit(5).all()
-    recent_videos = Video.query.order_by(Video.created_at.desc()).limit(10).all()
-    
-    # User with most videos
-    from sqlalchemy import func
-    top_users = db.session.query(
-        User, func.count(Video.id).label('video_count')
-    ).outerjoin(Video).group_by(User.id).order_by(func.count(Video.id).desc()).limit(5).all()
-    
-    # Monthly statistics (last 6 months)
-    from datetime import datetime, timedelta
-    import calendar
-    
-    monthly_stats = []
-    for i in range(6):
-        month_start = datetime.now().replace(day=1) - timedelta(days=30*i)
-        month_end = month_start + timedelta(days=32)
-        month_end = month_end.replace(day=1) - timedelta(days=1)
-        
-        month_users = User.query.filter(
-            User.created_at >= month_start,
-            User.created_at <= month_end
-        ).count()
-        
-        month_videos = Video.query.filter(
-            Video.created_at >= month_start,
-            Video.created_at <= month_end
-        ).count()
-        
-        monthly_stats.append({
-            'month': calendar.month_name[month_start.month],
-            'year': month_start.year,
-            'users': month_users,
-            'videos': month_videos
-        })
+    recent_videos = Video.query.options(joinedload(Video.user)) \
+        .order_by(Video.created_at.desc()).limit(10).all()
     
-    monthly_stats.reverse()
+    # Users with most videos, from the maintained User.video_count
+    top_users = [(user, user.video_count) for user in
+                 User.query.order_by(User.video_count.desc(), User.id).limit(5).all()]
     
     return render_template("admin_dashboard.html",
-                         total_users=total_users,
-                         admin_users=admin_users,
-                         regular_users=regular_users,
-                         total_videos=total_videos,
-                         completed_videos=completed_videos,
-                         processing_videos=processing_videos,
-                         failed_videos=failed_videos,
                          recent_users=recent_users,
                          recent_videos=recent_videos,
                          top_users=top_users,
-                         monthly_stats=monthly_stats)
+                         **stats)
 
-@app.route("/manage/users")
-@login_required
-def manage_users():
-    if not current_user.is_admin:
-        flash("Admin access required.", "danger")
-        return redirect(url_for("home"))
+MANAGE_USERS_PAGE_SIZE = 25
+MANAGE_USERS_MAX_PAGE_SIZE = 100
+
+# Sortable columns of the user list (all indexed)
+MANAGE_USERS_SORTS = {
+    'created': User.created_at,
+    'username': User.username,
+    'videos': User.video_count,
+}
+
+def manage_users_page(args):
+    """
+    One page of the admin user list, filtered and sorted in the database.
     
-    # Get filter parameters
-    search_query = request.args.get('search', '')
-    status_filter = request.args.get('status', 'all')
+    Video counts come from the maintained User.video_count column, so a page
+    is one query plus one aggregate for the totals.
     
-    # Build query
-    query = User.query
+    Args:
+        args: Request arguments (search, status, sort, dir, page, per_page)
+        
+    Returns:
+        dict: users, totals and the normalized filter / paging values
+    """
+    search_query = args.get('search', '').strip()
+    status_filter = args.get('status', 'all')
+    sort = args.get('sort', 'created')
+    if sort not in MANAGE_USERS_SORTS:
+        sort = 'created'
+    direction = 'asc' if args.get('dir') == 'asc' else 'desc'
+    per_page = args.get('per_page', MANAGE_USERS_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, MANAGE_USERS_MAX_PAGE_SIZE))
+    page = max(args.get('page', 1, type=int), 1)
     
-    # Apply search filter
+    query = User.query
     if search_query:
         query = query.filter(or_(
             User.username.contains(search_query),
             User.email.contains(search_query)
         ))
-    
-    # Apply status filter
     if status_filter == 'admin':
         query = query.filter_by(is_admin=True)
     elif status_filter == 'regular':
         query = query.filter_by(is_admin=False)
     
-    users = query.order_by(User.created_at.desc()).all()
+    total, admins, videos = query.with_entities(
+        func.count(User.id),
+        func.coalesce(func.sum(case((User.is_admin, 1), else_=0)), 0),
+        func.coalesce(func.sum(User.video_count), 0)
+    ).order_by(None).one()
+    pages = max((total + per_page - 1) // per_page, 1)
+    page = min(page, pages)
+    
+    column = MANAGE_USERS_SORTS[sort]
+    order = [column.asc(), User.id.asc()] if direction == 'asc' else [column.desc(), User.id.desc()]
+    users = query.order_by(*order).offset((page - 1) * per_page).limit(per_page).all()
+    
+    return {
+        'users': users,
+        'total': total,
+        'admin_count': int(admins),
+        'regular_count': total - int(admins),
+        'video_total': int(videos),
+        'search_query': search_query,
+        'status_filter': status_filter,
+        'sort': sort,
+        'direction': direction,
+        'page': page,
+        'pages': pages,
+        'per_page': per_page,
+    }
+
+@app.route("/manage/users")
+@login_required
+def manage_users():
+    if not current_user.is_admin:
+        flash("Admin access required.", "danger")
+        return redirect(url_for("home"))
+    
+    return render_template("admin_users.html", **manage_users_page(request.args))
+
+@app.route("/api/users")
+@login_required
+def api_users():
+    """
+    The admin user list as JSON, for filtering and paging without a reload.
     
-    # Add video count for each user
-    for user in users:
-        user.video_count = Video.query.filter_by(user_id=user.id).count()
+    Query args: as /manage/users, plus include_html=1 to also get the rendered
+    table rows and mobile cards.
+    """
+    if not current_user.is_admin:
+        return jsonify({"error": "Admin access required"}), 403
     
-    return render_template("admin_users.html", users=users, 
-                         search_query=search_query, status_filter=status_filter)
+    context = manage_users_page(request.args)
+    payload = {
+        "users": [{
+            "id": user.id,
+            "username": user.username,
+            "email": user.email,
+            "is_admin": user.is_admin,
+            "is_super_admin": user.is_super_admin,
+            "video_count": user.video_count,
+            "created_at": user.created_at.isoformat() if user.created_at else None
+        } for user in context['users']],
+        **{key: value for key, value in context.items() if key != 'users'}
+    }
+    if request.args.get('include_html'):
+        payload["rows_html"] = render_template("admin_user_rows.html", users=context['users'])
+        payload["cards_html"] = render_template("admin_user_cards.html", users=context['users'])
+    return jsonify(payload)
 
 @app.route("/manage/user/<int:user_id>")
 @login_required
@@ -364,12 +711,17 @@ def manage_delete_user(user_id):
         flash(f"Cannot delete super admin '{user.username}'. This user is protected.", "error")
         return redirect(url_for("manage_users"))
     
-    # Delete user's videos first (cascade delete)
+    # Remove the stored reels, then the user's videos and their render jobs (cascade delete)
+    delete_reels(Video.query.filter_by(user_id=user_id).all())
+    video_ids = db.session.query(Video.id).filter_by(user_id=user_id)
+    RenderJob.query.filter(RenderJob.video_id.in_(video_ids)).delete(synchronize_session=False)
+    forget_videos(Video.query.filter_by(user_id=user_id))
     Video.query.filter_by(user_id=user_id).delete()
     
     # Delete user
     db.session.delete(user)
     db.session.commit()
+    forget_user(user_id)
     
     flash(f"User '{user.username}' and all their videos have been deleted.", "success")
     return redirect(url_for("manage_users"))
@@ -395,6 +747,7 @@ def manage_toggle_user_admin(user_id):
     
     user.is_admin = not user.is_admin
     db.session.commit()
+    forget_user(user_id)
     
     status = "granted" if user.is_admin else "revoked"
     flash(f"Admin privileges {status} for user '{user.username}'.", "success")
@@ -409,10 +762,8 @@ def manage_delete_video(video_id):
     
     video = Video.query.get_or_404(video_id)
     
-    # Delete video file if it exists locally
-    local_path = f"static/reels/{video.uuid}.mp4"
-    if os.path.exists(local_path):
-        os.remove(local_path)
+    # Delete the stored reel and any local reel/preview files
+    delete_reels([video])
     
     # Delete video folder if it exists
     video_folder = f"user_uploads/{video.uuid}"
@@ -434,19 +785,91 @@ def api_search_users():
         return jsonify({"error": "Admin access required"}), 403
     
     query = request.args.get('q', '')
-    if len(query) < 2:
+    if len(query.strip()) < 2:
         return jsonify([])
     
-    users = User.query.filter(or_(
-        User.username.contains(query),
-        User.email.contains(query)
-    )).limit(10).all()
+    # Prefix match on indexed lower(username) / lower(email), cached per prefix
+    return jsonify(autocomplete_users(query, limit=10))
+
+PROFILES_PAGE_SIZE = 50
+
+@app.route("/manage/profiles")
+@login_required
+def manage_profiles():
+    if not current_user.is_admin:
+        flash("Admin access required.", "danger")
+        return redirect(url_for("home"))
+    
+    kind = request.args.get('kind', '')
+    query = Profile.query.options(defer(Profile.stats), defer(Profile.sql), defer(Profile.data))
+    if kind in ('request', 'job'):
+        query = query.filter_by(kind=kind)
+    profiles = query.order_by(Profile.id.desc()).limit(PROFILES_PAGE_SIZE).all()
+    
+    return render_template("admin_profiles.html", profiles=profiles, kind=kind,
+                           settings=profiling.current_settings(), header=profiling.PROFILE_HEADER,
+                           keep=profiling.PROFILE_KEEP)
+
+@app.route("/manage/profiles/settings", methods=["POST"])
+@login_required
+def manage_profiling_settings():
+    if not current_user.is_admin:
+        flash("Admin access required.", "danger")
+        return redirect(url_for("home"))
+    
+    if request.form.get('action') == 'off':
+        request_rate = job_rate = 0.0
+        minutes = 0
+    else:
+        try:
+            request_rate = float(request.form.get('request_percent') or 0) / 100
+            job_rate = float(request.form.get('job_percent') or 0) / 100
+            minutes = max(1, min(int(request.form.get('minutes') or 60), 24 * 60))
+        except ValueError:
+            flash("Rates and duration must be numbers.", "danger")
+            return redirect(url_for("manage_profiles"))
+    settings = profiling.save_settings(request_rate, job_rate, request.form.get('endpoints', ''),
+                                       minutes, current_user.username)
+    
+    if settings.enabled_until:
+        log.info("Profiling switched on", admin=current_user.username, request_rate=settings.request_rate,
+                 job_rate=settings.job_rate, endpoints=settings.endpoints, until=settings.enabled_until)
+        flash(f"Profiling is on until {settings.enabled_until.strftime('%H:%M')}. "
+              f"Other processes pick it up within {profiling.PROFILING_SETTINGS_TTL:g} seconds.", "success")
+    else:
+        log.info("Profiling switched off", admin=current_user.username)
+        flash("Profiling is off.", "success")
+    return redirect(url_for("manage_profiles"))
+
+@app.route("/manage/profiles/<int:profile_id>")
+@login_required
+def manage_profile_detail(profile_id):
+    if not current_user.is_admin:
+        flash("Admin access required.", "danger")
+        return redirect(url_for("home"))
     
-    return jsonify([{
-        'id': user.id,
-        'username': user.username,
-        'email': user.email,
-        'is_admin': user.is_admin
-    } for user in users])
+    profile = Profile.query.options(defer(Profile.data)).get_or_404(profile_id)
+    return render_template("admin_profile_detail.html", profile=profile, queries=json.loads(profile.sql))
 
+@app.route("/manage/profiles/<int:profile_id>.prof")
+@login_required
+def manage_profile_download(profile_id):
+    """The raw statistics, for python -m pstats or snakeviz"""
+    if not current_user.is_admin:
+        return Response("Forbidden\n", status=403, mimetype='text/plain')
+    
+    profile = Profile.query.get_or_404(profile_id)
+    return Response(profile.data, mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename=profile-{profile.id}.prof'})
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics of all web and worker processes (see metrics.py)"""
+    if metrics.METRICS_TOKEN:
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        allowed = hmac.compare_digest(token.encode(), metrics.METRICS_TOKEN.encode())
+    else:
+        allowed = current_user.is_authenticated and current_user.is_admin
+    if not allowed:
+        return Response("Forbidden\n", status=403, mimetype='text/plain')
+    return Response(metrics.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
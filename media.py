@@ -0,0 +1,122 @@
+"""
+Serving locally stored reels.
+
+Reels that are not (yet) on the CDN are served from disk by send_media()
+instead of Flask's static handler:
+
+- Range requests get 206 Partial Content, so seeking in a <video> only fetches
+  the bytes it needs. A request for several ranges gets the whole file (200);
+  416 is only for a single range past the end of the file.
+- ETag / Last-Modified are validated, so revisits get 304 Not Modified.
+- The body is handed to the server's wsgi.file_wrapper, which lets gunicorn
+  use sendfile(2) (also for ranges): the bytes are copied by the kernel rather
+  than by a Python worker thread.
+
+With MEDIA_ACCEL_PREFIX (nginx X-Accel-Redirect) or MEDIA_X_SENDFILE (Apache /
+lighttpd X-Sendfile) set, only the headers come from Python and the front proxy
+sends the file itself, including ranges.
+"""
+import os
+import mimetypes
+
+from flask import request, abort, Response
+from werkzeug.security import safe_join
+from werkzeug.datastructures import ContentRange
+
+# e.g. "/internal" with an nginx "location /internal/ { internal; alias /app/; }"
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '').rstrip('/')
+MEDIA_X_SENDFILE = os.environ.get('MEDIA_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', 3600))
+BLOCK_SIZE = 256 * 1024
+
+
+def _read_range(f, length):
+    """Fallback body for servers without wsgi.file_wrapper"""
+    try:
+        while length > 0:
+            chunk = f.read(min(BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _not_modified(etag, mtime):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since:
+        return int(mtime) <= request.if_modified_since.timestamp()
+    return False
+
+
+def _range_applies(etag, mtime):
+    """A Range is honoured unless an If-Range validator says the file changed"""
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return int(mtime) <= if_range.date.timestamp()
+    return True
+
+
+def send_media(root, filename):
+    """
+    Serve root/filename with Range, conditional-request and sendfile support.
+
+    Args:
+        root (str): Directory the file must be inside
+        filename (str): Path relative to root, taken from the URL
+
+    Returns:
+        flask.Response: 200, 206, 304 or 416
+    """
+    path = safe_join(root, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f"{stat.st_mtime_ns:x}-{size:x}"
+
+    response = Response(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.set_etag(etag)
+    response.last_modified = int(stat.st_mtime)
+    response.cache_control.public = True
+    response.cache_control.max_age = MEDIA_MAX_AGE
+    response.accept_ranges = 'bytes'
+
+    if _not_modified(etag, stat.st_mtime):
+        response.status_code = 304
+        return response
+
+    # Let the front proxy send the bytes; it handles Range itself
+    if MEDIA_ACCEL_PREFIX:
+        response.headers['X-Accel-Redirect'] = f"{MEDIA_ACCEL_PREFIX}/{os.path.relpath(path)}"
+        return response
+    if MEDIA_X_SENDFILE:
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+        return response
+
+    start, end = 0, size
+    # Multiple ranges would need a multipart/byteranges body; RFC 7233 lets us
+    # ignore the header and send the whole file instead
+    if request.range and len(request.range.ranges) == 1 and _range_applies(etag, stat.st_mtime):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response.status_code = 416
+            response.content_range = ContentRange('bytes', None, None, size)
+            return response
+        start, end = byte_range
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, end, size)
+
+    f = open(path, 'rb')
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    # The server sends Content-Length bytes from the current offset (gunicorn: sendfile)
+    response.response = file_wrapper(f, BLOCK_SIZE) if file_wrapper else _read_range(f, end - start)
+    response.content_length = end - start
+    response.direct_passthrough = True
+    return response
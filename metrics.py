@@ -0,0 +1,341 @@
+"""
+Prometheus metrics for the web app and the render pipeline.
+
+Metrics are defined here and updated in place by the code they measure:
+
+    with FFMPEG_SECONDS.time(step='concat'):
+        ...
+    RENDER_FAILURES.inc(cause='concat')
+
+Counters and histograms live in process memory, so updating one costs a
+lock and a few additions. Web and render workers run as separate processes,
+so each process writes a snapshot of its values to the metrics_snapshot
+table every METRICS_FLUSH_INTERVAL seconds, from a background thread. The
+write doubles as a heartbeat, so it happens even when nothing changed. A
+forked child starts from zero under a name of its own. GET /metrics adds up
+the snapshots of the live processes. The serving process uses its live
+values instead of its own snapshot. Gauges for video status and queue depth
+are read from the database at scrape time.
+
+A process deletes its snapshot when it shuts down cleanly. The snapshot of a
+process that died without doing so stops being counted, and is deleted, once
+it has not been refreshed for METRICS_SNAPSHOT_MAX_AGE seconds. Either way
+Prometheus treats the drop in the counters as a reset, as it does for any
+restarted process.
+
+Settings:
+    METRICS_TOKEN             bearer token for /metrics; without it only admins may read it
+    METRICS_FLUSH_INTERVAL    seconds between snapshots of a process (default 15)
+    METRICS_SNAPSHOT_MAX_AGE  seconds after which a silent process counts as gone (default 4 flush intervals)
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import bisect
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from logs import get_logger
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 15))
+METRICS_SNAPSHOT_MAX_AGE = float(os.environ.get('METRICS_SNAPSHOT_MAX_AGE', 4 * METRICS_FLUSH_INTERVAL))
+
+# Upper bounds in seconds: web requests, and pipeline steps (TTS, ffmpeg, uploads)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PIPELINE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+COMMIT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+log = get_logger(__name__)
+
+_lock = threading.Lock()
+_registry = {}
+_state = {'process': None, 'pid': None, 'dirty': False, 'flusher': None}
+
+
+def _process_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{int(time.time())}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # {label values tuple: value}
+        self.values = {}
+        _registry[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _changed(self):
+        _state['dirty'] = True
+        if _state['pid'] != os.getpid():
+            _start_flusher()
+
+
+class Counter(Metric):
+    """A value that only goes up (events, failures)"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self._changed()
+
+
+class Histogram(Metric):
+    """
+    Observations counted into buckets (exposed cumulatively), plus their sum.
+
+    A value is stored as [count per bucket..., count above the last bucket, sum].
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=PIPELINE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+        self._changed()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the with block (also when it raises)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+# --- Web ---
+REQUEST_SECONDS = Histogram('reels_http_request_duration_seconds', 'Time to handle a request, by Flask endpoint',
+                            ['endpoint', 'method', 'status'], REQUEST_BUCKETS)
+
+# --- Render pipeline ---
+TTS_SECONDS = Histogram('reels_tts_seconds', 'text_to_speech_file latency (outcome: speech, cache or fallback)',
+                        ['outcome'])
+TTS_FALLBACKS = Counter('reels_tts_fallbacks_total', 'Narrations replaced by background music, by reason',
+                        ['reason'])
+TTS_CACHE_LOOKUPS = Counter('reels_tts_cache_lookups_total', 'TTS audio cache lookups (result: hit or miss)',
+                            ['result'])
+TTS_CACHE_EVICTIONS = Counter('reels_tts_cache_evictions_total', 'TTS audio cache entries evicted for space')
+TTS_API_ATTEMPTS = Counter('reels_tts_api_attempts_total', 'ElevenLabs requests, retries included, by outcome',
+                           ['outcome'])
+TTS_CIRCUIT_OPENS = Counter('reels_tts_circuit_opens_total', 'Times the ElevenLabs circuit breaker opened')
+FFMPEG_SECONDS = Histogram('reels_ffmpeg_seconds', 'Wall time of ffmpeg runs, by pipeline step', ['step'])
+FFMPEG_CPU_SECONDS = Histogram('reels_ffmpeg_cpu_seconds', 'CPU time (user + system) of ffmpeg runs, by step',
+                               ['step'])
+UPLOAD_SECONDS = Histogram('reels_upload_seconds', 'Reel upload time including retries, by storage backend',
+                           ['storage', 'outcome'])
+STATUS_COMMIT_SECONDS = Histogram('reels_video_status_commit_seconds', 'update_video_status() commit time',
+                                  ['status'], COMMIT_BUCKETS)
+RENDER_FAILURES = Counter('reels_render_failures_total', 'Renders that failed, by cause', ['cause'])
+
+
+def _reset_in_child():
+    # A forked process counts from zero under its own name; the parent keeps reporting its values
+    with _lock:
+        for metric in _registry.values():
+            metric.values.clear()
+    _state.update(process=None, pid=None, dirty=False, flusher=None)
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def _start_flusher():
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        _state['pid'] = os.getpid()
+        _state['process'] = _process_name()
+        flusher = threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True)
+        _state['flusher'] = flusher
+    flusher.start()
+
+
+def _flush_loop():
+    me = threading.current_thread()
+    while _state['flusher'] is me:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush_metrics(heartbeat=True)
+        except Exception as e:
+            log.warning("Could not write metrics snapshot", error=str(e))
+
+
+def snapshot():
+    """This process's values: {name: [[label values, value], ...]}"""
+    with _lock:
+        return {name: [[list(key), list(value) if isinstance(value, list) else value]
+                       for key, value in metric.values.items()]
+                for name, metric in _registry.items() if metric.values}
+
+
+def flush_metrics(heartbeat=False):
+    """
+    Write this process's snapshot if anything changed since the last one.
+
+    Args:
+        heartbeat (bool): Write it anyway, to show that the process is alive
+    """
+    # Scripts that never loaded the app (tests, tools) have nowhere to write to
+    if not (_state['dirty'] or heartbeat) or _state['pid'] != os.getpid() or 'app' not in sys.modules:
+        return
+    _state['dirty'] = False
+    from app import app, db, MetricsSnapshot
+    table = MetricsSnapshot.__table__
+    values = {'data': json.dumps(snapshot()), 'updated_at': datetime.now()}
+    try:
+        with app.app_context():
+            with db.engine.begin() as conn:
+                result = conn.execute(table.update().where(table.c.process == _state['process']).values(**values))
+                if result.rowcount == 0:
+                    conn.execute(table.insert().values(process=_state['process'], **values))
+    except Exception:
+        _state['dirty'] = True
+        raise
+
+
+def drop_snapshot():
+    """Stop reporting and delete this process's snapshot (on a clean shutdown)"""
+    if _state['pid'] != os.getpid() or 'app' not in sys.modules:
+        return
+    _state['flusher'] = None
+    from app import app, db, MetricsSnapshot
+    table = MetricsSnapshot.__table__
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(table.delete().where(table.c.process == _state['process']))
+
+
+def _drop_at_exit():
+    try:
+        drop_snapshot()
+    except Exception:
+        pass
+
+
+atexit.register(_drop_at_exit)
+
+
+def _merge(totals, data):
+    for name, rows in data.items():
+        metric = _registry.get(name)
+        if metric is None:
+            continue
+        merged = totals.setdefault(name, {})
+        for key, value in rows:
+            key = tuple(key)
+            if isinstance(value, list):
+                current = merged.get(key)
+                if current is None or len(current) != len(value):
+                    # First value, or the buckets changed between releases: keep the newest
+                    merged[key] = list(value)
+                else:
+                    merged[key] = [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+
+def collect():
+    """
+    Values of every metric summed over all live processes.
+
+    A process is live while its snapshot is younger than
+    METRICS_SNAPSHOT_MAX_AGE; older snapshots are deleted.
+
+    Returns:
+        dict: {name: {label values tuple: value}}
+    """
+    from app import db, MetricsSnapshot
+    totals = {}
+    _merge(totals, snapshot())
+    cutoff = datetime.now() - timedelta(seconds=METRICS_SNAPSHOT_MAX_AGE)
+    MetricsSnapshot.query.filter(MetricsSnapshot.updated_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    for process, data in db.session.query(MetricsSnapshot.process, MetricsSnapshot.data):
+        if process == _state['process'] and _state['pid'] == os.getpid():
+            continue
+        try:
+            _merge(totals, json.loads(data))
+        except ValueError:
+            log.warning("Skipping unreadable metrics snapshot", process=process)
+    return totals
+
+
+def _label_value(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _gauges():
+    """(name, help, labelname, {label: value}) read from the database at scrape time"""
+    from app import db, RenderJob, DailyStats
+    from stats import STATUS_COLUMNS
+    totals = db.session.query(*[db.func.coalesce(db.func.sum(getattr(DailyStats, status)), 0)
+                                for status in STATUS_COLUMNS]).one()
+    jobs = dict(db.session.query(RenderJob.status, db.func.count())
+                .filter(RenderJob.status.in_(('queued', 'running'))).group_by(RenderJob.status).all())
+    return [
+        ('reels_videos', 'Videos by status', 'status',
+         {status: int(count) for status, count in zip(STATUS_COLUMNS, totals)}),
+        ('reels_render_jobs', 'Render jobs waiting or running', 'status',
+         {status: jobs.get(status, 0) for status in ('queued', 'running')}),
+    ]
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    totals = collect()
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(totals.get(name, {}).items()):
+            if metric.kind == 'counter':
+                lines.append(f"{name}{_labels(metric.labelnames, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                cumulative += count
+                le = (('le', _number(bound)),)
+                lines.append(f"{name}_bucket{_labels(metric.labelnames, key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric.labelnames, key)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(metric.labelnames, key)} {cumulative}")
+    for name, documentation, labelname, values in _gauges():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        for label, value in values.items():
+            lines.append(f"{name}{_labels((labelname,), (label,))} {value}")
+    return '\n'.join(lines) + '\n'
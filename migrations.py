@@ -0,0 +1,322 @@
+"""
+Versioned schema migrations.
+
+db.create_all() only creates missing tables; it never changes an existing
+one. Every schema change is therefore also recorded here as a numbered
+migration, so a database created by an older release is brought up to date
+in place. Applied versions are stored in the schema_migrations table.
+run_migrations() runs at startup (init_app / init_db.py). On PostgreSQL it
+holds an advisory lock, so that web and worker processes starting together
+apply each migration exactly once.
+
+Every migration is idempotent (IF NOT EXISTS / column checks). It also works
+on a fresh database where create_all() already built the current models.
+
+A change that adds a model column must come with the migration that adds it
+to existing tables. After migrating, run_migrations() compares the tables
+with the models and raises SchemaOutOfDate if a column is still missing.
+init_app() lets that propagate, so gunicorn and worker.py refuse to start
+instead of failing queries with "column does not exist".
+
+Usage:
+    python migrations.py            apply pending migrations
+    python migrations.py status     list applied / pending migrations
+    python migrations.py plans      check that hot queries use their indexes
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect, text, select, func
+
+from app import app, db, User, Video, RenderJob, DailyStats, MetricsSnapshot, ProfilingSettings, Profile
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# Arbitrary key for pg_advisory_xact_lock, shared by all processes of the app
+MIGRATION_LOCK_ID = 7_318_004
+
+
+class SchemaOutOfDate(RuntimeError):
+    """Model columns that no migration adds to the existing tables"""
+
+
+def _add_missing_columns(conn, model, names):
+    """ALTER TABLE ... ADD COLUMN for model columns the table does not have yet"""
+    table = model.__table__
+    existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+    for name in names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        column_type = column.type.compile(dialect=conn.dialect)
+        if column.server_default is not None:
+            column_type += f" DEFAULT {column.server_default.arg}"
+        if not column.nullable and column.server_default is not None:
+            column_type += " NOT NULL"
+        conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{name}" {column_type}'))
+        log.info("Added column", table=table.name, column=name)
+
+
+def _create_index(conn, name, table, columns, unique=False):
+    conn.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {name} '
+                      f'ON "{table}" ({", ".join(columns)})'))
+
+
+def add_pipeline_columns(conn):
+    """Columns added to existing tables by the render pipeline"""
+    _add_missing_columns(conn, Video, ['preview_url', 'poster_url', 'thumbnail_url'])
+    _add_missing_columns(conn, RenderJob, ['encoding_profile', 'stage', 'progress', 'eta_seconds',
+                                           'stage_timings'])
+
+
+def video_uuid_unique(conn):
+    """update_video_status() and the API look videos up by uuid"""
+    duplicates = conn.execute(text(
+        "SELECT uuid, COUNT(*) FROM video GROUP BY uuid HAVING COUNT(*) > 1 LIMIT 10")).all()
+    if duplicates:
+        raise RuntimeError("Cannot add a unique index on video.uuid, duplicate uuids: "
+                           + ", ".join(f"{uuid} ({count}x)" for uuid, count in duplicates))
+    _create_index(conn, 'ux_video_uuid', 'video', ['uuid'], unique=True)
+
+
+def video_status_created_at(conn):
+    """Gallery / admin status filters and counts, the orphan scan of the worker"""
+    _create_index(conn, 'ix_video_status_created_at', 'video', ['status', 'created_at'])
+
+
+def video_user_created_at(conn):
+    """A user's videos, newest first (gallery filter, admin user pages)"""
+    _create_index(conn, 'ix_video_user_created_at', 'video', ['user_id', 'created_at'])
+
+
+def render_job_indexes(conn):
+    """Claiming the oldest queued job and finding the jobs of a video"""
+    _create_index(conn, 'ix_render_job_status_created_at', 'render_job', ['status', 'created_at'])
+    _create_index(conn, 'ix_render_job_video_id', 'render_job', ['video_id'])
+
+
+def video_full_text_search(conn):
+    from search import ensure_search_index
+    log.info("Video search index ready", backend=ensure_search_index(conn))
+
+
+def daily_stats_rollup(conn):
+    """Admin dashboard counters (stats.py): User.video_count and the daily_stats table"""
+    from stats import backfill
+    _add_missing_columns(conn, User, ['video_count'])
+    DailyStats.__table__.create(conn, checkfirst=True)
+    _create_index(conn, 'ix_user_created_at', 'user', ['created_at'])
+    _create_index(conn, 'ix_user_video_count', 'user', ['video_count'])
+    _create_index(conn, 'ix_video_created_at', 'video', ['created_at'])
+    backfill(conn)
+
+
+def user_autocomplete_index(conn):
+    """Prefix lookups of usernames and emails for the admin user autocomplete"""
+    from search import ensure_user_prefix_index
+    ensure_user_prefix_index(conn)
+
+
+def metrics_snapshots(conn):
+    """Per-process metric values that /metrics adds up (metrics.py)"""
+    MetricsSnapshot.__table__.create(conn, checkfirst=True)
+
+
+def profiling_tables(conn):
+    """The profiling switch and the stored profiles (profiling.py)"""
+    ProfilingSettings.__table__.create(conn, checkfirst=True)
+    Profile.__table__.create(conn, checkfirst=True)
+
+
+def render_job_heartbeat(conn):
+    """Running jobs are judged stale by their last progress report (job_queue.py)"""
+    _add_missing_columns(conn, RenderJob, ['heartbeat_at'])
+
+
+# (version, migration) in the order they must be applied; never renumber
+MIGRATIONS = [
+    (1, add_pipeline_columns),
+    (2, video_uuid_unique),
+    (3, video_status_created_at),
+    (4, video_user_created_at),
+    (5, render_job_indexes),
+    (6, video_full_text_search),
+    (7, daily_stats_rollup),
+    (8, user_autocomplete_index),
+    (9, metrics_snapshots),
+    (10, profiling_tables),
+    (11, render_job_heartbeat),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, applied_at TIMESTAMP NOT NULL)"))
+
+
+def applied_versions(conn):
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def missing_columns(conn):
+    """
+    Returns:
+        list: "table.column" for every model column the database lacks
+    """
+    tables = set(inspect(conn).get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            missing.append(f"{table.name}.*")
+            continue
+        existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+        missing.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in existing)
+    return missing
+
+
+def run_migrations(engine=None):
+    """
+    Apply all pending migrations, each in its own transaction.
+
+    Args:
+        engine: Database to migrate; defaults to the app's
+
+    Returns:
+        list: Names of the migrations applied by this call
+
+    Raises:
+        SchemaOutOfDate: If model columns are still missing afterwards
+    """
+    engine = engine or db.engine
+    applied = []
+    for version, migration in MIGRATIONS:
+        with engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                # Serialize concurrent startups; released at commit
+                conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {'id': MIGRATION_LOCK_ID})
+            if version in applied_versions(conn):
+                continue
+            log.info("Applying migration", version=version, name=migration.__name__)
+            migration(conn)
+            conn.execute(text("INSERT INTO schema_migrations (version, name, applied_at) "
+                              "VALUES (:version, :name, :applied_at)"),
+                         {'version': version, 'name': migration.__name__, 'applied_at': datetime.now()})
+            applied.append(migration.__name__)
+    with engine.connect() as conn:
+        missing = missing_columns(conn)
+    if missing:
+        raise SchemaOutOfDate("No migration adds these model columns to the existing tables: " + ", ".join(missing))
+    return applied
+
+
+def migration_status():
+    """
+    Returns:
+        list: (version, name, applied) for every known migration
+    """
+    with db.engine.begin() as conn:
+        done = applied_versions(conn)
+    return [(version, migration.__name__, version in done) for version, migration in MIGRATIONS]
+
+
+def autocomplete_sql(conn, column):
+    """The prefix query autocomplete_users() runs, as SQL for this dialect"""
+    from search import _prefix_match
+    expression = getattr(User, column)
+    query = select(User.id).where(*_prefix_match(expression, 'ad')).order_by(func.lower(expression)).limit(10)
+    return str(query.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+
+
+# Hot-path queries and the index each one must use (SQL, or a function of the
+# connection for queries whose SQL depends on the dialect)
+PLAN_CHECKS = [
+    ("update_video_status: video by uuid",
+     "SELECT id FROM video WHERE uuid = 'x'",
+     'ux_video_uuid'),
+    ("gallery: status filter, newest first",
+     "SELECT id FROM video WHERE status = 'completed' ORDER BY created_at DESC, id DESC LIMIT 25",
+     'ix_video_status_created_at'),
+    ("admin dashboard: count by status",
+     "SELECT COUNT(*) FROM video WHERE status = 'processing'",
+     'ix_video_status_created_at'),
+    ("admin dashboard: recent videos",
+     "SELECT id FROM video ORDER BY created_at DESC LIMIT 10",
+     'ix_video_created_at'),
+    ("admin dashboard: top creators",
+     'SELECT id FROM "user" ORDER BY video_count DESC LIMIT 5',
+     'ix_user_video_count'),
+    ("worker: orphaned processing videos",
+     "SELECT id FROM video WHERE status = 'processing' "
+     "AND NOT EXISTS (SELECT 1 FROM render_job WHERE render_job.video_id = video.id)",
+     'ix_video_status_created_at'),
+    ("gallery / admin: videos of a user, newest first",
+     "SELECT id FROM video WHERE user_id = 1 ORDER BY created_at DESC LIMIT 25",
+     'ix_video_user_created_at'),
+    ("admin: username autocomplete",
+     lambda conn: autocomplete_sql(conn, 'username'),
+     'ix_user_username_prefix'),
+    ("admin: email autocomplete",
+     lambda conn: autocomplete_sql(conn, 'email'),
+     'ix_user_email_prefix'),
+    ("worker: claim the oldest queued job",
+     "SELECT id FROM render_job WHERE status = 'queued' ORDER BY created_at, id LIMIT 1",
+     'ix_render_job_status_created_at'),
+]
+
+
+def explain(conn, sql):
+    """The query plan of sql as text"""
+    if conn.dialect.name == 'postgresql':
+        rows = conn.execute(text(f"EXPLAIN {sql}")).all()
+        return "\n".join(row[0] for row in rows)
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def check_query_plans(verbose=True):
+    """
+    Check that each PLAN_CHECKS query is planned with its index.
+
+    On PostgreSQL, sequential scans are disabled for the check. A small
+    table is otherwise cheaper to scan, and the check asks whether the index
+    can serve the query, not what the planner picks for today's row count.
+
+    Returns:
+        bool: True if every query uses its index
+    """
+    ok = True
+    with db.engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+            for label, sql, index in PLAN_CHECKS:
+                plan = explain(conn, sql(conn) if callable(sql) else sql)
+                passed = index in plan
+                ok = ok and passed
+                if verbose:
+                    print(f"[{'PASS' if passed else 'FAIL'}] {label} (expects {index})")
+                    for line in plan.splitlines():
+                        print(f"        {line}")
+        finally:
+            trans.rollback()
+    return ok
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    with app.app_context():
+        if command == 'upgrade':
+            applied = run_migrations()
+            print(f"[MIGRATE] Applied {len(applied)} migration(s)" if applied else "[MIGRATE] Schema is up to date")
+        elif command == 'status':
+            for version, name, done in migration_status():
+                print(f"{version:03d} {name:<30} {'applied' if done else 'pending'}")
+        elif command == 'plans':
+            sys.exit(0 if check_query_plans() else 1)
+        else:
+            print(f"Unknown command '{command}' (expected upgrade, status or plans)")
+            sys.exit(1)
@@ -0,0 +1,281 @@
+"""
+On-demand profiling of web requests and render jobs.
+
+Admins switch profiling on at /manage/profiles, for a limited time. It then
+profiles a sampled fraction of requests (all endpoints, or only the listed
+ones) and of render jobs. A single request can also be profiled by sending it
+with the header "X-Profile: 1" while logged in as an admin. The response then
+carries the id of its profile in X-Profile-Id.
+
+A profile runs the request, or create_reel() for a job, under cProfile. It
+stores the top functions by cumulative time, the raw statistics (a .prof file
+for pstats or snakeviz), the wall time, and the SQL statements run, grouped by
+statement with their count and time. Only the newest PROFILE_KEEP profiles
+are kept.
+
+Only one profile runs at a time in a process. From Python 3.12, cProfile
+hooks into sys.monitoring, which admits one profiler per process and records
+every thread. A request or job that is picked while another profile is
+running (or another profiling tool is active) is simply not profiled. On a
+threaded server a profile can still include calls made by other requests'
+threads while it runs, so read it alongside its SQL list and wall time.
+
+Each process reads the switch from the database at most every
+PROFILING_SETTINGS_TTL seconds. While profiling is off, a request costs one
+cached lookup. The SQL timing hooks are only installed once a profile has run
+in the process.
+"""
+import io
+import os
+import json
+import time
+import random
+import marshal
+import pstats
+import cProfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
+
+from logs import get_logger
+
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 100))
+PROFILING_SETTINGS_TTL = float(os.environ.get('PROFILING_SETTINGS_TTL', 10))
+PROFILE_HEADER = 'X-Profile'
+# Lines of the cumulative-time listing kept as text
+PROFILE_STATS_LINES = 60
+# Distinct SQL statements kept per profile (the slowest in total)
+PROFILE_SQL_STATEMENTS = 25
+
+log = get_logger(__name__)
+
+Settings = namedtuple('Settings', 'request_rate job_rate endpoints until')
+OFF = Settings(0.0, 0.0, frozenset(), None)
+
+_settings = {'value': OFF, 'expires': 0.0}
+_settings_lock = threading.Lock()
+_active = ContextVar('active_profile', default=None)
+_sql_hooks = {'installed': False}
+_sql_hooks_lock = threading.Lock()
+# Held by the one running profile of this process
+_profiler_lock = threading.Lock()
+
+
+def parse_endpoints(text):
+    return frozenset(name.strip() for name in (text or '').replace('\n', ',').split(',') if name.strip())
+
+
+def current_settings():
+    """
+    The profiling switch, cached per process for PROFILING_SETTINGS_TTL seconds.
+
+    Needs an app context when the cached value has expired.
+
+    Returns:
+        Settings: Rates of 0 when profiling is off or its time is up
+    """
+    now = time.monotonic()
+    with _settings_lock:
+        if now < _settings['expires']:
+            value = _settings['value']
+            return value if value.until is None or datetime.now() < value.until else OFF
+    from app import db, ProfilingSettings
+    try:
+        row = db.session.query(ProfilingSettings.request_rate, ProfilingSettings.job_rate,
+                               ProfilingSettings.endpoints, ProfilingSettings.enabled_until) \
+            .filter(ProfilingSettings.id == 1).first()
+    except Exception as e:
+        # Never let the switch take a request down (e.g. before migrations ran)
+        log.warning("Could not read profiling settings", error=str(e))
+        db.session.rollback()
+        row = None
+    value = OFF
+    if row and row.enabled_until and row.enabled_until > datetime.now():
+        value = Settings(row.request_rate or 0.0, row.job_rate or 0.0, parse_endpoints(row.endpoints),
+                         row.enabled_until)
+    with _settings_lock:
+        _settings['value'] = value
+        _settings['expires'] = now + PROFILING_SETTINGS_TTL
+    return value
+
+
+def invalidate_settings():
+    with _settings_lock:
+        _settings['expires'] = 0.0
+
+
+def save_settings(request_rate, job_rate, endpoints, minutes, admin_name):
+    """Switch profiling on for `minutes` minutes (rates of 0 switch it off)"""
+    from app import db, ProfilingSettings
+    settings = db.session.get(ProfilingSettings, 1) or ProfilingSettings(id=1)
+    settings.request_rate = min(max(request_rate, 0.0), 1.0)
+    settings.job_rate = min(max(job_rate, 0.0), 1.0)
+    settings.endpoints = ', '.join(sorted(parse_endpoints(endpoints))) or None
+    enabled = settings.request_rate > 0 or settings.job_rate > 0
+    settings.enabled_until = datetime.now() + timedelta(minutes=minutes) if enabled else None
+    settings.updated_by = admin_name
+    db.session.add(settings)
+    db.session.commit()
+    invalidate_settings()
+    return settings
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active.get() is not None:
+        conn.info.setdefault('profile_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    run = _active.get()
+    started = conn.info.get('profile_query_started')
+    if run is not None and started:
+        run.record_query(statement, time.perf_counter() - started.pop())
+
+
+def _install_sql_hooks():
+    with _sql_hooks_lock:
+        if not _sql_hooks['installed']:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            _sql_hooks['installed'] = True
+
+
+class ProfileRun:
+    """cProfile and SQL timings of one request or job, from start() to stop()"""
+
+    def __init__(self, kind, name, detail=None, trigger='sample'):
+        self.kind = kind
+        self.name = name
+        self.detail = detail
+        self.trigger = trigger
+        self.queries = {}
+        self.profiler = cProfile.Profile()
+        self.duration = None
+        self._token = None
+
+    def start(self):
+        """
+        Start profiling, unless another profile is running in this process.
+
+        Returns:
+            ProfileRun: self, or None if profiling was busy
+        """
+        if not _profiler_lock.acquire(blocking=False):
+            log.debug("Profiler busy, not profiling", kind=self.kind, name=self.name)
+            return None
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            # Another profiling tool (a debugger, coverage) holds sys.monitoring
+            _profiler_lock.release()
+            log.debug("Profiler unavailable, not profiling", kind=self.kind, name=self.name, error=str(e))
+            return None
+        _install_sql_hooks()
+        self._token = _active.set(self)
+        self.started = time.perf_counter()
+        return self
+
+    def stop(self):
+        if self.duration is not None:
+            return
+        self.profiler.disable()
+        self.duration = time.perf_counter() - self.started
+        if self._token is not None:
+            _active.reset(self._token)
+            self._token = None
+        _profiler_lock.release()
+
+    def record_query(self, statement, seconds):
+        entry = self.queries.get(statement)
+        if entry is None:
+            entry = self.queries[statement] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def save(self, status_code=None):
+        """
+        Store the profile and drop the oldest beyond PROFILE_KEEP.
+
+        Returns:
+            int: Id of the stored profile
+        """
+        from app import app, db, Profile
+        self.profiler.create_stats()
+        data = marshal.dumps(self.profiler.stats)
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(PROFILE_STATS_LINES)
+        slowest = sorted(self.queries.items(), key=lambda item: item[1][1], reverse=True)
+        table = Profile.__table__
+        with app.app_context():
+            with db.engine.begin() as conn:
+                profile_id = conn.execute(table.insert().values(
+                    kind=self.kind,
+                    name=(self.name or '')[:200],
+                    detail=(self.detail or '')[:500] or None,
+                    trigger=self.trigger,
+                    status_code=status_code,
+                    duration_ms=round(self.duration * 1000, 2),
+                    sql_count=sum(count for count, _ in self.queries.values()),
+                    sql_ms=round(sum(seconds for _, seconds in self.queries.values()) * 1000, 2),
+                    stats=stream.getvalue(),
+                    sql=json.dumps([{'sql': statement[:2000], 'count': count, 'ms': round(seconds * 1000, 2)}
+                                    for statement, (count, seconds) in slowest[:PROFILE_SQL_STATEMENTS]]),
+                    data=data,
+                    created_at=datetime.now(),
+                )).inserted_primary_key[0]
+                cutoff = conn.execute(select(table.c.id).order_by(table.c.id.desc())
+                                      .offset(PROFILE_KEEP).limit(1)).scalar()
+                if cutoff is not None:
+                    conn.execute(table.delete().where(table.c.id <= cutoff))
+        log.info("Saved profile", profile_id=profile_id, kind=self.kind, name=self.name,
+                 duration_ms=round(self.duration * 1000, 1), sql_count=sum(c for c, _ in self.queries.values()))
+        return profile_id
+
+
+def request_trigger(endpoint, header_value, is_admin):
+    """
+    Why this request should be profiled: 'header', 'sample', or None.
+
+    Args:
+        endpoint (str): Flask endpoint of the request
+        header_value (str): Value of the X-Profile header, if sent
+        is_admin (callable): Returns whether the current user is an admin
+            (only called when the header is present)
+    """
+    if header_value and header_value not in ('0', 'false') and is_admin():
+        return 'header'
+    settings = current_settings()
+    if not settings.request_rate:
+        return None
+    if settings.endpoints and endpoint not in settings.endpoints:
+        return None
+    return 'sample' if random.random() < settings.request_rate else None
+
+
+@contextmanager
+def profile_job(folder, job_id):
+    """Profile the with block (create_reel of a job) if the job is sampled"""
+    from app import app
+    with app.app_context():
+        rate = current_settings().job_rate
+    if not rate or random.random() >= rate:
+        yield None
+        return
+    run = ProfileRun('job', folder, f"job {job_id}").start()
+    if run is None:
+        yield None
+        return
+    try:
+        yield run
+    finally:
+        run.stop()
+        try:
+            run.save()
+        except Exception as e:
+            log.warning("Could not save job profile", folder=folder, error=str(e))
@@ -0,0 +1,189 @@
+"""
+Content-addressed render cache.
+
+A finished reel is keyed by a hash of its normalized frames, slide durations,
+audio bytes and encoder arguments. Resubmitting identical content (retries,
+reposts, templates) then resolves to the already uploaded URL or to a local
+copy of the MP4 instead of encoding again.
+
+Layout under RENDER_CACHE_DIR:
+    <key>.json   {"url": ..., "file": ...} entry
+    <key>.mp4    local copy of the reel (only while it has no CDN URL)
+
+Local MP4s are evicted least-recently-used first once they exceed
+RENDER_CACHE_MAX_BYTES.
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from logs import get_logger
+
+log = get_logger(__name__)
+
+RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR', 'render_cache')
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def cache_stats():
+    """Hit/miss counters for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+
+def _hash_file(digest, path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+
+def cache_key(frame_paths, durations, audio_path, encoder_args):
+    """
+    Hash everything that determines the output of an encode.
+
+    Args:
+        frame_paths (list): Normalized frame files in reel order
+        durations (list): Per-frame durations (same order)
+        audio_path (str): Narration / music track
+        encoder_args (list): ffmpeg output arguments used for the encode
+    """
+    digest = hashlib.sha256()
+    for path, duration in zip(frame_paths, durations):
+        _hash_file(digest, path)
+        digest.update(f"|duration={duration}|".encode())
+    digest.update(b"|audio|")
+    _hash_file(digest, audio_path)
+    digest.update(("|args|" + "\0".join(encoder_args)).encode())
+    return digest.hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(RENDER_CACHE_DIR, f"{key}.json")
+
+
+def _video_path(key):
+    return os.path.join(RENDER_CACHE_DIR, f"{key}.mp4")
+
+
+def _write_entry(key, entry):
+    os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+    # Atomic replace so concurrent workers never read a half-written entry
+    fd, tmp_path = tempfile.mkstemp(dir=RENDER_CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, _entry_path(key))
+
+
+def lookup(key):
+    """
+    Returns:
+        dict or None: {'url': str or None, 'file': local mp4 path or None}
+    """
+    try:
+        with open(_entry_path(key)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        _count('misses')
+        return None
+
+    file_path = _video_path(key)
+    if entry.get('url'):
+        _count('hits')
+        return {'url': entry['url'], 'file': None}
+    if os.path.exists(file_path):
+        os.utime(file_path)  # mark as recently used for LRU eviction
+        _count('hits')
+        return {'url': None, 'file': file_path}
+
+    # Local copy was evicted and there is no URL: the entry is useless
+    _count('misses')
+    return None
+
+
+def _link_or_copy(src, dest):
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+def store_file(key, video_path):
+    """Keep a local copy of a freshly encoded reel"""
+    os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+    _link_or_copy(video_path, _video_path(key))
+    _write_entry(key, {'url': None})
+    _count('stores')
+    evict()
+
+
+def store_url(key, url):
+    """Record the permanent URL of a reel; the local copy is no longer needed"""
+    _write_entry(key, {'url': url})
+    if os.path.exists(_video_path(key)):
+        os.remove(_video_path(key))
+
+
+def restore_file(entry, dest_path):
+    """Place a cached local reel at dest_path without re-encoding"""
+    _link_or_copy(entry['file'], dest_path)
+
+
+def evict(max_bytes=RENDER_CACHE_MAX_BYTES):
+    """Remove least-recently-used local reels until the cache fits in max_bytes"""
+    files = []
+    for name in os.listdir(RENDER_CACHE_DIR):
+        if name.endswith('.mp4'):
+            path = os.path.join(RENDER_CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            entry_path = path[:-len('.mp4')] + '.json'
+            if os.path.exists(entry_path):
+                os.remove(entry_path)
+        except OSError:
+            continue
+        total -= size
+        _count('evictions')
+        log.info("Evicted render cache entry", file=os.path.basename(path), size=size)
+
+
+def forget_urls(urls):
+    """Drop entries that point at stored reels which are being deleted"""
+    urls = set(urls)
+    if not urls or not os.path.isdir(RENDER_CACHE_DIR):
+        return
+    for name in os.listdir(RENDER_CACHE_DIR):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(RENDER_CACHE_DIR, name)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            if entry.get('url') in urls:
+                os.remove(path)
+        except (OSError, ValueError):
+            continue
@@ -0,0 +1,247 @@
+"""
+Full-text search over video descriptions.
+
+PostgreSQL: video.search_vector is a generated tsvector column (so the
+database keeps it in sync on every insert and update) with a GIN index;
+queries use websearch_to_tsquery() and are ranked with ts_rank_cd().
+
+SQLite: an external-content FTS5 table video_fts mirrors video.description
+through insert/update/delete triggers; queries use MATCH and are ranked with
+bm25().
+
+ensure_search_index() creates whichever applies; it runs as a schema
+migration (migrations.py). On databases where neither is available, search falls back to a
+LIKE scan.
+
+User autocomplete (admin) matches prefixes of the lower-cased username and
+email through expression indexes (ensure_user_prefix_index()), so a lookup
+is a short index range scan. Results are cached per prefix for
+AUTOCOMPLETE_CACHE_TTL seconds; the cache is cleared whenever a user is
+created, changed or deleted in this process.
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import text, func, false, literal, literal_column, event
+from sqlalchemy.orm import Session
+
+from app import db, User, Video
+from logs import get_logger
+
+# Text search configuration (stemming / stop words) on PostgreSQL
+SEARCH_TEXT_CONFIG = os.environ.get('SEARCH_TEXT_CONFIG', 'english')
+AUTOCOMPLETE_CACHE_TTL = float(os.environ.get('AUTOCOMPLETE_CACHE_TTL', 60))
+AUTOCOMPLETE_CACHE_SIZE = 1024
+
+log = get_logger(__name__)
+
+_backend = None
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def ensure_search_index(conn):
+    """
+    Create the full-text index for video descriptions if it does not exist.
+
+    Run by the video_full_text_search migration (migrations.py).
+
+    Args:
+        conn: A connection inside the migration transaction
+
+    Returns:
+        str: The search backend in use ('postgresql', 'fts5' or 'like')
+    """
+    global _backend
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        if not re.fullmatch(r'[a-z_]+', SEARCH_TEXT_CONFIG):
+            raise ValueError(f"Invalid SEARCH_TEXT_CONFIG: {SEARCH_TEXT_CONFIG}")
+        conn.execute(text(
+            "ALTER TABLE video ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(description, ''))) STORED"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_video_search_vector ON video USING GIN (search_vector)"))
+        _backend = 'postgresql'
+    elif dialect == 'sqlite':
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'video_fts'")).first()
+        try:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS video_fts USING fts5("
+                "description, content='video', content_rowid='id', tokenize='porter unicode61')"))
+        except Exception as e:
+            # SQLite builds without FTS5
+            log.warning("Full-text search unavailable, falling back to LIKE", error=str(e))
+            _backend = 'like'
+            return _backend
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS video_fts_insert AFTER INSERT ON video BEGIN "
+            "INSERT INTO video_fts(rowid, description) VALUES (new.id, new.description); END"))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS video_fts_delete AFTER DELETE ON video BEGIN "
+            "INSERT INTO video_fts(video_fts, rowid, description) VALUES ('delete', old.id, old.description); END"))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS video_fts_update AFTER UPDATE OF description ON video BEGIN "
+            "INSERT INTO video_fts(video_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+            "INSERT INTO video_fts(rowid, description) VALUES (new.id, new.description); END"))
+        if not exists:
+            # Index the rows that existed before the FTS table
+            conn.execute(text("INSERT INTO video_fts(video_fts) VALUES ('rebuild')"))
+        _backend = 'fts5'
+    else:
+        _backend = 'like'
+    return _backend
+
+
+def search_backend():
+    """The search backend of this database (detected once per process)"""
+    global _backend
+    if _backend is None:
+        if _dialect() == 'postgresql':
+            _backend = 'postgresql'
+        elif _dialect() == 'sqlite':
+            with db.engine.connect() as conn:
+                exists = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'video_fts'")).first()
+            _backend = 'fts5' if exists else 'like'
+        else:
+            _backend = 'like'
+    return _backend
+
+
+def fts5_query(terms):
+    """
+    Turn free text into a safe FTS5 query: every word must match, the last
+    one as a prefix (search-as-you-type).
+    """
+    words = re.findall(r'\w+', terms)
+    if not words:
+        return None
+    quoted = [f'"{word}"' for word in words]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_videos(query, terms):
+    """
+    Restrict a query over Video to descriptions matching terms.
+
+    Args:
+        query: A query selecting from Video (or a count query over it)
+        terms (str): The user's search text
+
+    Returns:
+        tuple: (query, score) where score is a column expression, higher is
+        more relevant, for ORDER BY and keyset pagination
+    """
+    backend = search_backend()
+    if backend == 'postgresql':
+        vector = literal_column('video.search_vector')
+        tsquery = func.websearch_to_tsquery(literal_column(f"'{SEARCH_TEXT_CONFIG}'::regconfig"), terms)
+        return query.filter(vector.op('@@')(tsquery)), func.ts_rank_cd(vector, tsquery)
+
+    if backend == 'fts5':
+        match = fts5_query(terms)
+        if match is None:
+            return query.filter(false()), literal(0.0)
+        matches = text(
+            "SELECT rowid AS video_id, -bm25(video_fts) AS score FROM video_fts WHERE video_fts MATCH :match"
+        ).bindparams(match=match).columns(video_id=db.Integer, score=db.Float).subquery('fts')
+        return query.join(matches, matches.c.video_id == Video.id), matches.c.score
+
+    return query.filter(Video.description.contains(terms)), literal(0.0)
+
+
+def ensure_user_prefix_index(conn):
+    """
+    Create the expression indexes used by user autocomplete.
+
+    Run by the user_autocomplete_index migration (migrations.py). PostgreSQL
+    needs text_pattern_ops for LIKE 'prefix%' to use a btree index under a
+    non-C collation; SQLite compares lower() values bytewise, so the query
+    uses a range instead of LIKE.
+    """
+    ops = ' text_pattern_ops' if conn.dialect.name == 'postgresql' else ''
+    for column in ('username', 'email'):
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_user_{column}_prefix '
+                          f'ON "user" (lower({column}){ops})'))
+
+
+def _prefix_match(column, prefix):
+    """column starts with prefix (lower-cased), in a form the prefix index serves"""
+    expression = func.lower(column)
+    if _dialect() == 'sqlite':
+        # Every string with the prefix sorts between it and prefix + the highest code point
+        return expression >= prefix, expression < prefix + '\U0010ffff'
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return (expression.like(escaped + '%', escape='\\'),)
+
+
+_autocomplete_cache = OrderedDict()
+_autocomplete_lock = threading.Lock()
+
+
+def clear_user_autocomplete():
+    with _autocomplete_lock:
+        _autocomplete_cache.clear()
+
+
+def autocomplete_users(prefix, limit=10):
+    """
+    Users whose username or email starts with prefix (case-insensitive).
+
+    Args:
+        prefix (str): What the admin has typed so far
+        limit (int): Maximum number of users
+
+    Returns:
+        list: dicts with id, username, email and is_admin; username matches
+        first, in username order
+    """
+    prefix = prefix.strip().lower()
+    key = (prefix, limit)
+    now = time.monotonic()
+    with _autocomplete_lock:
+        cached = _autocomplete_cache.get(key)
+        if cached and now < cached[0]:
+            _autocomplete_cache.move_to_end(key)
+            return cached[1]
+
+    columns = (User.id, User.username, User.email, User.is_admin)
+    rows = db.session.query(*columns).filter(*_prefix_match(User.username, prefix)) \
+        .order_by(func.lower(User.username)).limit(limit).all()
+    if len(rows) < limit:
+        seen = {row.id for row in rows}
+        rows += [row for row in db.session.query(*columns).filter(*_prefix_match(User.email, prefix))
+                 .order_by(func.lower(User.email)).limit(limit).all() if row.id not in seen][:limit - len(rows)]
+    users = [{'id': row.id, 'username': row.username, 'email': row.email, 'is_admin': row.is_admin}
+             for row in rows]
+
+    with _autocomplete_lock:
+        _autocomplete_cache[key] = (now + AUTOCOMPLETE_CACHE_TTL, users)
+        if len(_autocomplete_cache) > AUTOCOMPLETE_CACHE_SIZE:
+            _autocomplete_cache.popitem(last=False)
+    return users
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_user_changes(session, flush_context):
+    if any(isinstance(obj, User) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['users_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_after_commit(session):
+    if session.info.pop('users_changed', False):
+        clear_user_autocomplete()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('users_changed', None)
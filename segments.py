@@ -0,0 +1,194 @@
+"""
+Per-slide segment encoding.
+
+Each slide is encoded on its own into a short MP4 segment using the job's
+encoding profile, then all segments are joined with a stream-copy concat and
+muxed with the audio. Every segment starts on a keyframe and uses identical
+codec parameters, so the concat needs no re-encode.
+
+Segments are cached under SEGMENT_CACHE_DIR by a hash of the normalized frame,
+its length in frames and the encoder arguments. Any duration that comes out
+at the same frame count therefore reuses the segment. When a user replaces
+or reorders a slide, only the changed slide is encoded again.
+"""
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from encoding_profiles import get_profile, video_encoder_args
+from ffmpeg_runner import run_ffmpeg, ProgressTracker
+from logs import get_logger, tail_output
+
+log = get_logger(__name__)
+
+SEGMENT_CACHE_DIR = os.environ.get('SEGMENT_CACHE_DIR', 'segment_cache')
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 1024 ** 3))
+SEGMENT_WORKERS = int(os.environ.get('SEGMENT_WORKERS', 2))
+
+
+def segment_key(frame_path, frame_count, encoder_args):
+    digest = hashlib.sha256()
+    with open(frame_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    digest.update(f"|frames={frame_count}|".encode())
+    digest.update("\0".join(encoder_args).encode())
+    return digest.hexdigest()
+
+
+def segment_frames(duration, fps):
+    # An exact frame count keeps every segment (and so the whole reel) frame-accurate
+    return max(int(round(float(duration) * fps)), 1)
+
+
+def encode_segment(frame_path, duration, profile, dest_path, on_progress=None):
+    """
+    Encode one still frame into a silent segment of the given duration.
+
+    Returns:
+        tuple: (returncode, stderr_tail) from ffmpeg
+    """
+    fps = get_profile(profile)['fps']
+    frame_count = segment_frames(duration, fps)
+    tmp_path = f"{dest_path}.{os.getpid()}.tmp.mp4"
+    command = ['ffmpeg', '-y',
+               '-loop', '1', '-framerate', str(fps), '-i', frame_path,
+               *video_encoder_args(profile), '-frames:v', str(frame_count), '-an', tmp_path]
+    returncode, stderr = run_ffmpeg(command, duration=frame_count / fps, on_progress=on_progress,
+                                    step='segment')
+    if returncode == 0:
+        # Publish atomically so concurrent workers never pick up a partial segment
+        os.replace(tmp_path, dest_path)
+    elif os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return returncode, stderr
+
+
+def plan_segments(frame_paths, durations, profile):
+    """
+    Look the slides up in the segment cache.
+
+    Args:
+        frame_paths (list): Normalized frames in reel order
+        durations (list): Slide durations in seconds (same order)
+        profile (str): Encoding profile name
+
+    Returns:
+        tuple: (segment paths in reel order, [(frame_path, duration, segment_path), ...] still to encode)
+    """
+    os.makedirs(SEGMENT_CACHE_DIR, exist_ok=True)
+    encoder_args = video_encoder_args(profile)
+    fps = get_profile(profile)['fps']
+    segment_paths = []
+    missing = []
+    for frame_path, duration in zip(frame_paths, durations):
+        key = segment_key(frame_path, segment_frames(duration, fps), encoder_args)
+        segment_path = os.path.join(SEGMENT_CACHE_DIR, f"{key}.mp4")
+        segment_paths.append(segment_path)
+        if os.path.exists(segment_path):
+            os.utime(segment_path)  # mark as recently used for LRU eviction
+        elif segment_path not in [queued for _, _, queued in missing]:
+            missing.append((frame_path, duration, segment_path))
+
+    log.info("Segment cache", cached=len(frame_paths) - len(missing), total=len(frame_paths),
+             encoding=len(missing))
+    return segment_paths, missing
+
+
+def encode_segments(missing, profile, on_progress=None):
+    """
+    Encode the segments plan_segments() found missing, SEGMENT_WORKERS at a time.
+
+    Args:
+        missing (list): [(frame_path, duration, segment_path), ...] from plan_segments()
+        profile (str): Encoding profile name
+        on_progress (list): Optional per-segment on_progress(percent, eta_seconds)
+            callbacks, in the order of missing (see ProgressTracker)
+
+    Returns:
+        bool: True if every segment was encoded
+    """
+    callbacks = on_progress or [None] * len(missing)
+
+    def work(item, callback):
+        frame_path, duration, segment_path = item
+        returncode, stderr = encode_segment(frame_path, duration, profile, segment_path, callback)
+        if returncode != 0:
+            log.error("Segment encode failed", frame=frame_path, exit_code=returncode,
+                      ffmpeg_output=tail_output(stderr))
+        return returncode == 0
+
+    ok = True
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, min(SEGMENT_WORKERS, len(missing)))) as pool:
+            ok = all(list(pool.map(work, missing, callbacks)))
+    if ok:
+        evict()
+    return ok
+
+
+def build_segments(frame_paths, durations, profile, on_progress=None):
+    """
+    Return one encoded segment per slide, encoding only the slides not in the cache.
+
+    Args:
+        frame_paths (list): Normalized frames in reel order
+        durations (list): Slide durations in seconds (same order)
+        profile (str): Encoding profile name
+        on_progress (callable): Called as on_progress(percent, eta_seconds) over all encodes
+
+    Returns:
+        list or None: Segment paths in reel order, or None if any encode failed
+    """
+    segment_paths, missing = plan_segments(frame_paths, durations, profile)
+    callbacks = None
+    if on_progress and missing:
+        tracker = ProgressTracker(on_progress)
+        callbacks = [tracker.part(duration) for _, duration, _ in missing]
+    if not encode_segments(missing, profile, callbacks):
+        return None
+    return segment_paths
+
+
+def concat_segments(segment_paths, audio_path, output_path, list_path, duration=None, on_progress=None):
+    """
+    Join segments without re-encoding and mux in the audio track.
+
+    duration (the reel length) and on_progress are passed on to run_ffmpeg().
+
+    Returns:
+        tuple: (returncode, stderr_tail) from ffmpeg
+    """
+    with open(list_path, "w") as f:
+        for segment_path in segment_paths:
+            f.write(f"file '{os.path.abspath(segment_path)}'\n")
+    command = ['ffmpeg', '-y',
+               '-f', 'concat', '-safe', '0', '-i', list_path,
+               '-i', audio_path,
+               '-map', '0:v', '-map', '1:a',
+               '-c:v', 'copy', '-c:a', 'aac', '-shortest',
+               '-movflags', '+faststart', output_path]
+    return run_ffmpeg(command, duration=duration, on_progress=on_progress, step='concat')
+
+
+def evict(max_bytes=SEGMENT_CACHE_MAX_BYTES):
+    """Remove least-recently-used segments until the cache fits in max_bytes"""
+    files = []
+    for name in os.listdir(SEGMENT_CACHE_DIR):
+        if name.endswith('.mp4') and '.tmp' not in name:
+            path = os.path.join(SEGMENT_CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
@@ -0,0 +1,22 @@
+#!/bin/bash
+# Starts the web app and the render worker side by side in one service.
+#
+# They must share a disk: /create saves the uploads to user_uploads/ where the
+# worker reads them, and the reels and posters the worker writes under static/
+# and media/ are served by the web app until (and, with STORAGE_BACKEND=local,
+# after) they are uploaded. Separate services each get their own filesystem.
+
+python worker.py &
+worker=$!
+gunicorn app:app --bind 0.0.0.0:${PORT:-5000} --workers 1 --worker-class gthread --threads 8 --timeout 120 &
+web=$!
+
+# Pass a platform shutdown on to both, so the worker can drain its uploads
+trap 'kill -TERM $web $worker 2>/dev/null' TERM INT
+
+# Whichever stops first takes the other one down, so the platform restarts both
+wait -n
+status=$?
+kill -TERM $web $worker 2>/dev/null
+wait
+exit $status
@@ -0,0 +1,271 @@
+"""
+Pre-aggregated statistics for the admin dashboard.
+
+daily_stats keeps one row per day. Each row counts the users and videos
+created on that day, split into admins and into video status, as they are
+now. User.video_count keeps the number of videos of each user. Both are
+maintained incrementally by an after_flush hook. Every insert, delete, status
+change, owner change or admin toggle that goes through the ORM adjusts the
+counters in the same transaction, so they commit or roll back together with
+the change itself. Bulk query deletes bypass the ORM and must call
+forget_videos() first.
+
+dashboard_stats() reads the rollup (two small indexed reads) and keeps the
+result in a per-process cache for STATS_CACHE_TTL seconds.
+"""
+import os
+import time
+import calendar
+import threading
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func, inspect, text, update
+from sqlalchemy.orm import Session, attributes
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db, User, Video, DailyStats
+
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', 30))
+# Video statuses with their own rollup column
+STATUS_COLUMNS = ('completed', 'processing', 'failed')
+
+_cache = {'value': None, 'expires': 0.0}
+_cache_lock = threading.Lock()
+
+
+def _day(value):
+    if value is None:
+        return date.today()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _video_deltas(deltas, created_at, status, sign):
+    counter = deltas[_day(created_at)]
+    counter['videos'] += sign
+    if status in STATUS_COLUMNS:
+        counter[status] += sign
+
+
+def apply_deltas(conn, day_deltas, user_deltas=None):
+    """Add counter deltas to daily_stats rows (created as needed) and User.video_count"""
+    table = DailyStats.__table__
+    for day, counter in day_deltas.items():
+        values = {name: amount for name, amount in counter.items() if amount}
+        if not values:
+            continue
+        if conn.dialect.name in ('postgresql', 'sqlite'):
+            dialect_insert = postgresql.insert if conn.dialect.name == 'postgresql' else sqlite.insert
+            statement = dialect_insert(table).values(day=day, **values)
+            statement = statement.on_conflict_do_update(
+                index_elements=['day'],
+                set_={name: table.c[name] + statement.excluded[name] for name in values})
+            conn.execute(statement)
+        else:
+            result = conn.execute(update(table).where(table.c.day == day)
+                                  .values({name: table.c[name] + amount for name, amount in values.items()}))
+            if result.rowcount == 0:
+                conn.execute(table.insert().values(day=day, **values))
+
+    for user_id, amount in (user_deltas or {}).items():
+        if user_id is not None and amount:
+            conn.execute(update(User.__table__).where(User.__table__.c.id == user_id)
+                         .values(video_count=User.__table__.c.video_count + amount))
+
+
+def _old_and_new(obj, name):
+    """(previous, current) value of an attribute changed in this flush"""
+    history = attributes.get_history(obj, name)
+    if not history.has_changes():
+        return None
+    return (history.deleted[0] if history.deleted else None,
+            history.added[0] if history.added else None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    day_deltas = defaultdict(Counter)
+    user_deltas = Counter()
+
+    for obj in session.new:
+        if isinstance(obj, Video):
+            _video_deltas(day_deltas, obj.created_at, obj.status, 1)
+            user_deltas[obj.user_id] += 1
+        elif isinstance(obj, User):
+            day_deltas[_day(obj.created_at)]['users'] += 1
+            if obj.is_admin:
+                day_deltas[_day(obj.created_at)]['admins'] += 1
+
+    for obj in session.deleted:
+        # Attributes of deleted rows are still in the instance dict
+        values = inspect(obj).dict
+        if isinstance(obj, Video):
+            _video_deltas(day_deltas, values.get('created_at'), values.get('status'), -1)
+            user_deltas[values.get('user_id')] -= 1
+        elif isinstance(obj, User):
+            day_deltas[_day(values.get('created_at'))]['users'] -= 1
+            if values.get('is_admin'):
+                day_deltas[_day(values.get('created_at'))]['admins'] -= 1
+
+    for obj in session.dirty:
+        if obj in session.deleted or not session.is_modified(obj):
+            continue
+        if isinstance(obj, Video):
+            changed = _old_and_new(obj, 'status')
+            if changed and changed[0] != changed[1]:
+                counter = day_deltas[_day(obj.created_at)]
+                if changed[0] in STATUS_COLUMNS:
+                    counter[changed[0]] -= 1
+                if changed[1] in STATUS_COLUMNS:
+                    counter[changed[1]] += 1
+            changed = _old_and_new(obj, 'user_id')
+            if changed and changed[0] != changed[1]:
+                user_deltas[changed[0]] -= 1
+                user_deltas[changed[1]] += 1
+        elif isinstance(obj, User):
+            changed = _old_and_new(obj, 'is_admin')
+            if changed and bool(changed[0]) != bool(changed[1]):
+                day_deltas[_day(obj.created_at)]['admins'] += 1 if changed[1] else -1
+
+    if day_deltas or any(user_deltas.values()):
+        apply_deltas(session.connection(), day_deltas, user_deltas)
+        session.info['stats_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('stats_changed', False):
+        invalidate_cache()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('stats_changed', None)
+
+
+def _load_previous_value(target, value, oldvalue, initiator):
+    pass
+
+
+# Load the previous value when these are set on an expired instance, so the
+# flush hook always sees what changed
+for _attribute in (Video.status, Video.user_id, User.is_admin):
+    event.listen(_attribute, 'set', _load_previous_value, active_history=True)
+
+
+def forget_videos(query):
+    """
+    Take the videos matched by a Video query out of the rollup before a bulk
+    query.delete() (which the flush hook does not see).
+    """
+    day_deltas = defaultdict(Counter)
+    user_deltas = Counter()
+    rows = query.with_entities(func.date(Video.created_at), Video.status, Video.user_id, func.count()) \
+        .group_by(func.date(Video.created_at), Video.status, Video.user_id).order_by(None).all()
+    for day, status, user_id, count in rows:
+        counter = day_deltas[_day(day)]
+        counter['videos'] -= count
+        if status in STATUS_COLUMNS:
+            counter[status] -= count
+        user_deltas[user_id] -= count
+    apply_deltas(db.session.connection(), day_deltas, user_deltas)
+    db.session.info['stats_changed'] = True
+
+
+def backfill(conn):
+    """Rebuild daily_stats and User.video_count from the user and video tables"""
+    day_deltas = defaultdict(Counter)
+    for day, is_admin, count in conn.execute(text(
+            'SELECT date(created_at), is_admin, COUNT(*) FROM "user" GROUP BY date(created_at), is_admin')):
+        day_deltas[_day(day)]['users'] += count
+        if is_admin:
+            day_deltas[_day(day)]['admins'] += count
+    for day, status, count in conn.execute(text(
+            'SELECT date(created_at), status, COUNT(*) FROM video GROUP BY date(created_at), status')):
+        day_deltas[_day(day)]['videos'] += count
+        if status in STATUS_COLUMNS:
+            day_deltas[_day(day)][status] += count
+
+    conn.execute(DailyStats.__table__.delete())
+    apply_deltas(conn, day_deltas)
+    conn.execute(text('UPDATE "user" SET video_count = '
+                      '(SELECT COUNT(*) FROM video WHERE video.user_id = "user".id)'))
+
+
+def invalidate_cache():
+    with _cache_lock:
+        _cache['value'] = None
+        _cache['expires'] = 0.0
+
+
+def _month_starts(today, count):
+    """First day of this month and of the count - 1 months before it, oldest first"""
+    year, month = today.year, today.month
+    starts = []
+    for _ in range(count):
+        starts.append(date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return list(reversed(starts))
+
+
+def _compute():
+    columns = [DailyStats.users, DailyStats.admins, DailyStats.videos] + \
+              [getattr(DailyStats, name) for name in STATUS_COLUMNS]
+    totals = db.session.query(*[func.coalesce(func.sum(column), 0) for column in columns]).one()
+    totals = dict(zip(['users', 'admins', 'videos'] + list(STATUS_COLUMNS), (int(value) for value in totals)))
+
+    today = date.today()
+    months = _month_starts(today, 6)
+    recent = db.session.query(DailyStats.day, DailyStats.users, DailyStats.videos) \
+        .filter(DailyStats.day >= months[0]).all()
+
+    week_start = today - timedelta(days=6)
+    per_month = defaultdict(Counter)
+    users_this_week = videos_this_week = 0
+    for day, users, videos in recent:
+        per_month[(day.year, day.month)]['users'] += users
+        per_month[(day.year, day.month)]['videos'] += videos
+        if day >= week_start:
+            users_this_week += users
+            videos_this_week += videos
+
+    return {
+        'total_users': totals['users'],
+        'admin_users': totals['admins'],
+        'regular_users': totals['users'] - totals['admins'],
+        'total_videos': totals['videos'],
+        'completed_videos': totals['completed'],
+        'processing_videos': totals['processing'],
+        'failed_videos': totals['failed'],
+        'users_this_week': users_this_week,
+        'videos_this_week': videos_this_week,
+        'monthly_stats': [{
+            'month': calendar.month_name[start.month],
+            'year': start.year,
+            'users': per_month[(start.year, start.month)]['users'],
+            'videos': per_month[(start.year, start.month)]['videos'],
+        } for start in months],
+    }
+
+
+def dashboard_stats():
+    """
+    Dashboard counters from the rollup, cached for STATS_CACHE_TTL seconds.
+
+    Returns:
+        dict: Totals, per-status video counts, this week's sign-ups/videos and
+        the last six months (oldest first)
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        if _cache['value'] is not None and now < _cache['expires']:
+            return _cache['value']
+    value = _compute()
+    with _cache_lock:
+        _cache['value'] = value
+        _cache['expires'] = now + STATS_CACHE_TTL
+    return value
@@ -0,0 +1,310 @@
+"""
+Pluggable storage for finished reels (and other published media).
+
+Objects are addressed by a key such as "videos/<uuid>.mp4". Every backend
+offers the same small interface:
+
+    put(key, path)       store a local file, return its public URL; an existing
+                         object under key is kept, never overwritten
+    get(key)             stream the stored bytes back in chunks
+    delete(key)          remove one object
+    delete_many(keys)    remove many objects in as few requests as possible
+    url(key)             public URL of an object
+    key_for_url(url)     inverse of url(), None for URLs of another backend
+
+STORAGE_BACKEND selects the implementation:
+    cloudinary   Cloudinary (the production CDN)
+    local        a directory on disk served under /media, standing in for an
+                 object store so the pipeline runs and can be benchmarked
+                 without the network
+
+When STORAGE_BACKEND is unset, Cloudinary is used if credentials are
+configured and local storage otherwise.
+
+Run "python storage.py <file>" to measure put/get/delete throughput of the
+configured backend.
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+import requests
+import cloudinary
+import cloudinary.api
+import cloudinary.utils
+import cloudinary.uploader
+import cloudinary.exceptions
+from dotenv import load_dotenv
+
+from logs import get_logger
+
+# Load environment variables
+load_dotenv()
+log = get_logger(__name__)
+
+# Configure Cloudinary
+cloudinary_url = os.getenv('CLOUDINARY_URL')
+if cloudinary_url:
+    try:
+        cloudinary.config(cloudinary_url=cloudinary_url)
+        # Verify configuration worked
+        if not cloudinary.config().cloud_name:
+            raise ValueError("Cloudinary URL parsing failed")
+    except Exception as e:
+        log.warning("Failed to configure Cloudinary with URL", error=str(e))
+        # Fallback to individual parameters
+        cloudinary.config(
+            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+            api_key=os.getenv('CLOUDINARY_API_KEY'),
+            api_secret=os.getenv('CLOUDINARY_API_SECRET')
+        )
+else:
+    cloudinary.config(
+        cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+        api_key=os.getenv('CLOUDINARY_API_KEY'),
+        api_secret=os.getenv('CLOUDINARY_API_SECRET')
+    )
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', '').lower()
+CLOUDINARY_FOLDER = os.environ.get('CLOUDINARY_FOLDER', 'bot_ai_vids')
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 20 * 1024 * 1024))
+LOCAL_STORAGE_DIR = os.environ.get('LOCAL_STORAGE_DIR', 'media')
+LOCAL_STORAGE_URL = os.environ.get('LOCAL_STORAGE_URL', '/media').rstrip('/')
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class StorageBackend:
+    """Interface shared by all storage backends"""
+
+    name = 'base'
+    # Errors that will not go away by retrying the same request
+    permanent_errors = (ValueError, FileNotFoundError)
+
+    def put(self, key, path):
+        raise NotImplementedError
+
+    def get(self, key, chunk_size=STREAM_CHUNK_SIZE):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        """
+        Returns:
+            int: Number of objects removed
+        """
+        removed = 0
+        for key in keys:
+            if self.delete(key):
+                removed += 1
+        return removed
+
+    def url(self, key):
+        raise NotImplementedError
+
+    def key_for_url(self, url):
+        raise NotImplementedError
+
+
+class CloudinaryStorage(StorageBackend):
+    """Cloudinary; keys map to public ids under CLOUDINARY_FOLDER"""
+
+    name = 'cloudinary'
+    permanent_errors = StorageBackend.permanent_errors + (
+        cloudinary.exceptions.AuthorizationRequired,
+        cloudinary.exceptions.BadRequest,
+        cloudinary.exceptions.NotAllowed,
+        cloudinary.exceptions.NotFound,
+    )
+    # Admin API limit for one delete_resources call
+    DELETE_BATCH = 100
+
+    def __init__(self, folder=CLOUDINARY_FOLDER, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self._session = requests.Session()
+
+    @staticmethod
+    def _resource_type(key):
+        return 'image' if key.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')) else 'video'
+
+    def _public_id(self, key):
+        return f"{self.folder}/{os.path.splitext(key)[0]}"
+
+    def put(self, key, path):
+        # Chunked upload: a dropped connection only costs the current chunk
+        result = cloudinary.uploader.upload_large(
+            path,
+            resource_type=self._resource_type(key),
+            public_id=self._public_id(key),
+            chunk_size=self.chunk_size,
+            # Keys are versioned by content; an existing object may be shared
+            overwrite=False
+        )
+        return result.get('secure_url')
+
+    def get(self, key, chunk_size=STREAM_CHUNK_SIZE):
+        with self._session.get(self.url(key), stream=True, timeout=60) as response:
+            if response.status_code == 404:
+                raise FileNotFoundError(key)
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size)
+
+    def delete(self, key):
+        result = cloudinary.uploader.destroy(self._public_id(key),
+                                             resource_type=self._resource_type(key),
+                                             invalidate=True)
+        return result.get('result') == 'ok'
+
+    def delete_many(self, keys):
+        removed = 0
+        by_type = {}
+        for key in keys:
+            by_type.setdefault(self._resource_type(key), []).append(self._public_id(key))
+        for resource_type, public_ids in by_type.items():
+            for start in range(0, len(public_ids), self.DELETE_BATCH):
+                batch = public_ids[start:start + self.DELETE_BATCH]
+                result = cloudinary.api.delete_resources(batch, resource_type=resource_type,
+                                                         invalidate=True)
+                removed += sum(1 for status in result.get('deleted', {}).values() if status == 'deleted')
+        return removed
+
+    def url(self, key):
+        extension = os.path.splitext(key)[1].lstrip('.') or None
+        url, _ = cloudinary.utils.cloudinary_url(self._public_id(key),
+                                                 resource_type=self._resource_type(key),
+                                                 format=extension, secure=True)
+        return url
+
+    def key_for_url(self, url):
+        # https://res.cloudinary.com/<cloud>/<type>/upload/[v<version>/]<folder>/<key>
+        if not url or 'res.cloudinary.com/' not in url or '/upload/' not in url:
+            return None
+        path = url.split('/upload/', 1)[1].split('?', 1)[0]
+        first, _, rest = path.partition('/')
+        if first.startswith('v') and first[1:].isdigit():
+            path = rest
+        prefix = f"{self.folder}/"
+        return path[len(prefix):] if path.startswith(prefix) else None
+
+
+class LocalStorage(StorageBackend):
+    """A directory on disk, served by the web app under LOCAL_STORAGE_URL"""
+
+    name = 'local'
+
+    def __init__(self, root=LOCAL_STORAGE_DIR, base_url=LOCAL_STORAGE_URL):
+        self.root = root
+        self.base_url = base_url
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def put(self, key, path):
+        dest = self._path(key)
+        if os.path.exists(dest):
+            return self.url(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # Write to a temp file and rename, so readers never see a partial object
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.url(key)
+
+    def get(self, key, chunk_size=STREAM_CHUNK_SIZE):
+        with open(self._path(key), 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def url(self, key):
+        return f"{self.base_url}/{key}"
+
+    def key_for_url(self, url):
+        prefix = f"{self.base_url}/"
+        if not url or not url.startswith(prefix):
+            return None
+        return url[len(prefix):]
+
+
+BACKENDS = {
+    'cloudinary': CloudinaryStorage,
+    'local': LocalStorage,
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """The configured storage backend (created once per process)"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            name = STORAGE_BACKEND or ('cloudinary' if cloudinary.config().api_key else 'local')
+            if name not in BACKENDS:
+                raise ValueError(f"Unknown STORAGE_BACKEND '{name}' (expected one of: {', '.join(BACKENDS)})")
+            _storage = BACKENDS[name]()
+            log.info("Using storage backend", backend=_storage.name)
+        return _storage
+
+
+def benchmark(path, count=3, storage=None):
+    """
+    Time put, get and delete of one file against a backend.
+
+    Returns:
+        dict: Megabytes per second for put and get, seconds for the bulk delete
+    """
+    storage = storage or get_storage()
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    keys = [f"benchmark/{os.getpid()}-{i}{os.path.splitext(path)[1]}" for i in range(count)]
+
+    started = time.time()
+    for key in keys:
+        storage.put(key, path)
+    put_seconds = time.time() - started
+
+    started = time.time()
+    for key in keys:
+        for _ in storage.get(key):
+            pass
+    get_seconds = time.time() - started
+
+    started = time.time()
+    storage.delete_many(keys)
+    delete_seconds = time.time() - started
+
+    return {
+        'backend': storage.name,
+        'put_mb_per_s': size_mb * count / put_seconds if put_seconds else float('inf'),
+        'get_mb_per_s': size_mb * count / get_seconds if get_seconds else float('inf'),
+        'delete_seconds': delete_seconds,
+    }
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python storage.py <file> [count]")
+        sys.exit(1)
+    result = benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 3)
+    print(f"[STORAGE] {result['backend']}: put {result['put_mb_per_s']:.1f} MB/s, "
+          f"get {result['get_mb_per_s']:.1f} MB/s, bulk delete {result['delete_seconds']:.2f}s")
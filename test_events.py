@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Test script for the server-sent render progress events
+"""
+import uuid
+import threading
+
+import main
+from app import app, db, User, Video
+
+
+def admin_client():
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+
+def test_streams_over_the_cap_answer_like_a_poll():
+    """With every stream slot taken the status comes back at once, with a retry delay"""
+    folder = str(uuid.uuid4())
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        db.session.add(Video(uuid=folder, user_id=admin.id, status='processing'))
+        db.session.commit()
+    original = main._sse_slots
+    main._sse_slots = threading.BoundedSemaphore(1)
+    try:
+        main._sse_slots.acquire()  # another stream holds the only slot
+        response = admin_client().get(f'/api/videos/{folder}/events')
+        body = response.get_data(as_text=True)
+        assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+        assert body.startswith(f"retry: {main.SSE_BUSY_RETRY_MS}\nevent: status\n")
+        assert '"video_status": "processing"' in body
+        main._sse_slots.release()
+
+        # A stream that ends gives its slot back
+        with app.app_context():
+            Video.query.filter_by(uuid=folder).one().status = 'completed'
+            db.session.commit()
+        body = admin_client().get(f'/api/videos/{folder}/events').get_data(as_text=True)
+        assert body.startswith("event: status\n") and '"video_status": "completed"' in body
+        assert main._sse_slots.acquire(blocking=False)
+    finally:
+        main._sse_slots = original
+        with app.app_context():
+            db.session.delete(Video.query.filter_by(uuid=folder).one())
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    test_streams_over_the_cap_answer_like_a_poll()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Test script for the image pre-normalization stage
+"""
+import os
+import tempfile
+
+from PIL import Image
+
+from image_prep import normalize_images
+
+
+def test_normalize_images():
+    """Every valid image becomes one uniform, even-sized frame; broken files are reported"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            folder_path = "user_uploads/test_reel"
+            os.makedirs(folder_path)
+            Image.new('RGB', (4000, 3000), (200, 10, 10)).save(f"{folder_path}/landscape.jpg")
+            Image.new('RGBA', (601, 901)).save(f"{folder_path}/odd_size.png")
+            with open(f"{folder_path}/broken.jpg", "w") as f:
+                f.write("not an image")
+
+            frames, invalid = normalize_images("test_reel", ["landscape.jpg", "odd_size.png", "broken.jpg"],
+                                               size=(540, 960))
+
+            print(f"Frames: {frames}")
+            assert invalid == ["broken.jpg"]
+            assert frames[2] is None
+            for frame in frames[:2]:
+                with Image.open(f"{folder_path}/frames/{frame['frame']}") as img:
+                    assert img.size == (540, 960)
+                    assert img.mode == 'RGB'
+            assert frames[0]['original_width'] == 4000
+            assert os.path.exists(f"{folder_path}/frames/manifest.json")
+            print("✅ Images normalized to 540x960")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    test_normalize_images()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Test script for the structured logging layer
+"""
+import json
+import logging
+
+from logs import (TextFormatter, JsonFormatter, DroppingQueueHandler, get_logger,
+                  tail_output, _parse_rates)
+
+
+def make_record(message, **fields):
+    """A record as get_logger() would produce it"""
+    captured = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            captured.append(record)
+
+    logger = logging.getLogger("test_logs")
+    logger.propagate = False
+    logger.handlers = [Capture()]
+    logger.setLevel(logging.DEBUG)
+    get_logger("test_logs").info(message, **fields)
+    return captured[0]
+
+
+def test_text_and_json_formats():
+    """Fields are appended as key=value, or merged into the JSON object"""
+    record = make_record("Video created", folder="abc", size=42, note="two words")
+    line = TextFormatter().format(record)
+    print(line)
+    assert line.endswith('INFO test_logs: Video created folder=abc size=42 note="two words"')
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["msg"] == "Video created"
+    assert entry["folder"] == "abc" and entry["size"] == 42
+
+
+def test_full_queue_drops_instead_of_blocking():
+    """A full queue never blocks the caller"""
+    import queue
+    handler = DroppingQueueHandler(queue.Queue(1))
+    before = DroppingQueueHandler.dropped
+    for _ in range(3):
+        handler.handle(make_record("burst"))
+    assert DroppingQueueHandler.dropped - before == 2
+
+
+def test_sample_rates_and_tail():
+    """LOG_SAMPLE_RATES parsing and ffmpeg output truncation"""
+    assert _parse_rates("static=0.1, serve_reel=0,bad,x=oops,*=2") == {"static": 0.1, "serve_reel": 0.0, "*": 1.0}
+    output = "\n".join(f"line {i}" for i in range(100))
+    assert tail_output(output, 3) == "line 97\nline 98\nline 99"
+    assert tail_output(None, 3) == ""
+
+
+if __name__ == "__main__":
+    test_text_and_json_formats()
+    test_full_queue_drops_instead_of_blocking()
+    test_sample_rates_and_tail()
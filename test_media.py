@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Test script for serving local reels
+"""
+import os
+import uuid
+
+import main  # registers the routes
+from app import app
+from uploader import REELS_DIR
+
+
+def test_ranges_and_the_static_path():
+    """One range is a 206, several get the whole file, and /static/reels/ goes through send_media"""
+    name = f"media_test_{uuid.uuid4().hex[:8]}.mp4"
+    path = os.path.join(REELS_DIR, name)
+    os.makedirs(REELS_DIR, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(bytes(range(100)))
+    client = app.test_client()
+    try:
+        response = client.get(f"/reels/{name}", headers={"Range": "bytes=10-19"})
+        assert response.status_code == 206 and response.data == bytes(range(10, 20))
+
+        response = client.get(f"/reels/{name}", headers={"Range": "bytes=0-1,5-6"})
+        assert response.status_code == 200 and response.data == bytes(range(100))
+
+        response = client.get(f"/reels/{name}", headers={"Range": "bytes=500-"})
+        assert response.status_code == 416
+        assert response.headers["Content-Range"] == "bytes */100"
+
+        response = client.get(f"/static/reels/{name}", headers={"Range": "bytes=0-4"})
+        assert response.status_code == 206 and response.headers["Accept-Ranges"] == "bytes"
+        assert response.headers["ETag"] == client.get(f"/reels/{name}").headers["ETag"]
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    test_ranges_and_the_static_path()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Test script for the Prometheus metrics
+"""
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from app import app, db, MetricsSnapshot
+import metrics
+from metrics import Counter, Histogram, render_metrics, flush_metrics, drop_snapshot
+
+
+def unique(name):
+    """A metric name no other test process has written to the shared snapshot table"""
+    return f"{name}_{uuid.uuid4().hex[:8]}"
+
+
+def test_histogram_exposition():
+    """Buckets are cumulative and end with +Inf; _count matches the observations"""
+    name = unique('test_step_seconds')
+    histogram = Histogram(name, 'Test step time', ['step'], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.observe(value, step='encode')
+    with app.app_context():
+        text = render_metrics()
+    print(text)
+    assert f'# TYPE {name} histogram' in text
+    assert f'{name}_bucket{{step="encode",le="0.1"}} 1' in text
+    assert f'{name}_bucket{{step="encode",le="1.0"}} 3' in text
+    assert f'{name}_bucket{{step="encode",le="+Inf"}} 4' in text
+    assert f'{name}_count{{step="encode"}} 4' in text
+    assert f'{name}_sum{{step="encode"}} 4.05' in text
+    assert 'reels_render_jobs{status="queued"}' in text
+
+
+def test_other_processes_are_added():
+    """Snapshots of live processes are summed with this process's values; silent ones are not"""
+    name = unique('test_events_total')
+    counter = Counter(name, 'Test events', ['kind'])
+    counter.inc(kind='a "quoted"\nvalue')
+    counter.inc(2, kind='b')
+    live = MetricsSnapshot(process='otherhost:1:0', data=json.dumps({name: [[['b'], 5]]}),
+                           updated_at=datetime.now())
+    gone = MetricsSnapshot(process='otherhost:2:0', data=json.dumps({name: [[['b'], 100]]}),
+                           updated_at=datetime.now() - timedelta(seconds=metrics.METRICS_SNAPSHOT_MAX_AGE + 1))
+    with app.app_context():
+        db.session.merge(live)
+        db.session.merge(gone)
+        db.session.commit()
+        try:
+            text = render_metrics()
+            assert db.session.get(MetricsSnapshot, 'otherhost:2:0') is None
+        finally:
+            MetricsSnapshot.query.filter(MetricsSnapshot.process.like('otherhost:%')).delete()
+            db.session.commit()
+    assert f'{name}{{kind="b"}} 7' in text
+    assert f'{name}{{kind="a \\"quoted\\"\\nvalue"}} 1' in text
+
+
+def test_snapshot_is_written_and_dropped():
+    """flush_metrics() stores this process's values under its own name; a clean shutdown removes them"""
+    name = unique('test_flushed_total')
+    Counter(name, 'Test flushes').inc()
+    flush_metrics()
+    with app.app_context():
+        row = db.session.get(MetricsSnapshot, metrics._state['process'])
+        assert row is not None
+        assert json.loads(row.data)[name] == [[[], 1]]
+    drop_snapshot()
+    with app.app_context():
+        db.session.expire_all()
+        assert db.session.get(MetricsSnapshot, metrics._state['process']) is None
+
+
+if __name__ == "__main__":
+    test_histogram_exposition()
+    test_other_processes_are_added()
+    test_snapshot_is_written_and_dropped()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test script for schema migrations and the hot-path query plans
+"""
+import os
+import tempfile
+
+from sqlalchemy import create_engine, text
+
+import app as app_module
+import migrations
+from app import app, db
+from migrations import migration_status, check_query_plans, run_migrations, missing_columns, SchemaOutOfDate
+
+# The user and video tables as the first release created them
+ORIGINAL_SCHEMA = [
+    """CREATE TABLE "user" (
+        id INTEGER NOT NULL PRIMARY KEY, username VARCHAR(150) NOT NULL UNIQUE,
+        password VARCHAR(256) NOT NULL, email VARCHAR(120) UNIQUE, created_at DATETIME,
+        is_admin BOOLEAN, is_super_admin BOOLEAN)""",
+    """CREATE TABLE video (
+        id INTEGER NOT NULL PRIMARY KEY, uuid VARCHAR(255) NOT NULL, user_id INTEGER REFERENCES "user" (id),
+        cloudinary_public_id VARCHAR(255), cloudinary_url TEXT, description TEXT, status VARCHAR(50),
+        created_at DATETIME, updated_at DATETIME, duration FLOAT, size INTEGER, format VARCHAR(10))""",
+    """INSERT INTO "user" (id, username, password, created_at, is_admin) VALUES (1, 'old', 'x', '2024-01-01', 0)""",
+    """INSERT INTO video (id, uuid, user_id, description, status, created_at)
+        VALUES (1, 'old-video', 1, 'made before the render pipeline', 'completed', '2024-01-02')""",
+]
+
+
+def test_all_migrations_applied():
+    """Importing the app brings the database up to the latest migration"""
+    with app.app_context():
+        status = migration_status()
+        for version, name, applied in status:
+            print(f"{version:03d} {name}: {'applied' if applied else 'pending'}")
+        assert all(applied for _, _, applied in status)
+
+
+def test_hot_queries_use_indexes():
+    """uuid lookups, status/user filters and the job claim are index scans"""
+    with app.app_context():
+        assert check_query_plans()
+
+
+def test_upgrades_the_original_schema():
+    """A database of the first release gains every model column, and keeps its rows"""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'original.db')}")
+        try:
+            with engine.begin() as conn:
+                for statement in ORIGINAL_SCHEMA:
+                    conn.execute(text(statement))
+            with app.app_context():
+                # What init_app() does: create_all() adds new tables only, migrations do the rest
+                db.metadata.create_all(engine)
+                with engine.connect() as conn:
+                    assert "video.poster_url" in missing_columns(conn)
+                run_migrations(engine)
+                with engine.connect() as conn:
+                    assert missing_columns(conn) == []
+                    assert conn.execute(text("SELECT uuid, poster_url FROM video")).all() == [('old-video', None)]
+                    assert conn.execute(text('SELECT video_count FROM "user"')).scalar() == 1
+                assert run_migrations(engine) == []
+        finally:
+            engine.dispose()
+
+
+def test_missing_migration_stops_startup():
+    """A column no migration adds raises SchemaOutOfDate, and init_app() does not swallow it"""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'original.db')}")
+        original = migrations.MIGRATIONS
+        migrations.MIGRATIONS = [(version, migration) for version, migration in original
+                                 if migration is not migrations.add_pipeline_columns]
+        try:
+            with engine.begin() as conn:
+                for statement in ORIGINAL_SCHEMA:
+                    conn.execute(text(statement))
+            with app.app_context():
+                db.metadata.create_all(engine)
+                try:
+                    run_migrations(engine)
+                    assert False, "expected SchemaOutOfDate"
+                except SchemaOutOfDate as e:
+                    assert "video.poster_url" in str(e)
+        finally:
+            migrations.MIGRATIONS = original
+            engine.dispose()
+
+    def out_of_date():
+        raise SchemaOutOfDate("video.poster_url")
+
+    run = migrations.run_migrations
+    migrations.run_migrations = out_of_date
+    try:
+        app_module.init_app()
+        assert False, "expected init_app() to raise"
+    except SchemaOutOfDate:
+        pass
+    finally:
+        migrations.run_migrations = run
+
+
+if __name__ == "__main__":
+    test_all_migrations_applied()
+    test_hot_queries_use_indexes()
+    test_upgrades_the_original_schema()
+    test_missing_migration_stops_startup()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script for on-demand request profiling
+"""
+import json
+import threading
+
+from app import app, db, Profile
+import profiling
+
+
+def admin_client():
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+
+def test_header_profiles_one_request():
+    """An admin's X-Profile request is stored with its SQL; anyone else's is not profiled"""
+    response = admin_client().get('/gallery', headers={'X-Profile': '1'})
+    assert response.status_code == 200
+    profile_id = int(response.headers['X-Profile-Id'])
+    with app.app_context():
+        profile = db.session.get(Profile, profile_id)
+        print(profile.name, profile.duration_ms, profile.sql_count, profile.sql_ms)
+        assert profile.kind == 'request' and profile.name == 'gallery' and profile.trigger == 'header'
+        assert profile.sql_count == sum(query['count'] for query in json.loads(profile.sql))
+        assert 'cumulative' in profile.stats
+
+    assert 'X-Profile-Id' not in app.test_client().get('/gallery', headers={'X-Profile': '1'}).headers
+
+
+def test_sampling_follows_the_switch():
+    """Sampled profiling covers only the listed endpoints, and nothing once switched off"""
+    client = admin_client()
+    with app.app_context():
+        profiling.save_settings(1.0, 0.0, 'gallery', 5, 'admin')
+        before = Profile.query.count()
+    try:
+        client.get('/gallery')
+        client.get('/')
+        with app.app_context():
+            assert Profile.query.count() == before + 1
+    finally:
+        with app.app_context():
+            profiling.save_settings(0.0, 0.0, '', 0, 'admin')
+    client.get('/gallery')
+    with app.app_context():
+        assert Profile.query.count() == before + 1
+        assert profiling.current_settings() == profiling.OFF
+
+
+def test_concurrent_requests_profile_one_at_a_time():
+    """Sampled requests that overlap a running profile are served unprofiled instead of failing"""
+    with app.app_context():
+        profiling.save_settings(1.0, 0.0, 'gallery', 5, 'admin')
+        before = Profile.query.count()
+    busy, release = threading.Event(), threading.Event()
+
+    def hold_profiler():
+        run = profiling.ProfileRun('job', 'busy').start()
+        busy.set()
+        release.wait(10)
+        run.stop()
+
+    holder = threading.Thread(target=hold_profiler)
+    holder.start()
+    try:
+        busy.wait(10)
+        statuses = []
+
+        def get_gallery():
+            statuses.append(app.test_client().get('/gallery').status_code)
+
+        requests = [threading.Thread(target=get_gallery) for _ in range(2)]
+        for thread in requests:
+            thread.start()
+        for thread in requests:
+            thread.join()
+        assert statuses == [200, 200]
+        with app.app_context():
+            assert Profile.query.count() == before
+
+        release.set()
+        holder.join()
+        assert app.test_client().get('/gallery').status_code == 200
+        with app.app_context():
+            assert Profile.query.count() == before + 1
+    finally:
+        release.set()
+        holder.join()
+        with app.app_context():
+            profiling.save_settings(0.0, 0.0, '', 0, 'admin')
+
+
+if __name__ == "__main__":
+    test_header_profiles_one_request()
+    test_sampling_follows_the_switch()
+    test_concurrent_requests_profile_one_at_a_time()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Test script for segment encoding progress
+"""
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+
+import segments
+from ffmpeg_runner import ProgressTracker
+
+
+def test_tracker_weights_parts():
+    """Parts count by weight, and the job is done only when every part is"""
+    reports = []
+    tracker = ProgressTracker(lambda percent, eta: reports.append(percent))
+    preview, segment, concat = tracker.part(1), tracker.part(8), tracker.part(1)
+    preview(100.0)
+    segment(50.0)
+    assert reports == [10.0, 50.0]
+    segment(100.0, 0.0)
+    assert reports[-1] == 90.0 and tracker.snapshot()[1] is not None
+    concat(100.0, 0.0)
+    assert tracker.snapshot() == (100.0, 0.0)
+
+
+def test_segment_encodes_report_progress():
+    """build_segments() passes each segment's duration to ffmpeg and reports one rising percent"""
+    original, run_ffmpeg = segments.SEGMENT_CACHE_DIR, segments.run_ffmpeg
+    tmp = tempfile.mkdtemp(prefix="segments_test_")
+    segments.SEGMENT_CACHE_DIR = os.path.join(tmp, "cache")
+    durations = []
+
+    def spy(command, duration=None, on_progress=None, step='other'):
+        durations.append((duration, on_progress is not None))
+        return run_ffmpeg(command, duration, on_progress, step)
+
+    segments.run_ffmpeg = spy
+    try:
+        frames = []
+        for i, color in enumerate(("red", "blue")):
+            frames.append(os.path.join(tmp, f"{i}.jpg"))
+            Image.new("RGB", (320, 568), color).save(frames[-1])
+        reports = []
+        paths = segments.build_segments(frames, [1.0, 2.0], "draft",
+                                        lambda percent, eta: reports.append((percent, eta)))
+        assert paths and all(os.path.exists(path) for path in paths)
+        percents = [percent for percent, _ in reports]
+        assert sorted(durations) == [(1.0, True), (2.0, True)]
+        assert percents[-1] == 100.0 and any(0 < percent < 100 for percent in percents)
+        assert percents == sorted(percents)
+    finally:
+        segments.SEGMENT_CACHE_DIR, segments.run_ffmpeg = original, run_ffmpeg
+        shutil.rmtree(tmp)
+
+
+def test_segments_are_keyed_by_frame_count():
+    """Durations that come out at the same number of frames share one segment"""
+    original = segments.SEGMENT_CACHE_DIR
+    tmp = tempfile.mkdtemp(prefix="segments_test_")
+    segments.SEGMENT_CACHE_DIR = os.path.join(tmp, "cache")
+    try:
+        frame = os.path.join(tmp, "frame.jpg")
+        Image.new("RGB", (320, 568), "green").save(frame)
+        # 'draft' runs at 10 fps: 1.5s and 1.52s are both 15 frames, 1.6s is 16
+        paths, missing = segments.plan_segments([frame, frame, frame], ["1.5", "1.52", "1.6"], "draft")
+        assert paths[0] == paths[1] != paths[2]
+        assert len(missing) == 2
+    finally:
+        segments.SEGMENT_CACHE_DIR = original
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    test_tracker_weights_parts()
+    test_segment_encodes_report_progress()
+    test_segments_are_keyed_by_frame_count()
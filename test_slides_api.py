@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Test script for the slide editing API
+"""
+import os
+import json
+import uuid
+import shutil
+
+from PIL import Image
+
+from app import app, db, User, Video, RenderJob
+from generate_process import write_input_list
+
+
+def admin_client():
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+
+def test_invalid_durations_are_rejected_before_queueing():
+    """nan, inf, zero, negative, too long or non-numeric durations get a 400 and no render job"""
+    folder = str(uuid.uuid4())
+    folder_path = os.path.join("user_uploads", folder)
+    os.makedirs(folder_path)
+    Image.new("RGB", (64, 64), "red").save(os.path.join(folder_path, "a.jpg"))
+    write_input_list(folder, [("a.jpg", 3)])
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        db.session.add(Video(uuid=folder, user_id=admin.id, status='completed'))
+        db.session.commit()
+    client = admin_client()
+    url = f'/api/videos/{folder}/slides'
+    try:
+        for duration in ("nan", "inf", "-inf", 0, -2, 61, "abc", [1]):
+            response = client.post(url, data={"order": json.dumps([{"file": "a.jpg", "duration": duration}])})
+            assert response.status_code == 400, duration
+            assert "error" in response.get_json()
+        with app.app_context():
+            video = Video.query.filter_by(uuid=folder).one()
+            assert RenderJob.query.filter_by(video_id=video.id).count() == 0
+
+        response = client.post(url, data={"order": json.dumps([{"file": "a.jpg", "duration": 2.5}])})
+        assert response.status_code == 202
+        assert response.get_json()["slides"] == [{"file": "a.jpg", "duration": "2.5"}]
+    finally:
+        with app.app_context():
+            db.session.delete(Video.query.filter_by(uuid=folder).one())
+            db.session.commit()
+        shutil.rmtree(folder_path)
+
+
+if __name__ == "__main__":
+    test_invalid_durations_are_rejected_before_queueing()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test script for the admin dashboard rollups
+"""
+import uuid
+
+from sqlalchemy import func
+
+from app import app, db, User, Video, DailyStats
+from stats import forget_videos
+
+COLUMNS = ['users', 'admins', 'videos', 'completed', 'processing', 'failed']
+
+
+def rollup_totals():
+    row = db.session.query(*[func.coalesce(func.sum(getattr(DailyStats, name)), 0) for name in COLUMNS]).one()
+    return dict(zip(COLUMNS, row))
+
+
+def counted_totals():
+    return {
+        'users': User.query.count(),
+        'admins': User.query.filter_by(is_admin=True).count(),
+        'videos': Video.query.count(),
+        'completed': Video.query.filter_by(status='completed').count(),
+        'processing': Video.query.filter_by(status='processing').count(),
+        'failed': Video.query.filter_by(status='failed').count(),
+    }
+
+
+def test_rollup_follows_changes():
+    """Creating, updating and deleting users and videos keeps the rollup exact"""
+    with app.app_context():
+        user = User(username=f"stats_{uuid.uuid4().hex[:8]}", password="x")
+        db.session.add(user)
+        db.session.commit()
+        videos = [Video(uuid=str(uuid.uuid4()), user_id=user.id, description="stats test") for _ in range(3)]
+        db.session.add_all(videos)
+        db.session.commit()
+        assert rollup_totals() == counted_totals()
+        assert user.video_count == 3
+
+        videos[0].status = 'completed'
+        videos[1].status = 'failed'
+        user.is_admin = True
+        db.session.commit()
+        assert rollup_totals() == counted_totals()
+
+        db.session.delete(videos[2])
+        db.session.commit()
+        db.session.refresh(user)
+        assert user.video_count == 2
+        assert rollup_totals() == counted_totals()
+
+        forget_videos(Video.query.filter_by(user_id=user.id))
+        Video.query.filter_by(user_id=user.id).delete()
+        db.session.delete(user)
+        db.session.commit()
+        print(f"Rollup totals: {rollup_totals()}")
+        assert rollup_totals() == counted_totals()
+
+
+if __name__ == "__main__":
+    test_rollup_follows_changes()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test script for the local storage backend
+"""
+import os
+import tempfile
+
+from storage import LocalStorage
+
+
+def test_local_storage_round_trip():
+    """put/get/url/delete work without any network access"""
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = LocalStorage(root=os.path.join(tmp, "store"), base_url="/static/store")
+        src = os.path.join(tmp, "reel.mp4")
+        with open(src, "wb") as f:
+            f.write(os.urandom(3 * 1024 * 1024 + 17))
+
+        url = storage.put("videos/abc.mp4", src)
+        print(f"Stored at {url}")
+        assert url == "/static/store/videos/abc.mp4"
+        assert storage.key_for_url(url) == "videos/abc.mp4"
+        assert storage.key_for_url("https://res.cloudinary.com/x/video/upload/v1/a.mp4") is None
+
+        with open(src, "rb") as f:
+            assert b"".join(storage.get("videos/abc.mp4")) == f.read()
+
+        assert storage.delete("videos/abc.mp4")
+        assert not storage.delete("videos/abc.mp4")
+
+
+def test_local_storage_bulk_delete():
+    """delete_many counts only objects that existed"""
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = LocalStorage(root=os.path.join(tmp, "store"), base_url="/static/store")
+        src = os.path.join(tmp, "thumb.jpg")
+        with open(src, "wb") as f:
+            f.write(b"jpeg")
+        for i in range(3):
+            storage.put(f"videos/{i}.jpg", src)
+        assert storage.delete_many(["videos/0.jpg", "videos/1.jpg", "videos/2.jpg", "videos/9.jpg"]) == 3
+
+
+def test_local_storage_keeps_existing_objects():
+    """put never overwrites an object that may be shared"""
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = LocalStorage(root=os.path.join(tmp, "store"), base_url="/static/store")
+        first, second = os.path.join(tmp, "a.mp4"), os.path.join(tmp, "b.mp4")
+        for path, data in ((first, b"first"), (second, b"second")):
+            with open(path, "wb") as f:
+                f.write(data)
+        assert storage.put("videos/v1.mp4", first) == storage.put("videos/v1.mp4", second)
+        assert b"".join(storage.get("videos/v1.mp4")) == b"first"
+
+
+def test_local_storage_rejects_escaping_keys():
+    """Keys cannot point outside the storage directory"""
+    storage = LocalStorage(root="/tmp/store", base_url="/static/store")
+    try:
+        storage.url("x")
+        storage.delete("../etc/passwd")
+    except ValueError:
+        return
+    raise AssertionError("escaping key was accepted")
+
+
+if __name__ == "__main__":
+    test_local_storage_round_trip()
+    test_local_storage_bulk_delete()
+    test_local_storage_keeps_existing_objects()
+    test_local_storage_rejects_escaping_keys()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Test script for the audio-duration-aware timeline planner
+"""
+from timeline import plan_frames
+
+
+def test_plan_frames_covers_audio_exactly():
+    """Slides add up to the audio length in whole frames"""
+    frames = plan_frames(10.0, [3, 3, 3], 15)
+    print(f"10s over 3 slides at 15 fps: {frames}")
+    assert frames == [50, 50, 50]
+
+    frames = plan_frames(64.73, [3, 3, 3, 3], 15)
+    print(f"64.73s over 4 slides at 15 fps: {frames}")
+    assert sum(frames) == round(64.73 * 15)
+    assert max(frames) - min(frames) <= 1
+
+
+def test_plan_frames_spreads_long_audio_over_every_slide():
+    """Long narration lengthens all slides in proportion; the last one is not stretched"""
+    frames = plan_frames(60.0, [3, 3, 3], 24)
+    print(f"60s over 3 slides at 24 fps: {frames}")
+    assert frames == [480, 480, 480]
+
+    frames = plan_frames(20.0, [2, 4, 6], 24)
+    assert frames == [80, 160, 240]
+
+
+def test_plan_frames_stable_under_reorder():
+    """A slide's frame count follows its weight, so reordered slides keep their cached segments"""
+    frames = plan_frames(20.0, [2, 4, 6], 24)
+    reordered = plan_frames(20.0, [6, 2, 4], 24)
+    assert reordered == [frames[2], frames[0], frames[1]]
+
+
+def test_plan_frames_short_audio():
+    """Every slide is shown for at least one frame"""
+    frames = plan_frames(0.1, [3, 3, 3, 3, 3], 10)
+    print(f"0.1s over 5 slides at 10 fps: {frames}")
+    assert frames == [1, 1, 1, 1, 1]
+
+    frames = plan_frames(0.6, [1, 1, 10], 10)
+    assert frames == [1, 1, 4]
+
+
+if __name__ == "__main__":
+    test_plan_frames_covers_audio_exactly()
+    test_plan_frames_spreads_long_audio_over_every_slide()
+    test_plan_frames_stable_under_reorder()
+    test_plan_frames_short_audio()
+    print("✅ Timeline planner tests passed")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Test script for the TTS audio cache
+"""
+import os
+import time
+import uuid
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import tts_cache
+import text_to_audio
+from generate_process import audio_is_current
+
+
+@contextmanager
+def temp_cache():
+    """Point the cache at a scratch directory, then restore the setting and remove it"""
+    original = tts_cache.TTS_CACHE_DIR
+    tts_cache.TTS_CACHE_DIR = tempfile.mkdtemp(prefix="tts_cache_test_")
+    try:
+        yield tts_cache.TTS_CACHE_DIR
+    finally:
+        shutil.rmtree(tts_cache.TTS_CACHE_DIR, ignore_errors=True)
+        tts_cache.TTS_CACHE_DIR = original
+
+
+def test_key_ignores_whitespace_but_not_settings():
+    """Reflowed text shares a key; another voice setting does not"""
+    settings = {"stability": 0.0, "speed": 1.0}
+    key = tts_cache.cache_key("Hello  world.\r\n\r\n\r\nBye ", "voice", "model", settings, "mp3")
+    assert key == tts_cache.cache_key(" Hello world.\n\nBye", "voice", "model", dict(reversed(settings.items())), "mp3")
+    assert key != tts_cache.cache_key("Hello world.\n\nBye", "voice", "model", {**settings, "speed": 1.1}, "mp3")
+    assert key != tts_cache.cache_key("Hello world. Bye", "voice", "model", settings, "mp3")
+
+
+def test_hit_links_and_replacing_keeps_the_entry():
+    """A hit shares the cached file; replacing audio.mp3 later leaves the cache intact"""
+    folder = tempfile.mkdtemp(prefix="tts_folder_test_")
+    try:
+        with temp_cache():
+            dest = os.path.join(folder, "audio.mp3")
+            assert not tts_cache.fetch("k1", dest)
+            entry = tts_cache.store("k1", b"narration")
+            assert tts_cache.fetch("k1", dest)
+            assert os.stat(dest).st_ino == os.stat(entry).st_ino
+
+            music = os.path.join(folder, "music.mp3")
+            with open(music, "wb") as f:
+                f.write(b"background music")
+            tts_cache.place(music, dest)
+            with open(entry, "rb") as f:
+                assert f.read() == b"narration"
+            with open(dest, "rb") as f:
+                assert f.read() == b"background music"
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_evicts_least_recently_used():
+    """Over the size limit the entry used longest ago goes first"""
+    with temp_cache() as cache_dir:
+        for key in ("a", "b"):
+            tts_cache.store(key, b"x" * 100)
+        old = time.time() - 60
+        os.utime(os.path.join(cache_dir, "a.mp3"), (old, old))
+        os.utime(os.path.join(cache_dir, "b.mp3"), (old - 60, old - 60))
+        tts_cache.evict(max_bytes=150)
+        assert sorted(os.listdir(cache_dir)) == ["a.mp3"]
+
+
+def test_cached_narration_is_reused_without_the_api():
+    """text_to_speech_file() takes a cached narration and marks the audio as current"""
+    folder = f"tts_test_{uuid.uuid4().hex[:8]}"
+    folder_path = os.path.join("user_uploads", folder)
+    os.makedirs(folder_path)
+    text = "A cached description"
+    try:
+        with temp_cache():
+            with open(os.path.join(folder_path, "description.txt"), "w") as f:
+                f.write(text)
+            tts_cache.store(text_to_audio.speech_key(text), b"cached narration")
+            assert not audio_is_current(folder)
+
+            path = text_to_audio.text_to_speech_file(text, folder)
+            with open(path, "rb") as f:
+                assert f.read() == b"cached narration"
+            assert audio_is_current(folder)
+
+            # Fallback music is never current, so a re-render synthesizes again
+            text_to_audio.get_fallback_audio(folder_path)
+            assert not audio_is_current(folder)
+    finally:
+        shutil.rmtree(folder_path)
+
+
+def test_settings_are_restored():
+    """Tests leave TTS_CACHE_DIR as they found it"""
+    original = tts_cache.TTS_CACHE_DIR
+    with temp_cache() as cache_dir:
+        assert tts_cache.TTS_CACHE_DIR == cache_dir != original
+    assert tts_cache.TTS_CACHE_DIR == original and not os.path.exists(cache_dir)
+
+
+if __name__ == "__main__":
+    test_key_ignores_whitespace_but_not_settings()
+    test_hit_links_and_replacing_keeps_the_entry()
+    test_evicts_least_recently_used()
+    test_cached_narration_is_reused_without_the_api()
+    test_settings_are_restored()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test script for the ElevenLabs client against a local mock server
+"""
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import tts_client
+
+
+class MockElevenLabs(BaseHTTPRequestHandler):
+    """Answers each POST with the next scripted (status, headers, delay) and records the client port"""
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        server.ports.append(self.client_address[1])
+        status, headers, delay = server.script.pop(0) if server.script else server.default
+        time.sleep(delay)
+        body = b'audio' if status == 200 else b'{"detail": "mock error"}'
+        try:
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # the client timed out and hung up
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock(script=(), default=(200, {}, 0)):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockElevenLabs)
+    server.daemon_threads = True
+    server.script, server.default, server.ports = list(script), default, []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_client(server, **kwargs):
+    options = dict(base_url=f"http://127.0.0.1:{server.server_address[1]}", backoff_base=0.01, backoff_max=0.01)
+    options.update(kwargs)
+    return tts_client.ElevenLabsClient(**options)
+
+
+def test_retry_after_is_honoured_on_one_connection():
+    """A 429 waits out its Retry-After, and the retry reuses the pooled connection"""
+    server = start_mock([(429, {'Retry-After': '1'}, 0)])
+    client = make_client(server)
+    try:
+        started = time.monotonic()
+        assert client.text_to_speech('voice', {'text': 'hi'}, 'key') == b'audio'
+        assert time.monotonic() - started >= 1
+        assert client.text_to_speech('voice', {'text': 'again'}, 'key') == b'audio'
+        assert len(server.ports) == 3 and len(set(server.ports)) == 1
+    finally:
+        client.close()
+        server.shutdown()
+
+
+def test_hung_api_times_out():
+    """A response slower than the read timeout fails each attempt instead of blocking"""
+    server = start_mock(default=(200, {}, 1))
+    client = make_client(server, read_timeout=0.2, max_attempts=2)
+    try:
+        started = time.monotonic()
+        try:
+            client.text_to_speech('voice', {'text': 'hi'}, 'key')
+            assert False, "expected a timeout"
+        except tts_client.TTSError as e:
+            assert e.reason == 'timeout'
+        assert time.monotonic() - started < 1
+        assert len(server.ports) == 2
+    finally:
+        client.close()
+        server.shutdown()
+
+
+def test_breaker_fails_fast_then_recovers():
+    """Failures open the breaker, calls skip the API during the cool-down, a good trial closes it"""
+    server = start_mock(default=(503, {}, 0))
+    breaker = tts_client.CircuitBreaker(threshold=2, cooldown=0.5)
+    client = make_client(server, max_attempts=5, breaker=breaker)
+    try:
+        try:
+            client.text_to_speech('voice', {'text': 'hi'}, 'key')
+            assert False, "expected an API error"
+        except tts_client.TTSError as e:
+            assert e.reason == 'api_error' and e.status == 503
+        assert len(server.ports) == 2 and breaker.state == 'open'
+
+        try:
+            client.text_to_speech('voice', {'text': 'hi'}, 'key')
+            assert False, "expected the circuit to be open"
+        except tts_client.CircuitOpen as e:
+            assert e.reason == 'circuit_open'
+        assert len(server.ports) == 2
+
+        time.sleep(0.5)
+        server.default = (200, {}, 0)
+        assert breaker.state == 'half_open'
+        assert client.text_to_speech('voice', {'text': 'hi'}, 'key') == b'audio'
+        assert breaker.state == 'closed'
+    finally:
+        client.close()
+        server.shutdown()
+
+
+def test_unexpected_trial_error_does_not_wedge_the_breaker():
+    """A half-open trial that dies with a non-HTTP error lets the next call try again"""
+    server = start_mock()
+    breaker = tts_client.CircuitBreaker(threshold=1, cooldown=0.2)
+    client = make_client(server, breaker=breaker)
+    post = client._session.post
+    try:
+        breaker.record_failure()
+        time.sleep(0.2)
+        assert breaker.state == 'half_open'
+
+        def broken_post(*args, **kwargs):
+            raise KeyError('content-type')
+
+        client._session.post = broken_post
+        try:
+            client.text_to_speech('voice', {'text': 'hi'}, 'key')
+            assert False, "expected the KeyError"
+        except KeyError:
+            pass
+        assert breaker.state == 'half_open'
+
+        client._session.post = post
+        assert client.text_to_speech('voice', {'text': 'hi'}, 'key') == b'audio'
+        assert breaker.state == 'closed'
+    finally:
+        client.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_retry_after_is_honoured_on_one_connection()
+    test_hung_api_times_out()
+    test_breaker_fails_fast_then_recovers()
+    test_unexpected_trial_error_does_not_wedge_the_breaker()
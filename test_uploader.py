@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test script for reel naming and clean-up of replaced reels
+"""
+import os
+import uuid
+import tempfile
+
+import storage
+import uploader
+from app import app, db, User, Video
+from stats import forget_videos
+
+
+def test_reel_names_follow_the_content():
+    """A re-render with other content gets another key and local URL; the same content the same"""
+    folder = str(uuid.uuid4())
+    first = uploader.reel_name(folder, uploader.reel_version("a" * 64))
+    second = uploader.reel_name(folder, uploader.reel_version("b" * 64))
+    assert uploader.reel_key(first) != uploader.reel_key(second)
+    assert uploader.reel_key(first) == uploader.reel_key(uploader.reel_name(folder, uploader.reel_version("a" * 64)))
+    assert uploader.local_reel_name(uploader.local_reel_url(first)) == first
+    assert uploader.local_reel_name(f"/static/reels/{folder}.mp4") == folder
+    assert uploader.local_reel_name("https://cdn.example.com/videos/x.mp4") is None
+
+
+def test_release_keeps_objects_other_videos_use():
+    """A replaced reel shared through a render cache hit stays; one nobody uses is deleted"""
+    original = storage._storage
+    with tempfile.TemporaryDirectory() as tmp:
+        storage._storage = storage.LocalStorage(root=tmp, base_url="/media")
+        src = os.path.join(tmp, "reel.mp4")
+        with open(src, "wb") as f:
+            f.write(b"reel")
+        shared = storage._storage.put("videos/shared.mp4", src)
+        replaced = storage._storage.put("videos/replaced.mp4", src)
+        folders = [str(uuid.uuid4()), str(uuid.uuid4())]
+        try:
+            with app.app_context():
+                admin = User.query.filter_by(username='admin').first()
+                db.session.add(Video(uuid=folders[0], user_id=admin.id, status='completed',
+                                     cloudinary_url=shared))
+                db.session.add(Video(uuid=folders[1], user_id=admin.id, status='completed',
+                                     cloudinary_url="/media/videos/new.mp4"))
+                db.session.commit()
+                assert uploader.release_urls({shared, replaced}) == 1
+            assert os.path.exists(os.path.join(tmp, "videos", "shared.mp4"))
+            assert not os.path.exists(os.path.join(tmp, "videos", "replaced.mp4"))
+        finally:
+            storage._storage = original
+            with app.app_context():
+                forget_videos(Video.query.filter(Video.uuid.in_(folders)))
+                Video.query.filter(Video.uuid.in_(folders)).delete()
+                db.session.commit()
+
+
+def test_promotion_only_replaces_the_uploaded_local_url():
+    """A late upload does not overwrite a video that was re-rendered meanwhile, nor its status"""
+    folder = str(uuid.uuid4())
+    old_url = uploader.local_reel_url(uploader.reel_name(folder, "old"))
+    new_url = uploader.local_reel_url(uploader.reel_name(folder, "new"))
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        db.session.add(Video(uuid=folder, user_id=admin.id, status='processing', cloudinary_url=new_url))
+        db.session.commit()
+    try:
+        assert not uploader.promote_url(folder, old_url, "/media/videos/old.mp4")
+        assert uploader.promote_url(folder, new_url, "/media/videos/new.mp4")
+        with app.app_context():
+            video = Video.query.filter_by(uuid=folder).one()
+            assert video.cloudinary_url == "/media/videos/new.mp4" and video.status == 'processing'
+    finally:
+        with app.app_context():
+            db.session.delete(Video.query.filter_by(uuid=folder).one())
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    test_reel_names_follow_the_content()
+    test_release_keeps_objects_other_videos_use()
+    test_promotion_only_replaces_the_uploaded_local_url()
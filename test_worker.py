@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test script for the render worker's job handling
+"""
+import os
+import uuid
+import shutil
+from datetime import datetime, timedelta
+
+from app import app, db, User, Video, RenderJob
+import job_queue
+from job_queue import enqueue_job, requeue_stale_jobs, JobProgress
+from worker import process_job
+
+
+def test_failed_render_fails_the_video():
+    """A job whose create_reel() gives up early (no input.txt) fails its video too"""
+    folder = str(uuid.uuid4())
+    folder_path = os.path.join("user_uploads", folder)
+    os.makedirs(folder_path)
+    with open(os.path.join(folder_path, "description.txt"), "w") as f:
+        f.write("A reel without slides")
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        video = Video(uuid=folder, description="A reel without slides", user_id=admin.id, status='processing')
+        db.session.add(video)
+        job = enqueue_job(video)
+        db.session.commit()
+        job_id = job.id
+    try:
+        assert process_job(job_id, folder) is False
+        with app.app_context():
+            assert db.session.get(RenderJob, job_id).status == 'failed'
+            assert Video.query.filter_by(uuid=folder).one().status == 'failed'
+    finally:
+        with app.app_context():
+            db.session.delete(Video.query.filter_by(uuid=folder).one())
+            db.session.commit()
+        shutil.rmtree(folder_path)
+
+
+def test_stale_jobs_are_judged_by_heartbeat():
+    """A long render that keeps reporting progress stays with its worker; a silent one is re-queued"""
+    long_ago = datetime.now() - timedelta(seconds=job_queue.JOB_STALE_SECONDS + 60)
+    folders = [str(uuid.uuid4()), str(uuid.uuid4())]
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        job_ids = []
+        for folder in folders:
+            video = Video(uuid=folder, user_id=admin.id, status='processing')
+            db.session.add(video)
+            job = enqueue_job(video)
+            job.status, job.worker_id, job.attempts = 'running', 'test:1:w0', 1
+            job.started_at = job.heartbeat_at = long_ago
+            db.session.commit()
+            job_ids.append(job.id)
+    try:
+        JobProgress(job_ids[0]).stage('encode', 40.0)
+        with app.app_context():
+            requeue_stale_jobs()
+            alive, silent = (db.session.get(RenderJob, job_id) for job_id in job_ids)
+            assert alive.status == 'running' and alive.worker_id == 'test:1:w0'
+            assert silent.status == 'queued' and silent.worker_id is None and silent.heartbeat_at is None
+    finally:
+        with app.app_context():
+            for folder in folders:
+                db.session.delete(Video.query.filter_by(uuid=folder).one())
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    test_failed_render_fails_the_video()
+    test_stale_jobs_are_judged_by_heartbeat()
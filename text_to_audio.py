@@ -1,16 +1,50 @@
 import os
-import requests
-import shutil
+import time
 from dotenv import load_dotenv
+import tts_cache
+import tts_client
+from logs import get_logger
+from metrics import TTS_SECONDS, TTS_FALLBACKS
 
 # Load environment variables
 load_dotenv()
+log = get_logger(__name__)
 
 ELEVENLABS_API_KEY = os.environ.get('ELEVENLABS_API_KEY')
 if not ELEVENLABS_API_KEY:
-    print("[ERROR] No ElevenLabs API key found in environment variables")
+    log.error("No ElevenLabs API key found in environment variables")
     ELEVENLABS_API_KEY = None
 
+# Everything below is part of the TTS cache key (tts_cache.py)
+VOICE_ID = "pNInz6obpgDQGcFmaJgB"  # Adam voice
+MODEL_ID = "eleven_turbo_v2_5"
+VOICE_SETTINGS = {
+    "stability": 0.0,
+    "similarity_boost": 1.0,
+    "style": 0.0,
+    "use_speaker_boost": True,
+    "speed": 1.0
+}
+OUTPUT_FORMAT = "mp3_22050_32"
+# Next to audio.mp3: the cache key of the narration it holds (absent for fallback music)
+AUDIO_KEY_FILE = "audio.key"
+
+
+def speech_key(text: str) -> str:
+    """Cache key of the narration of text with the current voice settings"""
+    return tts_cache.cache_key(text, VOICE_ID, MODEL_ID, VOICE_SETTINGS, OUTPUT_FORMAT)
+
+
+def _mark_audio(folder_path, key):
+    """Record which narration audio.mp3 holds (None: not a narration)"""
+    marker_path = os.path.join(folder_path, AUDIO_KEY_FILE)
+    if key is None:
+        if os.path.exists(marker_path):
+            os.remove(marker_path)
+        return
+    with open(marker_path, "w") as f:
+        f.write(key)
+
 
 def get_fallback_audio(folder_path: str) -> str:
     """
@@ -28,81 +62,88 @@ def get_fallback_audio(folder_path: str) -> str:
         for music_file in background_music_files:
             if os.path.exists(music_file):
                 fallback_path = os.path.join(folder_path, "audio.mp3")
-                shutil.copy2(music_file, fallback_path)
-                print(f"[INFO] Using fallback background music: {music_file}")
+                _mark_audio(folder_path, None)
+                # Replaces rather than overwrites: audio.mp3 may be linked to a TTS cache entry
+                tts_cache.place(music_file, fallback_path)
+                log.info("Using fallback background music", file=music_file)
                 return fallback_path
         
-        print("[WARNING] No background music files found in static/songs/")
+        log.warning("No background music files found in static/songs/")
         return ""
         
-    except Exception as e:
-        print(f"[ERROR] Failed to copy background music: {e}")
+    except Exception:
+        log.exception("Failed to copy background music")
         return ""
 
 
 def text_to_speech_file(text: str, folder: str) -> str:
+    """
+    Narrate text into user_uploads/<folder>/audio.mp3, or copy in background
+    music if speech synthesis is not possible.
+    
+    Returns:
+        str: Path of the audio file, or "" if not even the fallback worked
+    """
+    started = time.perf_counter()
+    path, source = _synthesize(text, folder)
+    if source not in ('speech', 'cache'):
+        TTS_FALLBACKS.inc(reason=source)
+    TTS_SECONDS.observe(time.perf_counter() - started,
+                        outcome=source if source in ('speech', 'cache') else 'fallback')
+    return path
+
+
+def _synthesize(text, folder):
+    """(audio path, 'speech' or 'cache'), or when falling back to background music (path, reason)"""
     try:
-        print(f"[DEBUG] text_to_speech_file called for folder: {folder}")
-        
         folder_path = os.path.join("user_uploads", folder)
         if not os.path.exists(folder_path):
-            print(f"[DEBUG] Folder {folder_path} does not exist. Creating...")
+            log.debug("Creating missing folder", path=folder_path)
             os.makedirs(folder_path, exist_ok=True)
         
+        text = tts_cache.normalize_text(text)
+        key = speech_key(text)
+        save_file_path = os.path.join(folder_path, "audio.mp3")
+        if tts_cache.fetch(key, save_file_path):
+            _mark_audio(folder_path, key)
+            log.info("Reused cached narration", folder=folder, key=key[:12])
+            return save_file_path, 'cache'
+        
         if not ELEVENLABS_API_KEY:
-            print("[INFO] ElevenLabs API key not found, using background music fallback")
-            return get_fallback_audio(folder_path)
+            log.info("ElevenLabs API key not found, using background music fallback", folder=folder)
+            return get_fallback_audio(folder_path), 'no_api_key'
             
-        # ElevenLabs API endpoint
-        voice_id = "pNInz6obpgDQGcFmaJgB"  # Adam voice
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-        
-        headers = {
-            "Accept": "audio/mpeg",
-            "Content-Type": "application/json",
-            "xi-api-key": ELEVENLABS_API_KEY
-        }
-        
         data = {
             "text": text,
-            "model_id": "eleven_turbo_v2_5",
-            "voice_settings": {
-                "stability": 0.0,
-                "similarity_boost": 1.0,
-                "style": 0.0,
-                "use_speaker_boost": True,
-                "speed": 1.0
-            },
-            "output_format": "mp3_22050_32"
+            "model_id": MODEL_ID,
+            "voice_settings": VOICE_SETTINGS,
+            "output_format": OUTPUT_FORMAT
         }
         
-        print(f"[DEBUG] Making API request to ElevenLabs...")
-        response = requests.post(url, json=data, headers=headers)
+        log.debug("Making API request to ElevenLabs", folder=folder, chars=len(text))
+        try:
+            content = tts_client.get_client().text_to_speech(VOICE_ID, data, ELEVENLABS_API_KEY)
+        except tts_client.CircuitOpen as e:
+            log.warning("ElevenLabs circuit open, using background music", folder=folder, retry_in=round(e.retry_in))
+            return get_fallback_audio(folder_path), e.reason
+        except tts_client.TTSError as e:
+            log.error("ElevenLabs API error, falling back to background music", folder=folder,
+                      reason=e.reason, status=e.status, error=str(e))
+            return get_fallback_audio(folder_path), e.reason
         
-        if response.status_code == 200:
-            save_file_path = os.path.join(folder_path, "audio.mp3")
-            print(f"[DEBUG] Saving audio to: {save_file_path}")
-            
-            with open(save_file_path, "wb") as f:
-                f.write(response.content)
-                
-            print(f"{save_file_path}: A new audio file was saved successfully!")
-            return save_file_path
-        else:
-            print(f"[ERROR] ElevenLabs API error: {response.status_code} - {response.text}")
-            
-            # Check for specific API errors and provide fallback
-            if response.status_code == 401:
-                print("[INFO] API key issue detected, falling back to background music")
-            elif response.status_code == 429:
-                print("[INFO] Rate limit exceeded, falling back to background music") 
-            else:
-                print("[INFO] API error occurred, falling back to background music")
-                
-            return get_fallback_audio(folder_path)
+        try:
+            tts_cache.place(tts_cache.store(key, content), save_file_path)
+        except OSError as e:
+            log.warning("Could not cache synthesized audio", folder=folder, error=str(e))
+            with open(save_file_path + ".tmp", "wb") as f:
+                f.write(content)
+            os.replace(save_file_path + ".tmp", save_file_path)
+        _mark_audio(folder_path, key)
+        
+        log.info("Saved synthesized audio", folder=folder, path=save_file_path, size=len(content))
+        return save_file_path, 'speech'
             
-    except Exception as e:
-        print(f"[ERROR] Exception in text_to_speech_file: {e}")
-        print("[INFO] Exception occurred, falling back to background music")
-        return get_fallback_audio(folder_path)
+    except Exception:
+        log.exception("Text to speech failed, falling back to background music", folder=folder)
+        return get_fallback_audio(folder_path), 'exception'
 
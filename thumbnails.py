@@ -0,0 +1,119 @@
+"""
+Poster frames, thumbnails and metadata of finished reels.
+
+After a reel is encoded, one frame is grabbed with ffmpeg (piped straight into
+PIL, no temp file) and saved twice:
+
+    <reel>_poster.webp  POSTER_WIDTH wide, shown on gallery cards
+    <reel>_thumb.jpg    THUMBNAIL_WIDTH wide, for small listings / srcset
+
+where <reel> is the versioned reel name (<folder>-<version>, see uploader.py).
+
+The reel is also probed for the Video.duration, size and format columns.
+"""
+import io
+import os
+import json
+import subprocess
+
+from PIL import Image, features
+
+from timeline import probe_duration
+from logs import get_logger, tail_output
+from metrics import FFMPEG_SECONDS
+
+log = get_logger(__name__)
+
+POSTER_WIDTH = int(os.environ.get('POSTER_WIDTH', 540))
+THUMBNAIL_WIDTH = int(os.environ.get('THUMBNAIL_WIDTH', 180))
+POSTER_QUALITY = int(os.environ.get('POSTER_QUALITY', 80))
+# Grab the poster a little into the reel, past any fade-in
+POSTER_OFFSET_SECONDS = 1.0
+# Browsers without WebP support are rare; fall back to JPEG if PIL lacks it
+POSTER_FORMAT = 'webp' if features.check('webp') else 'jpg'
+
+
+def probe_metadata(path):
+    """
+    Duration, size and container format of a media file.
+
+    Returns:
+        dict: {'duration': float or None, 'size': int, 'format': str}
+    """
+    duration = None
+    container = os.path.splitext(path)[1].lstrip('.').lower() or None
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration,format_name',
+                                 '-of', 'json', path],
+                                capture_output=True, text=True, timeout=30)
+        if result.returncode == 0:
+            info = json.loads(result.stdout).get('format', {})
+            duration = float(info['duration']) if info.get('duration') else None
+            names = info.get('format_name', '').split(',')
+            # mp4 files report the whole ISO-BMFF family ("mov,mp4,m4a,...")
+            if container not in names and names[0]:
+                container = names[0]
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        pass
+    if duration is None:
+        duration = probe_duration(path)
+    return {
+        'duration': round(duration, 3) if duration else None,
+        'size': os.path.getsize(path),
+        'format': container[:10] if container else None,
+    }
+
+
+def grab_frame(video_path, seconds):
+    """Decode the frame at `seconds` into a PIL image (None on failure)"""
+    command = ['ffmpeg', '-v', 'error', '-ss', f"{seconds:.3f}", '-i', video_path,
+               '-frames:v', '1', '-f', 'image2pipe', '-vcodec', 'png', '-']
+    try:
+        # Wall time only: subprocess.run() reaps the child without its CPU usage
+        with FFMPEG_SECONDS.time(step='poster'):
+            result = subprocess.run(command, capture_output=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        log.warning("Could not grab a frame", path=video_path, error=str(e))
+        return None
+    if result.returncode != 0 or not result.stdout:
+        log.warning("Could not grab a frame", path=video_path, exit_code=result.returncode,
+                    ffmpeg_output=tail_output(result.stderr.decode(errors='replace')))
+        return None
+    return Image.open(io.BytesIO(result.stdout)).convert('RGB')
+
+
+def _resized(image, width):
+    height = max(round(image.height * width / image.width), 1)
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def extract_posters(video_path, dest_dir, name, duration=None):
+    """
+    Write the poster and thumbnail of a reel.
+
+    Args:
+        video_path (str): The finished reel
+        dest_dir (str): Directory for the images
+        name (str): Reel name, used for the file names
+        duration (float): Reel length, to keep the poster offset inside short reels
+
+    Returns:
+        tuple or None: (poster_path, thumbnail_path), None if no frame could be decoded
+    """
+    offset = POSTER_OFFSET_SECONDS
+    if duration:
+        offset = min(offset, duration / 2)
+    frame = grab_frame(video_path, offset)
+    if frame is None:
+        return None
+
+    poster_path = os.path.join(dest_dir, f"{name}_poster.{POSTER_FORMAT}")
+    thumbnail_path = os.path.join(dest_dir, f"{name}_thumb.jpg")
+    poster = _resized(frame, min(POSTER_WIDTH, frame.width))
+    if POSTER_FORMAT == 'webp':
+        poster.save(poster_path, 'WEBP', quality=POSTER_QUALITY, method=4)
+    else:
+        poster.save(poster_path, 'JPEG', quality=POSTER_QUALITY, optimize=True, progressive=True)
+    _resized(frame, min(THUMBNAIL_WIDTH, frame.width)).save(
+        thumbnail_path, 'JPEG', quality=POSTER_QUALITY, optimize=True, progressive=True)
+    return poster_path, thumbnail_path
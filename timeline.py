@@ -0,0 +1,101 @@
+"""
+Audio-duration-aware timeline planning.
+
+Instead of giving every slide a fixed 3 seconds and cutting the result down to
+the narration with -shortest, the planner probes the real length of audio.mp3
+and spreads it over all slides in whole frames of the output frame rate, in
+proportion to the input.txt durations. The encoder then produces exactly the
+frames that end up in the reel: nothing is encoded only to be cut off, and
+the last slide is never stretched.
+
+Segments are cached by their frame count (see segments.py), so slides whose
+share comes out the same reuse their segments across edits and re-renders.
+"""
+import re
+import subprocess
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def probe_duration(path):
+    """
+    Duration of a media file in seconds, or None if it cannot be determined.
+
+    Uses ffprobe, falling back to parsing the "Duration:" line that
+    "ffmpeg -i" prints when ffprobe is not installed.
+    """
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                                 '-of', 'default=noprint_wrappers=1:nokey=1', path],
+                                capture_output=True, text=True, timeout=30)
+        if result.returncode == 0:
+            return float(result.stdout.strip())
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        pass
+
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-i', path],
+                                capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    match = _DURATION_RE.search(result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def plan_frames(total_seconds, weights, fps):
+    """
+    Split total_seconds into whole frames per slide, proportionally to weights.
+
+    Each slide gets the floor of its exact share, at least one frame. The
+    frames left over by rounding go one each to the slides with the largest
+    fractional shares (the earlier slide on a tie), so the slides add up to
+    the audio without any one of them taking up the difference. Audio shorter
+    than one frame per slide still shows every slide for a frame.
+
+    Returns:
+        list: Frames per slide
+    """
+    count = len(weights)
+    total_frames = max(int(round(total_seconds * fps)), count)
+    weights = [max(float(w), 0.0) for w in weights]
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        weights, weight_sum = [1.0] * count, float(count)
+
+    shares = [total_frames * w / weight_sum for w in weights]
+    frames = [max(int(share), 1) for share in shares]
+    by_remainder = sorted(range(count), key=lambda i: (frames[i] - shares[i], i))
+    slack = total_frames - sum(frames)
+    for i in by_remainder[:max(slack, 0)]:
+        frames[i] += 1
+    # Slides raised to one frame are paid for by the longest ones
+    while slack < 0:
+        frames[frames.index(max(frames))] -= 1
+        slack += 1
+    return frames
+
+
+def _seconds(frame_count, fps):
+    return f"{frame_count / fps:.6f}".rstrip('0').rstrip('.')
+
+
+def plan_timeline(audio_path, weights, fps):
+    """
+    Plan slide durations that exactly cover the audio track.
+
+    Args:
+        audio_path (str): Narration / music track
+        weights (list): Relative slide lengths (e.g. the durations from input.txt)
+        fps (int): Output frame rate of the encoding profile
+
+    Returns:
+        list or None: Durations in seconds, one per slide, each a whole number
+        of frames. None if the audio length could not be probed.
+    """
+    audio_seconds = probe_duration(audio_path)
+    if not audio_seconds:
+        return None
+    return [_seconds(n, fps) for n in plan_frames(audio_seconds, weights, fps)]
@@ -0,0 +1,169 @@
+"""
+Disk cache of synthesized narration.
+
+Audio from ElevenLabs is keyed by a hash of the normalized text, the voice,
+the model, the voice settings and the output format. The same description
+read the same way is then synthesized once, not on every render, retry or
+repost.
+
+Layout under TTS_CACHE_DIR:
+    <key>.mp3
+
+Entries are written to a temporary file and renamed into place, so a
+concurrent worker never sees a partial file. Two workers that synthesize the
+same text at the same time both store it, and the last rename wins. A hit is
+hard-linked into the job folder as audio.mp3, or copied where the job folder
+is on another filesystem. Linked files share their bytes with the cache, so
+audio.mp3 is only ever replaced, never written into. The least recently used
+entries are evicted once the cache exceeds TTS_CACHE_MAX_BYTES.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import unicodedata
+
+from logs import get_logger
+from metrics import TTS_CACHE_LOOKUPS, TTS_CACHE_EVICTIONS
+
+log = get_logger(__name__)
+
+TTS_CACHE_DIR = os.environ.get('TTS_CACHE_DIR', 'tts_cache')
+TTS_CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def cache_stats():
+    """Hit/miss counters for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+
+def normalize_text(text):
+    """
+    The text as it is sent for synthesis: NFC, no trailing spaces, single
+    spaces within lines and at most one blank line between paragraphs.
+    """
+    text = unicodedata.normalize('NFC', text or '').replace('\r\n', '\n').replace('\r', '\n')
+    lines = [re.sub(r'[ \t\f\v]+', ' ', line).strip() for line in text.split('\n')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def cache_key(text, voice_id, model_id, voice_settings, output_format):
+    """Hash everything that determines the synthesized audio (text is normalized first)"""
+    payload = json.dumps({'text': normalize_text(text), 'voice_id': voice_id, 'model_id': model_id,
+                          'voice_settings': voice_settings, 'output_format': output_format},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _audio_path(key):
+    return os.path.join(TTS_CACHE_DIR, f"{key}.mp3")
+
+
+def place(src_path, dest_path):
+    """
+    Put src_path at dest_path as a hard link (a copy across filesystems),
+    replacing dest_path atomically rather than writing into it.
+    """
+    tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)  # left behind by a crashed run
+    try:
+        try:
+            os.link(src_path, tmp_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # Another filesystem (EXDEV) or no hard link support
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def fetch(key, dest_path):
+    """
+    Place the cached audio for key at dest_path.
+
+    Returns:
+        bool: True on a hit, False if the key is not cached
+    """
+    path = _audio_path(key)
+    try:
+        os.utime(path)  # mark as recently used for LRU eviction
+        place(path, dest_path)
+    except FileNotFoundError:
+        # Not cached, or evicted between the two calls
+        _count('misses')
+        TTS_CACHE_LOOKUPS.inc(result='miss')
+        return False
+    _count('hits')
+    TTS_CACHE_LOOKUPS.inc(result='hit')
+    return True
+
+
+def store(key, data):
+    """
+    Add synthesized audio to the cache.
+
+    Returns:
+        str: Path of the cache entry
+    """
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    # Atomic replace so concurrent workers never read a half-written entry
+    fd, tmp_path = tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, _audio_path(key))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _count('stores')
+    evict(keep=key)
+    return _audio_path(key)
+
+
+def evict(max_bytes=None, keep=None):
+    """Remove least-recently-used entries (except keep) until the cache fits in max_bytes"""
+    max_bytes = TTS_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    files = []
+    for name in os.listdir(TTS_CACHE_DIR):
+        if name.endswith('.mp3') and name != f"{keep}.mp3":
+            path = os.path.join(TTS_CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    if keep and os.path.exists(_audio_path(keep)):
+        total += os.path.getsize(_audio_path(keep))
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        _count('evictions')
+        TTS_CACHE_EVICTIONS.inc()
+        log.info("Evicted TTS cache entry", file=os.path.basename(path), size=size)
@@ -0,0 +1,269 @@
+"""
+HTTP client for the ElevenLabs text-to-speech API.
+
+One client per process (get_client()) keeps a pool of keep-alive connections,
+so only the first narration of a worker pays for the TLS handshake. Every
+attempt is bounded by a connect and a read timeout, and a whole synthesis,
+retries included, by TTS_DEADLINE.
+
+Timeouts, connection errors, 429 and 5xx responses are retried with
+exponential backoff and full jitter. A Retry-After header is honoured instead
+when the API sends one. Any other status is not retried.
+
+A circuit breaker counts consecutive failed attempts. After
+TTS_BREAKER_THRESHOLD of them it opens, and for TTS_BREAKER_COOLDOWN seconds
+calls fail at once with CircuitOpen, so jobs go straight to fallback music
+instead of waiting out timeouts. After the cool-down one trial call is let
+through. Its success closes the breaker and its failure opens it again. The
+breaker is per process, so each render worker finds out on its own.
+
+ELEVENLABS_API_URL points the client at another server, such as a local mock.
+"""
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logs import get_logger
+from metrics import TTS_API_ATTEMPTS, TTS_CIRCUIT_OPENS
+
+log = get_logger(__name__)
+
+ELEVENLABS_API_URL = os.environ.get('ELEVENLABS_API_URL', 'https://api.elevenlabs.io').rstrip('/')
+TTS_CONNECT_TIMEOUT = float(os.environ.get('TTS_CONNECT_TIMEOUT', 5))
+TTS_READ_TIMEOUT = float(os.environ.get('TTS_READ_TIMEOUT', 60))
+# Time budget of one synthesis, retries and waits included
+TTS_DEADLINE = float(os.environ.get('TTS_DEADLINE', 120))
+TTS_MAX_ATTEMPTS = int(os.environ.get('TTS_MAX_ATTEMPTS', 4))
+TTS_BACKOFF_BASE = float(os.environ.get('TTS_BACKOFF_BASE', 2))
+TTS_BACKOFF_MAX = float(os.environ.get('TTS_BACKOFF_MAX', 20))
+# Longer Retry-After waits are not worth holding a render worker for
+TTS_RETRY_AFTER_MAX = float(os.environ.get('TTS_RETRY_AFTER_MAX', 30))
+TTS_BREAKER_THRESHOLD = int(os.environ.get('TTS_BREAKER_THRESHOLD', 5))
+TTS_BREAKER_COOLDOWN = float(os.environ.get('TTS_BREAKER_COOLDOWN', 60))
+TTS_POOL_SIZE = int(os.environ.get('TTS_POOL_SIZE', 4))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TTSError(Exception):
+    """
+    A synthesis that did not produce audio.
+
+    reason is the fallback reason recorded in metrics: auth, rate_limit,
+    api_error, timeout, connection or circuit_open.
+    """
+
+    def __init__(self, reason, message, status=None):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+
+
+class CircuitOpen(TTSError):
+    """The breaker is open; the API was not called"""
+
+    def __init__(self, retry_in):
+        super().__init__('circuit_open', f"ElevenLabs circuit open, next trial in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a cool-down and a single half-open trial"""
+
+    def __init__(self, threshold=TTS_BREAKER_THRESHOLD, cooldown=TTS_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._trial or time.monotonic() - self._opened_at < self.cooldown:
+                return 'open'
+            return 'half_open'
+
+    def before_call(self):
+        """
+        Raise CircuitOpen unless a call may go out now.
+
+        Returns:
+            bool: True if this call is the half-open trial (see end_trial)
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            retry_in = self._opened_at + self.cooldown - time.monotonic()
+            if retry_in > 0 or self._trial:
+                raise CircuitOpen(max(retry_in, 0))
+            # Half-open: this call is the trial, everyone else keeps failing fast
+            self._trial = True
+            return True
+
+    def end_trial(self):
+        """Let another trial through if the trial call ended without recording an outcome"""
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            was_open = self._opened_at is not None
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+        if was_open:
+            log.info("ElevenLabs circuit closed")
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if not self._trial and (self._opened_at is not None or self._failures < self.threshold):
+                return
+            self._opened_at = time.monotonic()
+            self._trial = False
+            failures = self._failures
+        TTS_CIRCUIT_OPENS.inc()
+        log.warning("ElevenLabs circuit opened", failures=failures, cooldown=self.cooldown)
+
+
+def retry_after_seconds(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), None if absent or invalid"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class ElevenLabsClient:
+    """Pooled, retrying ElevenLabs client (share one per process via get_client())"""
+
+    def __init__(self, base_url=ELEVENLABS_API_URL, connect_timeout=TTS_CONNECT_TIMEOUT,
+                 read_timeout=TTS_READ_TIMEOUT, deadline=TTS_DEADLINE, max_attempts=TTS_MAX_ATTEMPTS,
+                 backoff_base=TTS_BACKOFF_BASE, backoff_max=TTS_BACKOFF_MAX, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._session = requests.Session()
+        # Retries are ours, so urllib3 must not retry on its own
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TTS_POOL_SIZE, max_retries=0)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def close(self):
+        self._session.close()
+
+    def text_to_speech(self, voice_id, payload, api_key):
+        """
+        Synthesize payload (text, model and voice settings) with voice_id.
+
+        Returns:
+            bytes: The audio
+
+        Raises:
+            TTSError: When no audio could be had; CircuitOpen while the breaker is open
+        """
+        url = f"{self.base_url}/v1/text-to-speech/{voice_id}"
+        headers = {"Accept": "audio/mpeg", "xi-api-key": api_key}
+        give_up_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            trial = self.breaker.before_call()
+            # The last attempt only gets what is left of the deadline
+            read_timeout = max(min(self.read_timeout, give_up_at - time.monotonic()), 0.1)
+            retry_after = None
+            try:
+                try:
+                    response = self._session.post(url, json=payload, headers=headers,
+                                                  timeout=(self.connect_timeout, read_timeout))
+                except requests.Timeout as e:
+                    error = TTSError('timeout', f"ElevenLabs request timed out: {e}")
+                except requests.RequestException as e:
+                    error = TTSError('connection', f"ElevenLabs request failed: {e}")
+                else:
+                    if response.status_code == 200:
+                        TTS_API_ATTEMPTS.inc(outcome='ok')
+                        self.breaker.record_success()
+                        return response.content
+                    error = self._status_error(response)
+                    if response.status_code not in RETRY_STATUSES:
+                        # The API answered; the request itself is wrong, so retrying cannot help
+                        TTS_API_ATTEMPTS.inc(outcome=error.reason)
+                        self.breaker.record_success()
+                        raise error
+                    retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+
+                TTS_API_ATTEMPTS.inc(outcome=error.reason)
+                self.breaker.record_failure()
+            finally:
+                if trial:
+                    # Any other exception would otherwise leave the breaker open for good
+                    self.breaker.end_trial()
+            if attempt >= self.max_attempts or self.breaker.state != 'closed':
+                raise error
+            if retry_after is not None:
+                if retry_after > TTS_RETRY_AFTER_MAX:
+                    raise error
+                delay = retry_after
+            else:
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base ** attempt))
+            if time.monotonic() + delay >= give_up_at:
+                raise error
+            log.warning("ElevenLabs attempt failed, retrying", attempt=attempt, reason=error.reason,
+                        status=error.status, error=str(error), retry_in=round(delay, 2))
+            time.sleep(delay)
+
+    @staticmethod
+    def _status_error(response):
+        if response.status_code == 401:
+            reason = 'auth'
+        elif response.status_code == 429:
+            reason = 'rate_limit'
+        else:
+            reason = 'api_error'
+        return TTSError(reason, f"ElevenLabs returned {response.status_code}: {response.text[:500]}",
+                        status=response.status_code)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The ElevenLabs client of this process (created on first use)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ElevenLabsClient()
+        return _client
+
+
+def _reset_in_child():
+    # A forked worker must not share pooled sockets (or the breaker) with its parent
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
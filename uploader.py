@@ -0,0 +1,347 @@
+"""
+Background reel uploads to the configured storage backend (storage.py).
+
+Render workers hand finished reels to a small, bounded pool of upload threads
+and move on to the next encode. Uploads retry transient failures with
+exponential backoff. A reel whose upload fails for good keeps being served
+from its local file. reconcile_local_urls() later finds such reels and uploads
+them again, promoting the local URL to the storage URL.
+"""
+import os
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import or_, update
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import render_cache
+from storage import get_storage
+from logs import get_logger
+from metrics import UPLOAD_SECONDS
+
+log = get_logger(__name__)
+
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+# Pending uploads per process; submit_upload() blocks beyond this (backpressure)
+UPLOAD_QUEUE_SIZE = int(os.environ.get('UPLOAD_QUEUE_SIZE', 8))
+UPLOAD_MAX_ATTEMPTS = int(os.environ.get('UPLOAD_MAX_ATTEMPTS', 5))
+UPLOAD_BACKOFF_BASE = float(os.environ.get('UPLOAD_BACKOFF_BASE', 2))
+UPLOAD_BACKOFF_MAX = float(os.environ.get('UPLOAD_BACKOFF_MAX', 60))
+# Local-URL reels older than this are re-uploaded by the reconciler
+RECONCILE_MIN_AGE = int(os.environ.get('RECONCILE_MIN_AGE', 10 * 60))
+RECONCILE_BATCH = 20
+# Finished reels and previews before (or instead of) being uploaded
+REELS_DIR = 'static/reels'
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(UPLOAD_QUEUE_SIZE)
+_in_flight = set()
+_pending = set()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload')
+        return _executor
+
+
+# Reels, posters and thumbnails are named <folder>-<version>, where the version
+# is taken from the render cache key of their content. A re-render after a
+# slide edit gets new names, so objects that render cache hits share with
+# other videos are never overwritten with different content.
+def reel_version(cache_key):
+    """Short content version of a render (a prefix of its render cache key)"""
+    return cache_key[:16]
+
+
+def reel_name(folder, version):
+    return f"{folder}-{version}"
+
+
+def reel_key(name):
+    """Storage key of a finished reel"""
+    return f"videos/{name}.mp4"
+
+
+def local_reel_path(name):
+    return os.path.join(REELS_DIR, f"{name}.mp4")
+
+
+def local_preview_path(folder):
+    return os.path.join(REELS_DIR, f"{folder}_preview.mp4")
+
+
+def local_reel_url(name):
+    # Served by main.serve_reel (Range/sendfile aware), not the static handler
+    return f"/reels/{name}.mp4"
+
+
+def local_reel_name(url):
+    """Reel name of a local reel URL (/reels/<name>.mp4, or the older /static/reels/), None otherwise"""
+    for prefix in ('/reels/', '/static/reels/'):
+        if url and url.startswith(prefix) and url.endswith('.mp4'):
+            return url[len(prefix):-len('.mp4')]
+    return None
+
+
+def local_preview_url(folder):
+    return f"/reels/{folder}_preview.mp4"
+
+
+def publish_image(path):
+    """
+    Store a small image (poster, thumbnail) from REELS_DIR right away.
+
+    Returns:
+        str: Its storage URL, or its local /reels URL if storing failed
+    """
+    name = os.path.basename(path)
+    try:
+        url = get_storage().put(f"posters/{name}", path)
+    except Exception as e:
+        log.warning("Could not store image, serving it locally", name=name, error=str(e))
+        return f"/reels/{name}"
+    os.remove(path)
+    return url
+
+
+def upload_with_retry(folder, path, key):
+    """
+    Store a reel under key, retrying transient failures.
+
+    Returns:
+        str: The public URL of the stored reel
+
+    Raises:
+        Exception: The last error once retries are exhausted or on a permanent error
+    """
+    storage = get_storage()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return storage.put(key, path)
+        except storage.permanent_errors:
+            raise
+        except Exception as e:
+            if attempt >= UPLOAD_MAX_ATTEMPTS:
+                raise
+            # Exponential backoff with full jitter
+            delay = random.uniform(0, min(UPLOAD_BACKOFF_MAX, UPLOAD_BACKOFF_BASE ** attempt))
+            log.warning("Upload attempt failed, retrying", folder=folder, attempt=attempt,
+                        error=str(e), retry_in=round(delay, 1))
+            time.sleep(delay)
+
+
+def promote_url(folder, local_url, url):
+    """
+    Swap the local URL of a video for its storage URL, but only while the
+    video still has that local URL (compare-and-set). A re-render or a
+    delete that happened during the upload wins.
+
+    Returns:
+        bool: True if the video now has url
+    """
+    from app import app, db, Video
+    with app.app_context():
+        result = db.session.execute(update(Video)
+                                    .where(Video.uuid == folder, Video.cloudinary_url == local_url)
+                                    .values(cloudinary_url=url))
+        db.session.commit()
+    return result.rowcount == 1
+
+
+def _upload_task(folder, path, key, local_url, cache_key):
+    try:
+        storage_name = get_storage().name
+        log.info("Uploading reel", folder=folder, path=path, storage=storage_name)
+        started = time.time()
+        try:
+            url = upload_with_retry(folder, path, key)
+        except Exception:
+            UPLOAD_SECONDS.observe(time.time() - started, storage=storage_name, outcome='failed')
+            raise
+        UPLOAD_SECONDS.observe(time.time() - started, storage=storage_name, outcome='ok')
+        log.info("Reel uploaded", folder=folder, storage=storage_name, seconds=round(time.time() - started, 1),
+                 url=url)
+        if not promote_url(folder, local_url, url):
+            log.info("Video changed during the upload, discarding it", folder=folder, url=url)
+            from app import app
+            with app.app_context():
+                release_urls({local_url, url})
+            return None
+
+        if cache_key:
+            try:
+                render_cache.store_url(cache_key, url)
+            except OSError as e:
+                log.warning("Could not record upload in the render cache", folder=folder, error=str(e))
+
+        # Clean up local file after upload
+        if os.path.exists(path):
+            os.remove(path)
+            log.debug("Local video file removed", path=path)
+        return url
+    except Exception:
+        log.exception("Failed to upload reel, keeping local copy", folder=folder)
+        return None
+    finally:
+        _in_flight.discard(key)
+        _slots.release()
+
+
+def submit_upload(folder, path, cache_key=None, local_url=None):
+    """
+    Queue a background upload of a finished reel (path is its local_reel_path).
+
+    Blocks only when UPLOAD_QUEUE_SIZE uploads are already pending.
+
+    Args:
+        local_url (str): The URL the video serves the reel from until the
+            upload replaces it (defaults to the local_reel_url of path)
+
+    Returns:
+        concurrent.futures.Future or None: None if this reel is already being uploaded
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    key = reel_key(name)
+    if key in _in_flight:
+        return None
+    _slots.acquire()
+    _in_flight.add(key)
+    try:
+        future = _pool().submit(_upload_task, folder, path, key, local_url or local_reel_url(name), cache_key)
+        _pending.add(future)
+        future.add_done_callback(_pending.discard)
+        return future
+    except Exception:
+        _in_flight.discard(key)
+        _slots.release()
+        raise
+
+
+def reconcile_local_urls():
+    """
+    Re-upload completed reels that are still served from a local file.
+
+    Returns:
+        int: Number of uploads queued
+    """
+    from app import app, Video
+    cutoff = datetime.now() - timedelta(seconds=RECONCILE_MIN_AGE)
+    with app.app_context():
+        videos = Video.query.filter(Video.status == 'completed',
+                                    or_(Video.cloudinary_url.like('/reels/%'),
+                                        Video.cloudinary_url.like('/static/reels/%')),
+                                    Video.updated_at < cutoff) \
+            .order_by(Video.updated_at).limit(RECONCILE_BATCH).all()
+        reels = [(video.uuid, video.cloudinary_url) for video in videos]
+
+    queued = 0
+    for folder, local_url in reels:
+        name = local_reel_name(local_url)
+        path = local_reel_path(name)
+        if not os.path.exists(path) or reel_key(name) in _in_flight:
+            continue
+        if submit_upload(folder, path, local_url=local_url):
+            queued += 1
+    if queued:
+        log.info("Reconciler queued local reels for upload", count=queued)
+    return queued
+
+
+def delete_reels(videos):
+    """
+    Remove the stored and local files (reel, preview, poster, thumbnail) of
+    videos that are about to be deleted.
+
+    Render cache hits share one stored reel and poster between several videos,
+    so objects still referenced by a video outside this batch are kept.
+
+    Args:
+        videos (list): Video rows being deleted
+
+    Returns:
+        int: Number of stored objects removed
+    """
+    urls = set()
+    for video in videos:
+        path = local_preview_path(video.uuid)
+        if os.path.exists(path):
+            os.remove(path)
+        urls.update(video_urls(video))
+    return _delete_unreferenced(urls, [video.id for video in videos])
+
+
+def video_urls(video):
+    """The reel, poster and thumbnail URLs of a video"""
+    return {url for url in (video.cloudinary_url, video.poster_url, video.thumbnail_url) if url}
+
+
+def release_urls(urls):
+    """
+    Remove reels, posters and thumbnails that a re-render replaced, unless a
+    video still refers to them (render cache hits share them).
+
+    Returns:
+        int: Number of stored objects removed
+    """
+    return _delete_unreferenced(set(urls), [])
+
+
+def _delete_unreferenced(urls, ids):
+    """Delete the local files and stored objects of urls not used by a video outside ids"""
+    from app import db, Video
+    storage = get_storage()
+    columns = (Video.cloudinary_url, Video.poster_url, Video.thumbnail_url)
+    urls = set(urls)
+    urls.discard(None)
+    if not urls:
+        return 0
+    for column in columns:
+        urls -= {url for (url,) in db.session.query(column)
+                 .filter(column.in_(urls), ~Video.id.in_(ids)).distinct()}
+
+    # Reels not uploaded yet, and posters and thumbnails that could not be
+    # stored, are still served locally
+    for url in [url for url in urls if url.startswith(('/reels/', '/static/reels/'))]:
+        path = os.path.join(REELS_DIR, url.rsplit('/reels/', 1)[1])
+        if os.path.exists(path):
+            os.remove(path)
+    urls = {url for url in urls if storage.key_for_url(url)}
+    if not urls:
+        return 0
+    render_cache.forget_urls(urls)
+    try:
+        return storage.delete_many([storage.key_for_url(url) for url in urls])
+    except Exception as e:
+        log.warning("Could not delete stored reels", count=len(urls), error=str(e))
+        return 0
+
+
+def wait_for_uploads(timeout=None):
+    """
+    Finish pending uploads (used on shutdown).
+
+    Uploads not started within timeout seconds are dropped. Their videos keep
+    the local URL, and the reconciler uploads them later.
+
+    Returns:
+        bool: True if every upload finished
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is None:
+        return True
+    executor.shutdown(wait=False)
+    _, not_done = wait(list(_pending), timeout=timeout)
+    if not_done:
+        executor.shutdown(wait=False, cancel_futures=True)
+        log.warning("Uploads unfinished at shutdown, left to the reconciler", count=len(not_done))
+        return False
+    return True
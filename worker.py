@@ -0,0 +1,317 @@
+"""
+Render workers: drain the RenderJob queue.
+
+Run alongside the web process:
+    python worker.py               # supervisor with one worker per CPU core
+    python worker.py --workers 4   # supervisor with 4 workers
+    python worker.py --single      # one worker in this process
+"""
+import os
+import time
+import queue
+import signal
+import socket
+import multiprocessing
+
+from app import app, db, RenderJob, Video
+from job_queue import (claim_next_job, complete_job, fail_job, requeue_stale_jobs,
+                       enqueue_orphaned_videos, JobProgress)
+from generate_process import text_to_speech, create_reel, update_video_status, audio_is_current
+import render_cache
+import tts_cache
+from uploader import reconcile_local_urls, video_urls, release_urls, wait_for_uploads
+from logs import get_logger, flush_logging
+from metrics import RENDER_FAILURES, drop_snapshot
+from profiling import profile_job
+
+POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', 2))
+STALE_CHECK_INTERVAL = 60
+RECONCILE_INTERVAL = int(os.environ.get('RECONCILE_INTERVAL', 300))
+# Number of render processes run by the supervisor; 0 means one per CPU core
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 0))
+STATS_INTERVAL = int(os.environ.get('WORKER_STATS_INTERVAL', 300))
+SUPERVISOR_INTERVAL = 1
+# Seconds a stopping worker waits for its background uploads before exiting
+SHUTDOWN_GRACE = float(os.environ.get('WORKER_SHUTDOWN_GRACE', 25))
+
+log = get_logger(__name__)
+
+
+def _interrupt(signum, frame):
+    # SIGTERM stops workers like Ctrl-C, so uploads are drained on the way out
+    raise KeyboardInterrupt
+
+
+def process_job(job_id, folder, profile=None):
+    """Run the render pipeline for one claimed job"""
+    folder_path = f"user_uploads/{folder}"
+
+    # Check if folder exists and has required files
+    if not os.path.exists(folder_path):
+        log.warning("Upload folder not found, marking as failed", folder=folder, job_id=job_id)
+        RENDER_FAILURES.inc(cause='missing_folder')
+        update_video_status(folder, 'failed')
+        with app.app_context():
+            fail_job(job_id, f"Upload folder {folder_path} not found")
+        return False
+
+    if not os.path.exists(f"{folder_path}/description.txt"):
+        log.warning("description.txt not found, marking as failed", folder=folder, job_id=job_id)
+        RENDER_FAILURES.inc(cause='missing_description')
+        update_video_status(folder, 'failed')
+        with app.app_context():
+            fail_job(job_id, "description.txt not found")
+        return False
+
+    log.info("Processing video", folder=folder, job_id=job_id, profile=profile or 'default')
+    with app.app_context():
+        video = Video.query.filter_by(uuid=folder).first()
+        previous_urls = video_urls(video) if video else set()
+    progress = JobProgress(job_id)
+    try:
+        progress.stage('tts')
+        if audio_is_current(folder):
+            # Re-render after a slide edit or retry: the narration has not changed
+            log.info("Reusing existing audio", folder=folder)
+        else:
+            text_to_speech(folder)  # convert from text to audio
+        with profile_job(folder, job_id):  # sampled when profiling is on (profiling.py)
+            result = create_reel(folder, profile, progress)  # create a reel from the audio and images
+        progress.finish()
+    except Exception as e:
+        log.exception("Exception processing video", folder=folder, job_id=job_id)
+        RENDER_FAILURES.inc(cause='exception')
+        with app.app_context():
+            fail_job(job_id, e, retry=True)
+            job = RenderJob.query.get(job_id)
+            if job and job.status == 'failed':
+                update_video_status(folder, 'failed')
+        return False
+
+    if not result:
+        # create_reel's early returns (no input.txt, missing or invalid images,
+        # no audio) leave the video 'processing'
+        update_video_status(folder, 'failed')
+    with app.app_context():
+        if result:
+            complete_job(job_id)
+            log.info("Completed processing", folder=folder, job_id=job_id)
+            # A re-render has new reel and poster names; drop the old ones unless shared
+            try:
+                release_urls(previous_urls)
+            except Exception as e:
+                log.warning("Could not remove the replaced reel", folder=folder, error=str(e))
+        else:
+            fail_job(job_id, "create_reel failed")
+            log.error("Failed processing", folder=folder, job_id=job_id)
+    return bool(result)
+
+
+def prepare_queue():
+    """One-off queue housekeeping done before any worker starts claiming jobs"""
+    with app.app_context():
+        queued = enqueue_orphaned_videos()
+        if queued:
+            log.info("Queued videos left over from before the job queue", count=queued)
+        requeue_stale_jobs()
+
+
+def run_worker(worker_id=None, stats_queue=None, prepare=True):
+    """
+    Claim and process jobs until interrupted.
+
+    Args:
+        worker_id (str): Name recorded on claimed jobs (defaults to host:pid)
+        stats_queue (multiprocessing.Queue): Where to report throughput when run under the supervisor
+        prepare (bool): Run prepare_queue() first and the upload reconciler periodically
+            (the supervisor does both once for all workers)
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    log.info("Render worker started", worker_id=worker_id)
+
+    if prepare:
+        prepare_queue()
+
+    stats = {'worker_id': worker_id, 'pid': os.getpid(), 'started': time.time(),
+             'completed': 0, 'failed': 0, 'busy_seconds': 0.0}
+    last_stale_check = time.time()
+    last_reconcile = 0
+    while True:
+        if prepare and time.time() - last_reconcile > RECONCILE_INTERVAL:
+            try:
+                reconcile_local_urls()
+            except Exception:
+                log.exception("Upload reconciler failed")
+            last_reconcile = time.time()
+
+        try:
+            with app.app_context():
+                if time.time() - last_stale_check > STALE_CHECK_INTERVAL:
+                    requeue_stale_jobs()
+                    last_stale_check = time.time()
+
+                job = claim_next_job(worker_id)
+                if job is None:
+                    job_id = folder = profile = None
+                else:
+                    job_id, folder, profile = job.id, job.video.uuid, job.encoding_profile
+        except Exception:
+            log.exception("Failed to claim job", worker_id=worker_id)
+            job_id = None
+
+        if job_id is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        job_start = time.time()
+        if process_job(job_id, folder, profile):
+            stats['completed'] += 1
+        else:
+            stats['failed'] += 1
+        stats['busy_seconds'] += time.time() - job_start
+        stats['render_cache'] = render_cache.cache_stats()
+        stats['tts_cache'] = tts_cache.cache_stats()
+        if stats_queue is not None:
+            stats_queue.put(dict(stats))
+
+
+def _worker_main(index, stats_queue):
+    """Entry point of a supervised worker process"""
+    # Never share the parent's pooled database connections across processes
+    with app.app_context():
+        db.engine.dispose()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:w{index}"
+    try:
+        run_worker(worker_id, stats_queue=stats_queue, prepare=False)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)  # the supervisor kills us after the grace period
+        wait_for_uploads(SHUTDOWN_GRACE)
+        # multiprocessing children skip atexit handlers
+        try:
+            drop_snapshot()
+        except Exception:
+            pass
+        flush_logging()
+
+
+def _report_throughput(worker_stats):
+    for index in sorted(worker_stats):
+        stats = worker_stats[index]
+        elapsed = max(time.time() - stats['started'], 1)
+        done = stats['completed'] + stats['failed']
+        per_hour = done * 3600 / elapsed
+        avg = stats['busy_seconds'] / done if done else 0
+        utilization = 100 * stats['busy_seconds'] / elapsed
+        log.info("Worker throughput", worker=index, worker_id=stats['worker_id'],
+                 completed=stats['completed'], failed=stats['failed'], jobs_per_hour=round(per_hour, 1),
+                 avg_seconds=round(avg, 1), busy_percent=round(utilization))
+        cache = stats.get('render_cache')
+        if cache:
+            log.info("Worker render cache", worker=index, hits=cache['hits'], misses=cache['misses'],
+                     hit_rate_percent=round(100 * cache['hit_rate']), evictions=cache['evictions'])
+        cache = stats.get('tts_cache')
+        if cache:
+            log.info("Worker TTS cache", worker=index, hits=cache['hits'], misses=cache['misses'],
+                     hit_rate_percent=round(100 * cache['hit_rate']), evictions=cache['evictions'])
+
+
+def run_supervisor(num_workers=None):
+    """
+    Run num_workers render worker processes (default: one per CPU core),
+    restarting any that exit and periodically logging per-worker throughput.
+    """
+    num_workers = num_workers or RENDER_WORKERS or os.cpu_count() or 1
+    log.info("Starting render supervisor", workers=num_workers)
+    prepare_queue()
+    with app.app_context():
+        db.engine.dispose()
+
+    stats_queue = multiprocessing.Queue()
+    processes = {}
+    restarts = {}
+    worker_stats = {}
+
+    def start(index):
+        process = multiprocessing.Process(target=_worker_main, args=(index, stats_queue),
+                                          name=f"render-worker-{index}")
+        process.start()
+        processes[index] = process
+        log.info("Started render worker", worker=index, pid=process.pid)
+
+    # Inherited by the workers, which finish their uploads when terminated
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    for index in range(num_workers):
+        start(index)
+
+    last_report = time.time()
+    last_reconcile = 0
+    try:
+        while True:
+            # Promote reels stuck on local URLs to the CDN (uploads run in this process)
+            if time.time() - last_reconcile > RECONCILE_INTERVAL:
+                try:
+                    reconcile_local_urls()
+                except Exception:
+                    log.exception("Upload reconciler failed")
+                last_reconcile = time.time()
+
+            try:
+                while True:
+                    stats = stats_queue.get(timeout=SUPERVISOR_INTERVAL)
+                    index = int(stats['worker_id'].rsplit(':w', 1)[1])
+                    worker_stats[index] = stats
+            except queue.Empty:
+                pass
+
+            for index, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                restarts[index] = restarts.get(index, 0) + 1
+                log.warning("Render worker exited, restarting", worker=index, pid=process.pid,
+                            exit_code=process.exitcode, restart=restarts[index])
+                # Crash-looping workers back off instead of spinning
+                time.sleep(min(2 ** min(restarts[index], 5), 30))
+                start(index)
+
+            if time.time() - last_report >= STATS_INTERVAL and worker_stats:
+                _report_throughput(worker_stats)
+                last_report = time.time()
+    except KeyboardInterrupt:
+        log.info("Stopping render workers")
+        for process in processes.values():
+            process.terminate()
+        # Uploads started by the reconciler run in this process
+        wait_for_uploads(SHUTDOWN_GRACE)
+        deadline = time.time() + SHUTDOWN_GRACE + 5
+        for process in processes.values():
+            process.join(timeout=max(deadline - time.time(), 0))
+            if process.is_alive():
+                log.warning("Render worker did not stop, killing it", pid=process.pid)
+                process.kill()
+        if worker_stats:
+            _report_throughput(worker_stats)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="BotAiVids render worker")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of render worker processes (default: RENDER_WORKERS or CPU count)")
+    parser.add_argument('--single', action='store_true',
+                        help="Run a single worker in this process without a supervisor")
+    args = parser.parse_args()
+
+    if args.single:
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            run_worker()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            wait_for_uploads(SHUTDOWN_GRACE)
+    else:
+        run_supervisor(args.workers)